@@ -114,6 +114,14 @@ class Arguments(object):
                            type=int,
                            help=Color.s('number of connects in parallel (per host, default: {G}5{W})'))
 
+        flags.add_argument('--executor',
+                           action='store',
+                           dest='executor',
+                           default='thread',
+                           choices=['thread', 'process'],
+                           help=Color.s('Run rule scanning and git blob parsing in threads or in a process pool '
+                                        '(default: {G}thread{W})'))
+
         flags.add_argument('--create-config',
                            action='store_true',
                            default=False,
@@ -138,6 +146,12 @@ class Arguments(object):
                            dest=f'disable_db',
                            help=Color.s('Disable db inserts/checks'))
 
+        flags.add_argument('--rehash',
+                           action='store_true',
+                           default=False,
+                           dest=f'rehash',
+                           help=Color.s('Ignore the hash cache and read/hash all files again'))
+
         flags.add_argument('-h', '--help',
                            action='help',
                            help=Color.s('show help message and exit'))
@@ -1,5 +1,7 @@
+import asyncio
 import json
 import sys
+import threading
 from argparse import _ArgumentGroup, Namespace
 from typing import Union
 
@@ -8,16 +10,47 @@ from filecrawler.libs.file import File
 from filecrawler._exceptions import IntegrationError
 from filecrawler.config import Configuration
 from filecrawler.crawlerbase import CrawlerBase
+from filecrawler.libs.bulkwriter import BulkWriter
 from filecrawler.libs.color import Color
+from filecrawler.libs.existsbatcher import ExistsBatcher
+from filecrawler.libs.logger import Logger
+from filecrawler.util.tools import Tools
+import elasticsearch
 from elasticsearch import Elasticsearch
 import requests
 import elastic_transport
 
+try:
+    # Async integrator engine, AsyncElasticsearch needs aiohttp
+    import aiohttp
+    from elasticsearch import AsyncElasticsearch
+except ImportError:
+    AsyncElasticsearch = None
+
 requests.packages.urllib3.disable_warnings()
 
 
 class Elastic(CrawlerBase):
     nodes = []
+    bulk_size = 0
+    byte_size = 512 * 1024
+    flush_interval = 2.0
+    http_compress = False
+    exists_batch_size = 100
+    exists_cache_size = 100000
+    number_of_replicas = 1
+    refresh_interval = '1s'
+    bulk_load = False
+    rollover = dict(enabled=False, max_docs=0, max_primary_shard_size='', max_age='', check_interval=60.0)
+    _es = None
+    _async_es = None
+    _exists = None
+    _bulk = None
+    _bulk_error = None
+    _loading = []
+    _rollover_aliases = []
+    _rollover_stop = None
+    _rollover_thread = None
     _CREDS_WHITE_LIST = []
     _CONTROL_KEYS = ["indexing_date", "fingerprint", "filename", "extension",
                       "mime_type", "file_size", "path_virtual", "path_real"]
@@ -35,9 +68,22 @@ class Elastic(CrawlerBase):
         return {
             'elasticsearch': {
                 'nodes': [{'url': 'http://127.0.0.1:9200'}],
-                #'bulk_size': 200,
-                #'byte_size': '500K',
-                #'flush_interval': '2s'
+                'bulk_size': 0,
+                'byte_size': '500K',
+                'flush_interval': '2s',
+                'http_compress': False,
+                'exists_batch_size': 100,
+                'exists_cache_size': 100000,
+                'number_of_replicas': 1,
+                'refresh_interval': '1s',
+                'bulk_load': False,
+                'rollover': {
+                    'enabled': False,
+                    'max_docs': 10000000,
+                    'max_primary_shard_size': '50gb',
+                    'max_age': '',
+                    'check_interval': '60s'
+                }
             }
         }
 
@@ -71,57 +117,98 @@ class Elastic(CrawlerBase):
                 Color.pl('{!} {R}error parsing elastic nodes: {O}%s{W}\r\n' % str(e))
                 sys.exit(1)
 
+            # bulk_size 0 or 1 indexes each file synchronously (default). With a bulk a file is
+            # marked integrated once buffered, the buffer is lost if the crawler is killed
+            try:
+                self.bulk_size = int(elasticsearch.get('bulk_size', self.bulk_size))
+                self.byte_size = BulkWriter.parse_size(elasticsearch.get('byte_size', self.byte_size))
+                self.flush_interval = BulkWriter.parse_interval(
+                    elasticsearch.get('flush_interval', self.flush_interval))
+                self.http_compress = Tools.to_boolean(elasticsearch.get('http_compress', self.http_compress))
+                self.exists_batch_size = max(1, int(elasticsearch.get('exists_batch_size', self.exists_batch_size)))
+                self.exists_cache_size = max(0, int(elasticsearch.get('exists_cache_size', self.exists_cache_size)))
+            except Exception as e:
+                Color.pl('{!} {R}error parsing elastic bulk options: {O}%s{W}\r\n' % str(e))
+                sys.exit(1)
+
+            # bulk_load: no replicas and no refresh during the crawl, the values above are restored at the end
+            try:
+                self.number_of_replicas = max(0, int(elasticsearch.get('number_of_replicas', self.number_of_replicas)))
+                self.refresh_interval = str(elasticsearch.get('refresh_interval', self.refresh_interval) or '1s')
+                self.bulk_load = Tools.to_boolean(elasticsearch.get('bulk_load', self.bulk_load))
+
+                rollover = elasticsearch.get('rollover', None) or {}
+                self.rollover = dict(
+                    enabled=Tools.to_boolean(rollover.get('enabled', False)),
+                    max_docs=max(0, int(rollover.get('max_docs', 0) or 0)),
+                    max_primary_shard_size=str(rollover.get('max_primary_shard_size', '') or '').strip(),
+                    max_age=str(rollover.get('max_age', '') or '').strip(),
+                    check_interval=max(1.0, BulkWriter.parse_interval(rollover.get('check_interval', '60s'))),
+                )
+            except Exception as e:
+                Color.pl('{!} {R}error parsing elastic index options: {O}%s{W}\r\n' % str(e))
+                sys.exit(1)
+
+            if self.rollover['enabled'] and len(self.get_rollover_conditions()) == 0:
+                Color.pl('{!} {R}error: elastic rollover needs at least one of: '
+                         '{G}max_docs, max_primary_shard_size, max_age{W}\r\n')
+                sys.exit(1)
+
         if self.nodes is None or len(self.nodes) == 0:
             Color.pl('{!} {R}error: invalid elasticsearch nodes. Check configuration file.{W}\r\n')
             sys.exit(1)
 
         return True
 
+    def get_connections(self) -> int:
+        '''
+        Threads that may call elasticsearch at the same time: the fingerprint (must_index) and
+        integrate stages, the integrator and the bulk flush timer
+        '''
+        cfg = Configuration.autoscale
+        stages = [Configuration.get_stage_tasks(name) for name in ('fingerprint', 'integrate')]
+        integrator = Configuration.tasks_integrator
+        if cfg['enabled']:
+            stages = [max(cfg['max_tasks'], tasks) for tasks in stages]
+            integrator = max(cfg['integrator_max_tasks'], integrator)
+
+        return sum(stages) + integrator + 1
+
     def pre_run(self, **data):
-        es = Elasticsearch(self.nodes)
-        if not es.indices.exists(index=Configuration.index_name):
-            request_body = {
-                "settings": {
-                    "number_of_replicas": 1,
-                    "index": {"highlight.max_analyzed_offset": 10000000}
-                },
-
-                'mappings': {
-                    'properties': {
-                        'indexing_date': {'type': 'date'},
-                        'created': {'type': 'date'},
-                        'last_accessed': {'type': 'date'},
-                        'last_modified': {'type': 'date'},
-                        'fingerprint': {'type': 'keyword'},
-                        'filename': {'type': 'text'},
-                        'extension': {'type': 'keyword'},
-                        'mime_type': {'type': 'keyword'},
-                        'file_size': {'type': 'long'},
-                        'path_virtual': {'type': 'text'},
-                        'path_real': {'type': 'text'},
-                        'content': {'type': 'text'},
-                        'filtered_content': {'type': 'text'},
-                        'metadata': {'type': 'text'},
-                        'has_credential': {'type': 'boolean'},
-                        'parser': {'type': 'keyword'},
-                        'object_content': {'type': 'text'},
-                        'info': {'type': 'text'},
-                        'credentials': {'type': 'flattened'},
-                    }
-                }
+        # One client (and connection pool, keep-alive) for every thread, closed by post_run
+        connections = self.get_connections()
+        self._es = Elasticsearch(self.nodes, request_timeout=30, max_retries=10, retry_on_timeout=True,
+                                 connections_per_node=connections, http_compress=self.http_compress)
+        Logger.pl('{+} {C}elasticsearch client: {O}%s{C} connections per node, compression {O}%s{W}' % (
+            connections, 'on' if self.http_compress else 'off'))
+
+        self._rollover_aliases = []
+
+        self.create_index(Configuration.index_name, {
+            'properties': {
+                'indexing_date': {'type': 'date'},
+                'created': {'type': 'date'},
+                'last_accessed': {'type': 'date'},
+                'last_modified': {'type': 'date'},
+                'fingerprint': {'type': 'keyword'},
+                'filename': {'type': 'text'},
+                'extension': {'type': 'keyword'},
+                'mime_type': {'type': 'keyword'},
+                'file_size': {'type': 'long'},
+                'path_virtual': {'type': 'text'},
+                'path_real': {'type': 'text'},
+                'content': {'type': 'text'},
+                'filtered_content': {'type': 'text'},
+                'metadata': {'type': 'text'},
+                'has_credential': {'type': 'boolean'},
+                'parser': {'type': 'keyword'},
+                'object_content': {'type': 'text'},
+                'info': {'type': 'text'},
+                'credentials': {'type': 'flattened'},
             }
-
-            es.indices.create(
-                index=Configuration.index_name,
-                body=request_body
-            )
+        }, rollover=self.rollover['enabled'])
 
         request_body = {
-            "settings": {
-                "number_of_replicas": 1,
-                "index": {"highlight.max_analyzed_offset": 10000000}
-            },
-
             'mappings': {
                 'properties': {
                     'indexing_date': {'type': 'date'},
@@ -152,37 +239,177 @@ class Elastic(CrawlerBase):
             for f, _ in request_body['mappings']['properties'].items()
         ]
 
-        if not es.indices.exists(index=Configuration.index_name + '_credentials'):
-            es.indices.create(
-                index=Configuration.index_name + '_credentials',
-                body=request_body
-            )
-
-        if not es.indices.exists(index='.ctrl_' + Configuration.index_name):
-            request_body = {
-                "settings": {
-                    "number_of_replicas": 1,
-                    "index": {"highlight.max_analyzed_offset": 10000000}
-                },
-
-                'mappings': {
-                    'properties': {
-                        'indexing_date': {'type': 'date'},
-                        'fingerprint': {'type': 'keyword'},
-                        'filename': {'type': 'text'},
-                        'extension': {'type': 'keyword'},
-                        'mime_type': {'type': 'keyword'},
-                        'file_size': {'type': 'long'},
-                        'path_virtual': {'type': 'text'},
-                        'path_real': {'type': 'text'},
-                    }
-                }
+        self.create_index(Configuration.index_name + '_credentials', request_body['mappings'],
+                          rollover=self.rollover['enabled'])
+
+        if self.bulk_size > 1:
+            self._bulk = BulkWriter(lambda operations: self._es.bulk(operations=operations, request_timeout=60),
+                                    bulk_size=self.bulk_size,
+                                    byte_size=self.byte_size,
+                                    flush_interval=self.flush_interval)
+            self._bulk.start()
+            Logger.pl('{+} {C}elasticsearch bulk mode: {O}%s{C} files, {O}%s{C} bytes or {O}%s{C}s{W}' % (
+                self.bulk_size, self.byte_size, self.flush_interval))
+
+        # Single index: the existence checks get its documents by id
+        self.create_index('.ctrl_' + Configuration.index_name, {
+            'properties': {
+                'indexing_date': {'type': 'date'},
+                'fingerprint': {'type': 'keyword'},
+                'filename': {'type': 'text'},
+                'extension': {'type': 'keyword'},
+                'mime_type': {'type': 'keyword'},
+                'file_size': {'type': 'long'},
+                'path_virtual': {'type': 'text'},
+                'path_real': {'type': 'text'},
             }
+        })
+
+        # The existence checks of every thread are grouped in _mget requests to the control index
+        self._exists = ExistsBatcher(self.lookup_ids,
+                                     batch_size=self.exists_batch_size,
+                                     cache_size=self.exists_cache_size)
+        self.seed_exists()
+
+        if self.bulk_load:
+            self.start_bulk_load()
+
+        if len(self._rollover_aliases) > 0:
+            self._rollover_stop = threading.Event()
+            self._rollover_thread = threading.Thread(target=self._rollover_run)
+            self._rollover_thread.daemon = True
+            self._rollover_thread.start()
+            Logger.pl('{+} {C}elasticsearch rollover: {O}%s{C} checked every {O}%s{C}s{W}' % (
+                ', '.join(self._rollover_aliases), self.rollover['check_interval']))
+
+    def get_index_settings(self, loading: bool = False) -> dict:
+        '''
+        Settings changed by the bulk-load profile: while loading there is no replica to write
+        and no refresh, the configured values are restored at the end
+        '''
+        if loading:
+            return {'number_of_replicas': 0, 'refresh_interval': '-1'}
+
+        return {'number_of_replicas': self.number_of_replicas, 'refresh_interval': self.refresh_interval}
+
+    def create_index(self, name: str, mappings: dict, rollover: bool = False):
+        '''
+        Create the index if it does not exist. With rollover, name is a write alias of the
+        backing indices name-000001, name-000002... created from an index template
+        '''
+        settings = {
+            **self.get_index_settings(loading=self.bulk_load),
+            'index': {'highlight.max_analyzed_offset': 10000000}
+        }
 
-            es.indices.create(
-                index='.ctrl_' + Configuration.index_name,
-                body=request_body
-            )
+        if not rollover:
+            if not self._es.indices.exists(index=name):
+                self._es.indices.create(index=name, settings=settings, mappings=mappings)
+            return
+
+        # Backing indices created later by the rollover get the configured settings from the template
+        self._es.indices.put_index_template(name=name + '_template', index_patterns=[name + '-*'], priority=200,
+                                            template={
+                                                'settings': {
+                                                    **self.get_index_settings(),
+                                                    'index': {'highlight.max_analyzed_offset': 10000000}
+                                                },
+                                                'mappings': mappings
+                                            })
+
+        if not self._es.indices.exists_alias(name=name):
+            if self._es.indices.exists(index=name):
+                Logger.pl('{!} {O}elasticsearch index {G}%s{O} was created without rollover, '
+                          'it is kept as a single index{W}' % name)
+                return
+
+            self._es.indices.create(index=name + '-000001', settings=settings,
+                                    aliases={name: {'is_write_index': True}})
+
+        self._rollover_aliases.append(name)
+
+    def get_rollover_conditions(self) -> dict:
+        return {
+            k: self.rollover[k]
+            for k in ('max_docs', 'max_primary_shard_size', 'max_age')
+            if self.rollover.get(k, None)
+        }
+
+    def rollover_indices(self):
+        '''
+        Move each write alias to a new backing index when a rollover condition is met
+        '''
+        for alias in self._rollover_aliases:
+            try:
+                res = self._es.indices.rollover(alias=alias, conditions=self.get_rollover_conditions(),
+                                                settings=self.get_index_settings(loading=True)
+                                                if self.bulk_load else None)
+                if res.get('rolled_over', False):
+                    Logger.pl('{+} {C}elasticsearch rollover: {O}%s{C} to {O}%s{W}' % (
+                        res.get('old_index'), res.get('new_index')))
+            except (elastic_transport.TransportError, elasticsearch.ApiError) as e:
+                Logger.pl('{!} {O}elasticsearch rollover of {G}%s{O} failed: %s{W}' % (alias, str(e)))
+
+    def start_bulk_load(self):
+        self._loading = [
+            Configuration.index_name,
+            Configuration.index_name + '_credentials',
+            '.ctrl_' + Configuration.index_name
+        ]
+        self._es.indices.put_settings(index=self._loading, settings=self.get_index_settings(loading=True))
+        Logger.pl('{+} {C}elasticsearch bulk load: replicas {O}0{C} and refresh {O}off{C} until the end{W}')
+
+    def finish_bulk_load(self):
+        '''
+        Restore the configured replicas and refresh interval (an alias updates every backing
+        index) and refresh, so that the documents loaded are searchable
+        '''
+        if len(self._loading) == 0:
+            return
+
+        try:
+            self._es.indices.put_settings(index=self._loading, settings=self.get_index_settings())
+            self._es.indices.refresh(index=self._loading)
+            Logger.pl('{+} {C}elasticsearch bulk load finished: replicas {O}%s{C}, refresh {O}%s{W}' % (
+                self.number_of_replicas, self.refresh_interval))
+        except (elastic_transport.TransportError, elasticsearch.ApiError) as e:
+            Logger.pl('{!} {R}error restoring elasticsearch settings of {G}%s{R}: %s{W}' % (
+                ', '.join(self._loading), str(e)))
+            Logger.pl('{!} {O}set {G}number_of_replicas: %s{O} and {G}refresh_interval: %s{O} by hand{W}' % (
+                self.number_of_replicas, self.refresh_interval))
+
+        self._loading = []
+
+    def _rollover_run(self):
+        while not self._rollover_stop.wait(self.rollover['check_interval']):
+            self.rollover_indices()
+
+    def lookup_ids(self, ids: list) -> list:
+        '''
+        Ids with a control document: written last, the file and its credentials are indexed
+        '''
+        res = self._es.mget(index='.ctrl_' + Configuration.index_name, ids=ids, source=False)
+        return [d['_id'] for d in res.get('docs', []) if d.get('found', False) is True]
+
+    def seed_exists(self):
+        '''
+        Cache the ids last indexed, likely the ones of a crawl being resumed
+        '''
+        size = min(self.exists_cache_size, 10000)
+        if size == 0:
+            return
+
+        try:
+            res = self._es.search(index='.ctrl_' + Configuration.index_name, size=size, source=False,
+                                  sort=[{'indexing_date': {'order': 'desc', 'unmapped_type': 'date'}}],
+                                  query={'match_all': {}})
+            self._exists.seed(h['_id'] for h in res.get('hits', {}).get('hits', []))
+        except (elastic_transport.TransportError, elasticsearch.ApiError) as e:
+            Logger.pl('{!} {O}elasticsearch exists cache not seeded: %s{W}' % str(e))
+            return
+
+        Logger.pl('{+} {C}elasticsearch exists cache: {O}%s{C} ids seeded, checks in groups of {O}%s{W}' % (
+            self._exists.cache_count, self.exists_batch_size))
 
     def must_index(self, file: Union[File, str]) -> bool:
         try:
@@ -195,80 +422,156 @@ class Elastic(CrawlerBase):
             else:
                 return True
 
-            with(Elasticsearch(self.nodes, timeout=30, max_retries=10, retry_on_timeout=True)) as es:
-                res = es.exists(index=Configuration.index_name, id=id)
-                if res is True:
-                    return False
-
-            return True
-        except (elastic_transport.ConnectionError, requests.exceptions.ConnectionError) as e:
+            # Not short-circuited by the fingerprint filter: it only knows this database, the
+            # index may already hold the document (another database, a wiped one)
+            return not self._exists.exists(id)
+        except (elastic_transport.TransportError, elasticsearch.ApiError,
+                requests.exceptions.ConnectionError) as e:
             return True
 
+    def flush_integration(self):
+        if self._bulk is not None:
+            self._bulk.flush()
+            self._bulk.wait()
+
+    def post_run(self):
+        if self._bulk is not None:
+            self._bulk.close()
+            if Configuration.verbose >= 1:
+                Logger.pl('{?} {C}elasticsearch bulk: {O}%s{C} files in {O}%s{C} requests, {O}%s{C} failed{W}' % (
+                    self._bulk.sent, self._bulk.requests, self._bulk.failed))
+            self._bulk = None
+
+        if self._rollover_thread is not None:
+            self._rollover_stop.set()
+            self._rollover_thread.join()
+            self._rollover_thread = None
+
+        # Also when the crawl was interrupted: the indices must not stay without refresh and replicas
+        if self._es is not None:
+            self.finish_bulk_load()
+
+        if self._exists is not None:
+            self._exists.close()
+            if Configuration.verbose >= 1:
+                Logger.pl('{?} {C}elasticsearch exists: {O}%s{C} checks, {O}%s{C} cache hits, '
+                          '{O}%s{C} _mget requests{W}' % (
+                            self._exists.checks, self._exists.cache_hits, self._exists.lookups))
+            self._exists = None
+
+        if self._es is not None:
+            self._es.close()
+            self._es = None
+
+    def get_actions(self, data: dict) -> list:
+        '''
+        Documents of a file: the file itself, its credentials and the control document
+        '''
+        id = data['fingerprint']
+        if Configuration.filename_as_id:
+            id = data['path_virtual']
+
+        actions = [(Configuration.index_name, id, {**data, 'credentials': None})]
+
+        # Index only credentials
+        findings = CrawlerBase.get_credentials_data(data)
+
+        for k, f in findings.items():
+            try:
+                j_data = json.loads(f.get('content', '{}'))
+                if isinstance(j_data, dict):
+                    f.update({
+                        k1: v1
+                        for k1, v1 in j_data.items()
+                        if k1.lower() in Elastic._CREDS_WHITE_LIST
+                    })
+            except:
+                pass
+
+            try:
+                # Filter just the first 50 lines
+                ff = f.get('filtered_file', None)
+                if ff is not None:
+                    f['filtered_file'] = '\n'.join(ff.split('\n')[0:50])
+            except:
+                pass
+
+            actions.append((Configuration.index_name + '_credentials', k, f))
+
+        actions.append(('.ctrl_' + Configuration.index_name, id, {
+            k: v
+            for k, v in data.items()
+            if k.lower() in Elastic._CONTROL_KEYS
+        }))
+
+        return actions
+
     def integrate(self, **data):
-        try:
+        if self._bulk is not None:
+            if self._bulk_error is not None:
+                raise Exception(f'Cannot insert elasticsearch data: {self._bulk_error}')
 
-            id = data['fingerprint']
-            if Configuration.filename_as_id:
-                id = data['path_virtual']
-
-            creds = data.get('credentials', None)
-            data['credentials'] = None
-
-            with(Elasticsearch(self.nodes, timeout=30, max_retries=10, retry_on_timeout=True)) as es:
-                res = es.index(index=Configuration.index_name, id=id, document=data)
-                if res is None or res.get('_shards', {}).get('successful', 0) == 0:
-                    if not Configuration.continue_on_error:
-                        raise Exception(f'Cannot insert elasticsearch data: {res}')
-
-                #if res.get('result', '') != 'created':
-                #    Logger.pl(res)
-
-                data['credentials'] = creds
-
-                # Index only credentials
-                findings = CrawlerBase.get_credentials_data(data)
-
-                for k, f in findings.items():
-                    try:
-                        j_data = json.loads(f.get('content', '{}'))
-                        if isinstance(j_data, dict):
-                            f.update({
-                                k1: v1
-                                for k1, v1 in j_data.items()
-                                if k1.lower() in Elastic._CREDS_WHITE_LIST
-                            })
-                    except:
-                        pass
-
-                    try:
-                        # Filter just the first 50 lines
-                        ff = f.get('filtered_file', None)
-                        if ff is not None:
-                            f['filtered_file'] = '\n'.join(ff.split('\n')[0:50])
-                    except:
-                        pass
-
-                    res = es.index(index=Configuration.index_name + '_credentials', id=k, document=f)
-                    if res is None or res.get('_shards', {}).get('successful', 0) == 0:
-                        if not Configuration.continue_on_error:
-                            raise Exception(f'Cannot insert elasticsearch data: {res}')
-
-                es.index(index='.ctrl_' + Configuration.index_name, id=id, document={
-                    k: v
-                    for k, v in data.items()
-                    if k.lower() in Elastic._CONTROL_KEYS
-                })
+            self._bulk.add(
+                [({'index': {'_index': index, '_id': id}}, document) for index, id, document in self.get_actions(data)],
+                callback=lambda ok, retry, error: self.bulk_callback(data, ok, retry, error)
+            )
+            return
+
+        try:
+            for index, id, document in self.get_actions(data):
+                res = self._es.index(index=index, id=id, document=document)
+                self.check_index_result(index, id, res)
 
         except (elastic_transport.ConnectionError, requests.exceptions.ConnectionError) as e:
             raise IntegrationError(e)
 
+    async def integrate_async(self, engine, **data):
+        # Bulk mode already groups the requests, and sends them from a blocking call
+        if self._bulk is not None or AsyncElasticsearch is None:
+            return await super().integrate_async(engine, **data)
 
+        if self._async_es is None:
+            self._async_es = AsyncElasticsearch(self.nodes, request_timeout=30, max_retries=10,
+                                                retry_on_timeout=True,
+                                                connections_per_node=Configuration.integrator['max_in_flight'],
+                                                http_compress=self.http_compress)
 
+        async def index_one(index: str, id: str, document: dict):
+            async with engine.limit(index):
+                res = await self._async_es.index(index=index, id=id, document=document)
+            self.check_index_result(index, id, res)
 
+        try:
+            actions = self.get_actions(data)
+
+            # The control document is the last one, it tells the file is completely indexed
+            await asyncio.gather(*[index_one(*a) for a in actions[:-1]])
+            await index_one(*actions[-1])
 
+        except (elastic_transport.ConnectionError, aiohttp.ClientError) as e:
+            raise IntegrationError(e)
 
+    async def close_async(self):
+        if self._async_es is not None:
+            await self._async_es.close()
+            self._async_es = None
 
+    def check_index_result(self, index: str, id: str, res):
+        if index == '.ctrl_' + Configuration.index_name:
+            self._exists.add(id)
+            return
 
+        if res is None or res.get('_shards', {}).get('successful', 0) == 0:
+            if not Configuration.continue_on_error:
+                raise Exception(f'Cannot insert elasticsearch data: {res}')
 
+    def bulk_callback(self, data: dict, ok: bool, retry: bool, error: Exception):
+        if ok:
+            self._exists.add(data['path_virtual'] if Configuration.filename_as_id else data['fingerprint'])
+            return
 
+        if not retry and not Configuration.continue_on_error:
+            # Next integrations fail, so the integrator stops as in the synchronous mode
+            self._bulk_error = error
 
+        self.integration_failed(data, retry, error)
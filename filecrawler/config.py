@@ -13,6 +13,8 @@ from .libs.crawlerdb import CrawlerDB
 from .parserbase import ParserBase
 from .rulebase import RuleBase
 from filecrawler.libs.color import Color
+from filecrawler.libs.excludematcher import ExcludeMatcher
+from filecrawler.libs.payload import Payload
 from filecrawler.libs.logger import Logger
 from .__meta__ import __version__, __description__
 from .util.tools import Tools
@@ -37,10 +39,30 @@ class Configuration(object):
     company = []
     tasks = 5
     tasks_integrator = 2
+    executor = 'thread'
+    processes = os.cpu_count() or 1
     evidences_path = './evidences'
     disable_rules = False
     is_tty = False
     disable_db = False
+    rehash = False
+    db_profile = 'balanced'
+    db_batch_size = 500
+    db_flush_interval = 0.2
+    db_payload_compression = 'zlib'
+    db_payload_level = None
+    fingerprint_filter = {
+        'enabled': True,
+        'false_positive_rate': 0.001,
+    }
+    integrator = {
+        'batch_size': 100,
+        'lease_timeout': 300,
+        'retry_delay': 5,
+        'engine': 'thread',
+        'max_in_flight': 256,
+        'per_destination': 64,
+    }
 
     public_domains = [
         "hotmail.com", "gmail.com", 'yahoo.com', 'outlook.com', 'terra.com', 'uol.com', 'ibest.com', 'ig.com.br'
@@ -62,6 +84,7 @@ class Configuration(object):
         "hotmail.com", "gmail.com", 'yahoo.com', 'outlook.com', 'terra.com', 'uol.com', 'ibest.com', 'ig.com.br'
         'bol.com'
     ]
+    exclude_matcher = None
     json_support = False
     filename_as_id = False
     add_filesize = True
@@ -87,6 +110,29 @@ class Configuration(object):
     ocr_enabled = True
     ocr_pdf_strategy = 'ocr_and_text'
     follow_symlinks = True
+    keyword_window_scan = False
+
+    # Adaptive pool sizes, the pools start with the configured tasks
+    autoscale = {
+        'enabled': False,
+        'interval': 2,
+        'min_tasks': 1,
+        'max_tasks': 32,
+        'integrator_max_tasks': 16,
+        'cpu_high': 0.9,
+    }
+
+    # Crawl pipeline stages, in order. tasks 0 means the number of worker tasks (-T), queue_size 0
+    # means a few items per stage thread: items after parse hold the file content, big queues
+    # multiply it (fingerprint items are just paths and stats)
+    pipeline_stages = {
+        'fingerprint': {'tasks': 0, 'queue_size': 1000},
+        'parse': {'tasks': 0, 'queue_size': 0},
+        'rules': {'tasks': 0, 'queue_size': 0},
+        'evidence': {'tasks': 2, 'queue_size': 0},
+        'integrate': {'tasks': 0, 'queue_size': 0},
+    }
+    _QUEUE_PER_TASK = 4
 
     @staticmethod
     def initialize():
@@ -205,6 +251,8 @@ class Configuration(object):
         Configuration.disable_rules = args.args.disable_rules
         Configuration.is_tty = os.isatty(sys.__stdout__.fileno())
         Configuration.disable_db = args.args.disable_db
+        Configuration.rehash = args.args.rehash
+        Configuration.executor = args.args.executor
 
         Color.pl('{+} {W}Startup parameters')
         Logger.pl('     {C}command line:{O} %s{W}' % Configuration.cmd_line)
@@ -212,14 +260,16 @@ class Configuration(object):
         Logger.pl('     {C}java version:{O} %s{W}' % java_ver)
         Logger.pl('     {C}worker tasks:{O} %s{W}' % Configuration.tasks)
         Logger.pl('     {C}integrator tasks:{O} %s{W}' % Configuration.tasks_integrator)
+        Logger.pl('     {C}executor:{O} %s{W}' % (
+            Configuration.executor if Configuration.executor != 'process'
+            else f'process ({Configuration.processes} processes)'))
         Logger.pl('     {C}leak rules:{O} %s{W}' % ("Enabled" if not Configuration.disable_rules else "Disabled"))
         Logger.pl('     {C}is a tty:{O} %s{W}' % Configuration.is_tty)
+        Logger.pl('     {C}hash cache:{O} %s{W}' % ("Enabled" if not Configuration.rehash else "Disabled (rehash)"))
 
         if Configuration.verbose > 0:
             Logger.pl('     {C}verbosity level:{O} %s{W}' % Configuration.verbose)
 
-        Configuration.tasks = 5
-
         Logger.pl('     {C}module:{O} %s{W}' % module.name)
 
         if args.args.index_name is not None and args.args.index_name.strip(' .,') != '':
@@ -296,6 +346,75 @@ class Configuration(object):
                     Configuration.git_support = general.get('git_support', Configuration.git_support)
                     Configuration.extract_files = general.get('extract_files', Configuration.extract_files)
                     Configuration.index_empty_files = general.get('index_empty_files', Configuration.index_empty_files)
+                    Configuration.keyword_window_scan = Tools.to_boolean(general.get('keyword_window_scan', Configuration.keyword_window_scan))
+
+                    database = general.get('database', None) or {}
+                    Configuration.db_profile = str(database.get('profile', Configuration.db_profile)).lower()
+                    Configuration.db_batch_size = max(1, int(database.get('batch_size', Configuration.db_batch_size)))
+                    Configuration.db_flush_interval = max(0.0, float(database.get('flush_interval', Configuration.db_flush_interval)))
+                    if Configuration.db_profile not in CrawlerDB.PROFILES:
+                        Color.pl('{!} {R}error: invalid database profile {G}%s{R}, use one of: {G}%s{W}\r\n' % (
+                            Configuration.db_profile, ', '.join(CrawlerDB.PROFILES.keys())))
+                        sys.exit(1)
+
+                    Configuration.db_payload_compression = str(database.get(
+                        'payload_compression', Configuration.db_payload_compression)).lower()
+                    Configuration.db_payload_level = database.get('payload_level', Configuration.db_payload_level)
+                    try:
+                        Payload.setup(Configuration.db_payload_compression, Configuration.db_payload_level)
+                    except Exception as e:
+                        Color.pl('{!} {R}error: %s{W}\r\n' % str(e))
+                        sys.exit(1)
+
+                    fingerprint_filter = general.get('fingerprint_filter', None) or {}
+                    Configuration.fingerprint_filter = dict(
+                        enabled=Tools.to_boolean(fingerprint_filter.get(
+                            'enabled', Configuration.fingerprint_filter['enabled'])),
+                        false_positive_rate=min(0.5, max(0.0000001, float(fingerprint_filter.get(
+                            'false_positive_rate', Configuration.fingerprint_filter['false_positive_rate'])))),
+                    )
+
+                    integrator = general.get('integrator', None) or {}
+                    Configuration.integrator = dict(
+                        batch_size=max(1, int(integrator.get('batch_size', Configuration.integrator['batch_size']))),
+                        lease_timeout=max(10.0, float(integrator.get(
+                            'lease_timeout', Configuration.integrator['lease_timeout']))),
+                        retry_delay=max(0.5, float(integrator.get(
+                            'retry_delay', Configuration.integrator['retry_delay']))),
+                        engine=str(integrator.get('engine', Configuration.integrator['engine'])).lower(),
+                        max_in_flight=max(1, int(integrator.get(
+                            'max_in_flight', Configuration.integrator['max_in_flight']))),
+                        per_destination=max(1, int(integrator.get(
+                            'per_destination', Configuration.integrator['per_destination']))),
+                    )
+                    if Configuration.integrator['engine'] not in ('thread', 'async'):
+                        Color.pl('{!} {R}error: invalid integrator engine {G}%s{R}, use one of: {G}thread, async{W}\r\n' %
+                                 Configuration.integrator['engine'])
+                        sys.exit(1)
+
+                    autoscale = general.get('autoscale', None) or {}
+                    Configuration.autoscale = dict(
+                        enabled=Tools.to_boolean(autoscale.get('enabled', Configuration.autoscale['enabled'])),
+                        interval=max(0.5, float(autoscale.get('interval', Configuration.autoscale['interval']))),
+                        min_tasks=max(1, int(autoscale.get('min_tasks', Configuration.autoscale['min_tasks']))),
+                        max_tasks=min(100, int(autoscale.get('max_tasks', Configuration.autoscale['max_tasks']))),
+                        integrator_max_tasks=min(50, int(autoscale.get(
+                            'integrator_max_tasks', Configuration.autoscale['integrator_max_tasks']))),
+                        cpu_high=float(autoscale.get('cpu_high', Configuration.autoscale['cpu_high'])),
+                    )
+                    if Configuration.autoscale['min_tasks'] > min(Configuration.autoscale['max_tasks'],
+                                                                  Configuration.autoscale['integrator_max_tasks']):
+                        Color.pl('{!} {R}error: autoscale {G}min_tasks{R} ({O}%s{R}) is greater than '
+                                 '{G}max_tasks{R} ({O}%s{R}) or {G}integrator_max_tasks{R} ({O}%s{R}){W}\r\n' % (
+                                    Configuration.autoscale['min_tasks'], Configuration.autoscale['max_tasks'],
+                                    Configuration.autoscale['integrator_max_tasks']))
+                        sys.exit(1)
+
+                    pipeline = general.get('pipeline', None) or {}
+                    for name, stage in Configuration.pipeline_stages.items():
+                        cfg = pipeline.get(name, None) or {}
+                        stage['tasks'] = max(0, int(cfg.get('tasks', stage['tasks'])))
+                        stage['queue_size'] = max(0, int(cfg.get('queue_size', stage['queue_size'])))
 
                     # Lowercase
                     Configuration.excludes = [
@@ -329,10 +448,10 @@ class Configuration(object):
                 Color.pl('{!} {R}error: could not open {G}%s{W}\r\n' % Configuration.config_file)
                 sys.exit(1)
 
-        excluded = next((
-            x for x in Configuration.excludes
-            if Path(Configuration.path.lower()).match(x)
-        ), None)
+        # Compile the exclude list once, it is checked for every file and directory
+        Configuration.exclude_matcher = ExcludeMatcher(Configuration.excludes)
+
+        excluded = Configuration.exclude_matcher.get_match(Configuration.path)
 
         if excluded is not None:
             Color.pl('{!} {R}error: the path {G}%s{R} is excluded by {G}%s{W}\r\n' % (Configuration.path, excluded))
@@ -384,9 +503,17 @@ class Configuration(object):
 
         Logger.pl('     {C}database file:{O} %s{W}' % Configuration.db_name)
 
+        CrawlerDB.profile = Configuration.db_profile
+        Logger.pl('     {C}database profile:{O} %s{W}' % Configuration.db_profile)
+        Logger.pl('     {C}payload compression:{O} %s (level %s){W}' % (Payload.codec, Payload.level))
+
         try:
             with(CrawlerDB(auto_create=True, db_name=Configuration.db_name)) as db:
-                pass
+                db.upgrade_db()
+                status = db.migrate_payloads()
+                if status['cleared'] + status['migrated'] + status['failed'] > 0:
+                    Logger.pl('     {C}payload migration:{O} %s pending rows compressed, %s integrated rows '
+                              'cleared, %s failed{W}' % (status['migrated'], status['cleared'], status['failed']))
         except sqlite3.OperationalError as e:
             Logger.pl(
                 '{!} {R}error: the database file exists but is not an SQLite or table structure was not created.{W}\r\n')
@@ -394,6 +521,11 @@ class Configuration(object):
         except Exception as e:
             raise e
 
+        if Configuration.autoscale['enabled']:
+            Logger.pl('     {C}autoscale:{O} %s to %s tasks (integrator up to %s), every %ss{W}' % (
+                Configuration.autoscale['min_tasks'], Configuration.autoscale['max_tasks'],
+                Configuration.autoscale['integrator_max_tasks'], Configuration.autoscale['interval']))
+
         Logger.pl('     {C}evidences path:{O} %s{W}' % Configuration.evidences_path)
 
         Logger.pl('     {C}index path:{O} %s{W}' % Configuration.path)
@@ -416,6 +548,33 @@ class Configuration(object):
 
         Logger.pl('  ')
 
+    @staticmethod
+    def get_exclude_matcher() -> ExcludeMatcher:
+        if Configuration.exclude_matcher is None:
+            Configuration.exclude_matcher = ExcludeMatcher(Configuration.excludes)
+
+        return Configuration.exclude_matcher
+
+    @staticmethod
+    def get_stage_tasks(name: str) -> int:
+        tasks = Configuration.pipeline_stages.get(name, {}).get('tasks', 0)
+        if tasks <= 0:
+            tasks = Configuration.tasks
+
+            # Enough threads to keep every process busy
+            if Configuration.executor == 'process' and name in ('parse', 'rules'):
+                tasks = max(tasks, Configuration.processes)
+
+        return min(max(1, tasks), 100)
+
+    @staticmethod
+    def get_stage_queue_size(name: str) -> int:
+        queue_size = Configuration.pipeline_stages.get(name, {}).get('queue_size', 0)
+        if queue_size <= 0:
+            queue_size = Configuration._QUEUE_PER_TASK * Configuration.get_stage_tasks(name)
+
+        return queue_size
+
     @staticmethod
     def print_config():
         with open(Configuration.config_file, 'r') as f:
@@ -470,7 +629,21 @@ class Configuration(object):
                     'enabled': Configuration.ocr_enabled,
                     'pdf_strategy': Configuration.ocr_pdf_strategy,
                 },
-                'follow_symlinks': Configuration.follow_symlinks
+                'follow_symlinks': Configuration.follow_symlinks,
+                'keyword_window_scan': Configuration.keyword_window_scan,
+                'database': {
+                    'profile': Configuration.db_profile,
+                    'batch_size': Configuration.db_batch_size,
+                    'flush_interval': Configuration.db_flush_interval,
+                    'payload_compression': Configuration.db_payload_compression,
+                },
+                'fingerprint_filter': dict(**Configuration.fingerprint_filter),
+                'integrator': dict(**Configuration.integrator),
+                'autoscale': dict(**Configuration.autoscale),
+                'pipeline': {
+                    name: dict(**stage)
+                    for name, stage in Configuration.pipeline_stages.items()
+                }
             }
         }
 
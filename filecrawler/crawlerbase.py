@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import json
 import os
@@ -11,7 +12,7 @@ import pkgutil
 import random
 import string
 from argparse import _ArgumentGroup, ArgumentParser, Namespace
-from typing import Union
+from typing import Optional, Union
 
 from filecrawler._exceptions import IntegrationError
 from filecrawler.alertbase import AlertBase
@@ -19,15 +20,23 @@ from filecrawler.libs.module import Module
 
 from filecrawler.config import Configuration
 from filecrawler.gitfinder import GitFinder
+from filecrawler.libs.asyncintegrator import AsyncIntegrator
+from filecrawler.libs.autoscaler import AutoScaler
 from filecrawler.libs.containerfile import ContainerFile
 from filecrawler.libs.cpath import CPath
 from filecrawler.libs.file import File
+from filecrawler.libs.fingerprintfilter import FingerprintFilter
+from filecrawler.libs.payload import Payload
+from filecrawler.libs.pipeline import Pipeline, PipelineItem
 from filecrawler.libs.slice import Slice
 from filecrawler.libs.worker import Worker
 from filecrawler.parserbase import ParserBase
 from filecrawler.libs.color import Color
 from filecrawler.libs.crawlerdb import CrawlerDB
+from filecrawler.libs.dbwriter import DBWriter
 from filecrawler.libs.logger import Logger
+from filecrawler.libs.prehashindex import PreHashIndex
+from filecrawler.libs.processpool import ProcessPool
 from filecrawler.parsers.intelxinfo import IntelXInfo
 from filecrawler.util.tools import Tools
 
@@ -47,8 +56,19 @@ class CrawlerBase(object):
     read = 0
     ignored = 0
     integrated = 0
+    hash_cached = 0
+    prehash_index = PreHashIndex()
+
+    # Integrator selector synchronization: passes are numbered, a notification wakes it up
+    _selector_cond = None
+    _selector_pass = 0
+    _selector_done = 0
+    _selector_wakeup = False
+    _outbox_owner = ''
     index_id = -1
     index_name = 'file_crawler'
+    db_writer = None
+    fingerprints = FingerprintFilter.disabled()
 
     def __init__(self, name, description, help_show=True):
         self.name = name
@@ -180,14 +200,38 @@ class CrawlerBase(object):
             # Insert/get index name
             self.index_id = db.insert_or_get_index(Configuration.index_name)
 
-            # Clear data of files
+            # Clear data left on files already integrated (NULL, as complete_integration and
+            # migrate_payloads do), the pending ones are integrated by the outbox
             db.delete('alert', index_id=self.index_id)
-            db.select_raw(sql="update file_index set data='' where index_id = ?", args=[self.index_id])
+            db.select_raw(sql="update file_index set data = NULL "
+                              "where index_id = ? and integrated = 1 and data is not null",
+                          args=[self.index_id])
+
+            self.fingerprints = self.load_fingerprints(db)
+
+            if not Configuration.disable_db:
+                pending = db.fill_outbox(self.index_id)
+                if pending > 0:
+                    Logger.pl('{+} {C}integration outbox: {O}%s{C} files queued from a previous run{W}' % pending)
 
         self.pre_run()
 
-        with Worker(callback=self.file_callback, per_thread_callback=self.thread_start_callback,
-                    threads=Configuration.tasks) as t:
+        if Configuration.executor == 'process':
+            ProcessPool.start(Configuration.processes)
+
+        self.db_writer = DBWriter(Configuration.db_name,
+                                  batch_size=Configuration.db_batch_size,
+                                  flush_interval=Configuration.db_flush_interval)
+        self.db_writer.start()
+
+        self._selector_cond = threading.Condition()
+        self._outbox_owner = '%s-%s' % (os.getpid(), ''.join(random.choice(string.ascii_lowercase) for i in range(8)))
+        self._selector_pass = 0
+        self._selector_done = 0
+        self._selector_wakeup = False
+
+        # Each stage has its own pool and bounded queue: the producers block while the consumers are behind
+        with self.create_pipeline() as t:
             t.start()
 
             t1 = threading.Thread(target=self.status,
@@ -195,8 +239,7 @@ class CrawlerBase(object):
             t1.daemon = True
             t1.start()
 
-            with Worker(callback=self.integrator_callback, per_thread_callback=self.thread_start_callback,
-                        threads=Configuration.tasks_integrator) as ing:
+            with self.create_integrator() as ing:
                 ing.start()
 
                 t2 = threading.Thread(target=self.integrator_selector,
@@ -204,32 +247,141 @@ class CrawlerBase(object):
                 t2.daemon = True
                 t2.start()
 
+                scaler = self.create_autoscaler(pipeline=t, integrator=ing)
+
                 try:
 
                     fl_count = 0
                     for f in self._list_objects(base_path=Path(Configuration.path), path=Path(Configuration.path)):
-                        if not t.running or not ing.running:
+                        if not ing.running or not t.add_item(f):
                             break
 
-                        while t.count > 1000:
-                            time.sleep(0.3)
-
                         fl_count += 1
-                        t.add_item(f)
 
                     Logger.pl('{+} {C}file list finished with {O}%s{C} files, waiting processors...{W}' % fl_count)
 
                     t.wait_finish()
+                    self.flush_integration()
+
+                    # A selector pass started from now on sees every row left by the processors
+                    self.wait_integrator(ing)
                     ing.wait_finish()
+                    self.flush_integration()
 
                     Color.clear_entire_line()
                     Logger.pl('{+} {C}processors finished!{W}')
 
+                    if Configuration.verbose >= 1:
+                        ms = Tools.get_mime_stats()
+                        Logger.pl('{?} {C}mime sniffing: {O}%s{C} calls, {O}%s{C} cache hits, '
+                                  '{O}%s{C} extension hits, {O}%s{C} libmagic calls, hit rate {O}%.1f%%{W}' % (
+                                    ms['calls'], ms['cache_hits'], ms['extension_hits'], ms['magic_calls'],
+                                    ms['hit_rate'] * 100))
+                        Logger.pl('{?} {C}hash cache: {O}%s{C} files resolved without reading{W}' %
+                                  CrawlerBase.hash_cached)
+                        Logger.pl('{?} {C}database writer: {O}%s{C} changes in {O}%s{C} transactions{W}' % (
+                                  self.db_writer.changes, self.db_writer.commits))
+                        if self.fingerprints.enabled:
+                            Logger.pl('{?} {C}fingerprint filter: {O}%s{C} fingerprints, {O}%s{C} KB{W}' % (
+                                      self.fingerprints.count, self.fingerprints.memory_usage // 1024))
+                        stats = t.stats
+                        stats['integrator'] = ing.stats
+                        for name, st in stats.items():
+                            Logger.pl('{?} {C}stage %s: {O}%s{C} tasks, {O}%s{C} executed, {O}%.1f{C}/s, '
+                                      'max queue {O}%s{C}, busy {O}%.1f%%{W}' % (
+                                        name, st['threads'], st['executed'], st['throughput'],
+                                        st['max_queued'], st['busy'] * 100))
+
                 except KeyboardInterrupt as e:
                     raise e
                 finally:
+                    if scaler is not None:
+                        scaler.stop()
                     t.close()
                     ing.close()
+                    self.post_run()
+                    ProcessPool.shutdown()
+                    self.db_writer.close()
+
+    def load_fingerprints(self, db: CrawlerDB) -> FingerprintFilter:
+        '''
+        Fingerprints already in file_index for this index, see FingerprintFilter
+        '''
+        cfg = Configuration.fingerprint_filter
+        if Configuration.disable_db or not cfg['enabled']:
+            return FingerprintFilter.disabled()
+
+        # Room for the files known plus as many new ones before it grows
+        count = db.select_count('file_index', index_id=self.index_id)
+        fingerprints = FingerprintFilter(capacity=max(100000, count * 2),
+                                         false_positive_rate=cfg['false_positive_rate'])
+        for fp in db.get_fingerprints(self.index_id):
+            fingerprints.add(fp)
+
+        Logger.pl('{+} {C}fingerprint filter loaded with {O}%s{C} fingerprints, {O}%s{C} KB '
+                  '(false positive rate {O}%s{C}){W}' % (
+                    fingerprints.count, fingerprints.memory_usage // 1024, fingerprints.false_positive_rate))
+
+        return fingerprints
+
+    def create_integrator(self) -> Union[Worker, AsyncIntegrator]:
+        '''
+        Integrator of the files in the outbox: Worker threads, or one asyncio loop (engine: async)
+        '''
+        cfg = Configuration.integrator
+        if cfg['engine'] == 'async':
+            Logger.pl('{+} {C}async integrator: {O}%s{C} requests in flight, {O}%s{C} per destination{W}' % (
+                cfg['max_in_flight'], cfg['per_destination']))
+            # Enough leased batches to keep max_in_flight files busy
+            return AsyncIntegrator(callback=self.integrator_callback_async,
+                                   per_thread_callback=self.thread_start_callback,
+                                   max_in_flight=cfg['max_in_flight'],
+                                   per_destination=cfg['per_destination'],
+                                   queue_size=max(2, 2 * cfg['max_in_flight'] // cfg['batch_size']),
+                                   blocking_threads=Configuration.tasks_integrator,
+                                   on_close=self.close_async)
+
+        return Worker(callback=self.integrator_callback, per_thread_callback=self.thread_start_callback,
+                      threads=Configuration.tasks_integrator,
+                      queue_size=max(2, Configuration.tasks_integrator * 2))
+
+    def create_autoscaler(self, pipeline: Pipeline, integrator: Worker) -> Optional[AutoScaler]:
+        cfg = Configuration.autoscale
+        if not cfg['enabled']:
+            return None
+
+        scaler = AutoScaler(interval=cfg['interval'], cpu_high=cfg['cpu_high'], verbose=Configuration.verbose)
+        for name, w in pipeline.stages:
+            scaler.add_pool(name, w, min_threads=cfg['min_tasks'], max_threads=max(cfg['max_tasks'], w.threads))
+
+        if isinstance(integrator, Worker):
+            scaler.add_pool('integrator', integrator, min_threads=cfg['min_tasks'],
+                            max_threads=max(cfg['integrator_max_tasks'], integrator.threads))
+        scaler.start()
+
+        return scaler
+
+    def create_pipeline(self) -> Pipeline:
+        '''
+        enumerate (run) -> fingerprint/dedup -> parse -> rule scan -> evidence -> integrate
+        '''
+        pipeline = Pipeline()
+        for name, callback, per_thread_callback in [
+            ('fingerprint', self.fingerprint_stage, self.thread_start_callback),
+            ('parse', self.parse_stage, None),
+            ('rules', self.rules_stage, None),
+            ('evidence', self.evidence_stage, self.thread_start_callback),
+            ('integrate', self.integrate_stage, self.thread_start_callback),
+        ]:
+            pipeline.add_stage(
+                name,
+                callback=self.stage_callback(pipeline, callback),
+                threads=Configuration.get_stage_tasks(name),
+                queue_size=Configuration.get_stage_queue_size(name),
+                per_thread_callback=per_thread_callback
+            )
+
+        return pipeline
 
     @staticmethod
     def ignore(file: File) -> bool:
@@ -257,7 +409,8 @@ class CrawlerBase(object):
             return True
 
         if isinstance(path, File):
-            i_path = Path(str(path.path)).resolve()
+            # Files come from the directory walker with an already resolved path
+            i_path = path.path
 
         if not isinstance(path, File):
             i_path = Path(str(path)).resolve()
@@ -271,33 +424,27 @@ class CrawlerBase(object):
                 if size > Configuration.max_size:
                     return True
 
-        ignore = next((
-            True for x in [
-            x1 for x1 in Configuration.excludes
-            if x1 not in include
-        ]
-            if Path(str(i_path).lower()).match(x)
-        ), False)
-
-        return ignore
+        return Configuration.get_exclude_matcher().without(include).is_excluded(i_path)
 
     def must_index(self, file: Union[File, str]) -> bool:
         return True
 
     def thread_start_callback(self, index, **kwargs):
+        # Reader connection, the changes are committed by the database writer
         return CrawlerDB(auto_create=False,
-                         db_name=Configuration.db_name)
+                         db_name=Configuration.db_name,
+                         writer=self.db_writer)
 
-    def file_callback(self, worker, entry, thread_callback_data, thread_count, **kwargs):
-        try:
-            if isinstance(entry, File):
-                self.process_file(db=thread_callback_data, file=entry)
-            elif isinstance(entry, CPath):
-                self.process_path(db=thread_callback_data, path=entry)
-        except KeyboardInterrupt as e:
-            worker.close()
-        except Exception as e:
-            Tools.print_error(e)
+    def stage_callback(self, pipeline: Pipeline, callback):
+        def run(entry, db, forward):
+            try:
+                callback(entry=entry, db=db, forward=forward)
+            except KeyboardInterrupt as e:
+                pipeline.close()
+            except Exception as e:
+                Tools.print_error(e)
+
+        return run
 
     def status(self, text, sync):
         try:
@@ -335,221 +482,335 @@ class CrawlerBase(object):
             self.clear_line()
 
     def integrator_callback(self, worker, entry, thread_callback_data, thread_count, **kwargs):
+        db = thread_callback_data
+        file_ids = entry
+        done = []
         try:
-            #self.process_file(db=thread_callback_data, file=entry)
-            file_id = int(entry)
-            db = thread_callback_data
-            try:
-                dt = db.select_first('file_index', file_id=file_id, integrated=0, index_id=self.index_id)
-                if dt is not None:
-                    b64_data = dt.get('data', None)
-
-                    if b64_data is None or b64_data.strip() == '':
-                        Logger.pl(f'Data is empty to {file_id}')
-                        Logger.p(dt)
-
-                    if b64_data is not None and b64_data.strip() != '':
-                        data = base64.b64decode(b64_data)
-                        if isinstance(data, bytes):
-                            data = data.decode("utf-8")
-
-                        data = json.loads(data)
-
-                        try:
-                            self.integrate(**data)
-                            CrawlerBase.integrated += 1
-                        except IntegrationError:
-                            time.sleep(0.3)
-                            return
-                        except Exception as e:
-                            if not Configuration.continue_on_error:
-                                Color.pl(
-                                    '{!} {R}error: Cannot integrate file {G}%s{R}: {O}%s{W}\r\n' % (
-                                    dt.get('path_virtual', ''), str(e)))
-                                raise KeyboardInterrupt()
-
-                    #Crawler.integrated += 1
-                    db.update('file_index', filter_data=dict(file_id=file_id), integrated=1, data='')
-
-            except sqlite3.OperationalError as e:
-                if 'locked' in str(e):
-                    time.sleep(5)
+            for dt in db.get_pending(file_ids):
+                data = Payload.decode(dt.get('data', None))
+
+                if data is None:
+                    Logger.pl(f'Data is empty to {dt["file_id"]}')
+                    Logger.p(dt)
+
+                if data is not None:
+                    try:
+                        self.integrate(**data)
+                        CrawlerBase.integrated += 1
+                    except IntegrationError:
+                        # The rest of the batch is leased again after retry_delay
+                        break
+                    except Exception as e:
+                        if not Configuration.continue_on_error:
+                            Color.pl(
+                                '{!} {R}error: Cannot integrate file {G}%s{R}: {O}%s{W}\r\n' % (
+                                dt.get('path_virtual', ''), str(e)))
+                            raise KeyboardInterrupt()
+
+                done.append(dt['file_id'])
 
         except KeyboardInterrupt as e:
             worker.close()
         except Exception as e:
             Tools.print_error(e)
+        finally:
+            try:
+                # One statement marks the whole batch as integrated
+                db.complete_integration(self._outbox_owner, done)
+                db.release_integration(self._outbox_owner, [f for f in file_ids if f not in done],
+                                       delay=Configuration.integrator['retry_delay'])
+            except Exception as e:
+                Tools.print_error(e)
+
+    async def integrate_async(self, engine: AsyncIntegrator, **data):
+        '''
+        integrate for the async integrator engine. By default the synchronous integrate runs in
+        the engine thread pool; modules with an async client override it
+        '''
+        async with engine.limit(self.name):
+            await engine.run_blocking(lambda tcb: self.integrate(**data))
+
+    async def close_async(self):
+        '''
+        Called on the async integrator loop before it stops
+        '''
+        pass
+
+    async def integrator_callback_async(self, engine: AsyncIntegrator, entry):
+        file_ids = entry
+        done = []
+        try:
+            rows = await engine.run_blocking(lambda db: db.get_pending(file_ids))
+            results = await asyncio.gather(*[self.integrate_row_async(engine, dt) for dt in rows])
+            done = [dt['file_id'] for dt, ok in zip(rows, results) if ok]
+
+        except KeyboardInterrupt as e:
+            engine.close()
+        except Exception as e:
+            Tools.print_error(e)
+        finally:
+            def finish(db: CrawlerDB):
+                db.complete_integration(self._outbox_owner, done)
+                db.release_integration(self._outbox_owner, [f for f in file_ids if f not in done],
+                                       delay=Configuration.integrator['retry_delay'])
+
+            try:
+                await engine.run_blocking(finish)
+            except Exception as e:
+                Tools.print_error(e)
+
+    async def integrate_row_async(self, engine: AsyncIntegrator, dt: dict) -> bool:
+        data = Payload.decode(dt.get('data', None))
+
+        if data is None:
+            Logger.pl(f'Data is empty to {dt["file_id"]}')
+            Logger.p(dt)
+            return True
+
+        try:
+            async with engine.limit():
+                await self.integrate_async(engine, **data)
+            CrawlerBase.integrated += 1
+        except IntegrationError:
+            # Leased again after retry_delay
+            return False
+        except Exception as e:
+            if not Configuration.continue_on_error:
+                Color.pl(
+                    '{!} {R}error: Cannot integrate file {G}%s{R}: {O}%s{W}\r\n' % (
+                    dt.get('path_virtual', ''), str(e)))
+                engine.close()
+                return False
+
+        return True
 
     def integrator_selector(self, worker):
+        cfg = Configuration.integrator
         try:
             with(CrawlerDB(auto_create=False,
-                           db_name=Configuration.db_name)) as db:
+                           db_name=Configuration.db_name,
+                           writer=self.db_writer)) as db:
                 while worker.running:
+                    with self._selector_cond:
+                        self._selector_pass += 1
+                        self._selector_wakeup = False
+                        current = self._selector_pass
+
+                    # Leased rows are not leased again until done, released or expired, no need to
+                    # wait the batch before leasing the next one
+                    file_ids = db.lease_integration(self.index_id, self._outbox_owner,
+                                                    limit=cfg['batch_size'], timeout=cfg['lease_timeout'])
+                    if len(file_ids) > 0:
+                        if not worker.add_item(file_ids):
+                            break
+                        continue
 
-                    while worker.count > 500:
-                        time.sleep(0.3)
-
-                    try:
-                        rows = db.select_raw(
-                            sql='select file_id from [file_index] where integrated = 0 order by indexing_date limit 1000',
-                            args=[]
-                        )
-                        if rows is not None and len(rows) > 0:
-                            for r in rows:
-                                worker.add_item(int(r['file_id']))
-                    except sqlite3.OperationalError as e:
-                        if 'locked' in str(e):
-                            time.sleep(5)
-
-                    time.sleep(5)
+                    # Nothing left (or only batches waiting a retry): sleep until notified
+                    with self._selector_cond:
+                        self._selector_done = current
+                        self._selector_cond.notify_all()
+                        if not self._selector_wakeup:
+                            self._selector_cond.wait(cfg['retry_delay'])
 
         except KeyboardInterrupt as e:
             worker.close()
         except Exception as e:
             Tools.print_error(e)
+        finally:
+            if self._selector_cond is not None:
+                with self._selector_cond:
+                    self._selector_done = sys.maxsize
+                    self._selector_cond.notify_all()
+
+    def notify_integrator(self):
+        '''
+        Wake up the integrator selector, there are rows in the integration outbox
+        '''
+        if self._selector_cond is None:
+            return
+
+        with self._selector_cond:
+            self._selector_wakeup = True
+            self._selector_cond.notify_all()
+
+    def wait_integrator(self, worker: Worker):
+        '''
+        Wait until a selector pass started after this call finds nothing more to integrate
+        '''
+        with self._selector_cond:
+            target = self._selector_pass + 1
+            self._selector_wakeup = True
+            self._selector_cond.notify_all()
+            while worker.running and self._selector_done < target:
+                self._selector_cond.wait(1)
 
     def _list_objects(self, base_path: Path, path: Path, recursive: bool = True, container_path: File = None):
-        here = str(path.resolve())
-        files = [
-            Path(os.path.join(here, name)).resolve()
-            for name in os.listdir(here)
-            if os.path.isfile(os.path.join(here, name))
-        ]
-
-        info = IntelXInfo(here)
-
-        for f in files:
-            yield File(base_path, f, container_path, info=info.get_info(f))
-
-        if os.path.isdir(os.path.join(here, '.git')) and Configuration.git_support:
-            yield CPath(base_path, Path(os.path.join(here, '.git')).resolve(), container_path)
-
-        if recursive:
-            dirs = [
-                Path(os.path.join(here, name)).resolve()
-                for name in os.listdir(here)
-                if os.path.isdir(os.path.join(here, name)) and next((
-                    False for x in Configuration.excludes
-                    if Path(str(os.path.join(here, name)).lower()).match(x)
-                    ), True)
-            ]
-
-            for d in dirs:
-                yield from self._list_objects(
-                    base_path=base_path,
-                    path=d,
-                    recursive=recursive,
-                    container_path=container_path)
-
-    def process_path(self, db: CrawlerDB, path: CPath):
-        if path.name == '.git' and Configuration.git_support:
+        '''
+        Directory walker built on os.scandir. The stat taken by each DirEntry is reused by File,
+        excluded and oversized entries are dropped before any File is created and, when following
+        symlinks, directories already visited (same dev/inode) are skipped to avoid loops.
+        '''
+        follow = Configuration.follow_symlinks
+        base_path = str(Path(base_path).resolve())
+        root = str(Path(path).resolve())
+        visited = set()
+        if follow:
+            st = os.stat(root)
+            visited.add((st.st_dev, st.st_ino))
+
+        stack = [root]
+        while len(stack) > 0:
+            here = stack.pop()
             try:
-                git = GitFinder(path)
-                for f_data in git.get_diffs():
+                with os.scandir(here) as it:
+                    entries = list(it)
+            except OSError as e:
+                if Configuration.verbose >= 3:
+                    Tools.print_error(Exception(f'Error listing directory: {here}', e))
+                continue
+
+            has_info = False
+            files = []
+            dirs = []
+            git_path = None
+            for entry in entries:
+                try:
+                    is_link = entry.is_symlink()
+                    if is_link and not follow:
+                        continue
 
-                    CrawlerBase.read += 1
+                    if entry.is_file():
+                        if entry.name == 'Info.csv' or entry.name == 'info.csv':
+                            has_info = True
 
-                    if CrawlerBase.ignore2(len(f_data.get('content', '')), f_data['path_real'], ['*/.git/*', '*/.git/']):
-                        CrawlerBase.ignored += 1
-                        continue
+                        f_path = os.path.realpath(entry.path) if is_link else entry.path
+                        if CrawlerBase._is_excluded(f_path):
+                            continue
 
-                    # Check if already integrated
-                    id = f_data.get('fingerprint', None)
-                    if Configuration.filename_as_id or id is None:
-                        id = f_data.get('path_virtual', '')
-                    if id is not None and id.strip() != '':
-                        if not self.must_index(file=id):
-                            CrawlerBase.ignored += 1
+                        st = entry.stat()
+                        if CrawlerBase._is_oversized(entry.name, st.st_size):
                             continue
 
-                    parser = ParserBase.get_parser_instance(f_data['extension'], f_data['mime_type'])
-                    f_data.update(dict(parser=parser.name))
+                        files.append((f_path, st))
 
-                    tmp = parser.parse_from_bytes(f_data.get('content', bytes()))
-                    if tmp is not None:
-                        f_data.update(**tmp)
+                    elif entry.is_dir():
+                        if entry.name == '.git':
+                            git_path = os.path.realpath(entry.path) if is_link else entry.path
 
-                        creds = parser.lookup_credentials(f_data.get('content', bytes()))
-                        if creds is not None:
-                            f_data.update(creds)
+                        if not recursive or CrawlerBase._is_excluded(entry.path):
+                            continue
 
-                            slice = Slice(f_data['path_virtual'], f_data['fingerprint'], f_data.get('content', bytes()), creds)
-                            if slice.text != '':
-                                f_data.update(dict(filtered_content=slice.text))
-                                if Configuration.store_leaks_evidences:
-                                    slice.save_evidences(Configuration.evidences_path, f_data['fingerprint'])
+                        if follow:
+                            st = entry.stat()
+                            if (st.st_dev, st.st_ino) in visited:
+                                continue
+                            visited.add((st.st_dev, st.st_ino))
 
-                            self.save_credential(db, f_data['path_virtual'], f_data)
+                        dirs.append(os.path.realpath(entry.path) if is_link else entry.path)
 
-                    if not Configuration.store_source:
-                        f_data['content'] = 'Disabled by configuration "store_source"'
-                    elif f_data.get('content', None) is not None and Configuration.indexed_chars > 0:
-                        f_data['content'] = f_data['content'][:Configuration.indexed_chars]
+                except OSError as e:
+                    # Broken symlinks, permission denied and entries removed meanwhile
+                    if Configuration.verbose >= 3:
+                        Tools.print_error(Exception(f'Error reading directory entry: {entry.path}', e))
 
-                    b64_data = base64.b64encode(json.dumps(f_data, default=Tools.json_serial).encode("utf-8"))
-                    if isinstance(b64_data, bytes):
-                        b64_data = b64_data.decode("utf-8")
+            info = IntelXInfo(here) if has_info else None
 
-                    # try to send in a first attempt
-                    integrated = 0
-                    try:
+            for f_path, st in files:
+                yield File(base_path, f_path, container_path,
+                           info=info.get_info(Path(f_path)) if info is not None else None,
+                           stats=st, resolved=True)
 
-                        if isinstance(f_data.get('content', ''), bytes):
-                            f_data['content'] = f_data.get('content', bytes()).decode('utf-8', 'ignore')
+            if git_path is not None and Configuration.git_support:
+                yield CPath(base_path, git_path, container_path, resolved=True)
 
-                        if f_data.get('content', None) is not None and Configuration.indexed_chars > 0:
-                            f_data['content'] = f_data['content'][:Configuration.indexed_chars]
+            # Depth first, in the same order the directories were listed
+            stack.extend(reversed(dirs))
 
-                        f_data['content'] = f_data.get('content', '').strip('\n\t ')
+    @staticmethod
+    def _is_excluded(path: str) -> bool:
+        return Configuration.get_exclude_matcher().is_excluded(path)
 
-                        if not Configuration.index_empty_files and \
-                                (f_data.get('content', None) is None or len(f_data.get('content', '')) == 0):
-                            CrawlerBase.ignored += 1
-                        else:
-                            self.integrate(**f_data)
-                            CrawlerBase.integrated += 1
+    @staticmethod
+    def _is_oversized(name: str, size: int) -> bool:
+        # Same size limit applied by CrawlerBase.ignore, where containers are not limited
+        if Configuration.container_max_size <= 0 or size <= Configuration.container_max_size:
+            return False
+
+        return not ContainerFile.is_container_extension(Path(name).suffix.lower().strip('. '))
+
+    def fingerprint_stage(self, entry, db: CrawlerDB, forward):
+        if isinstance(entry, File):
+            self.process_file(db=db, file=entry, forward=forward)
+        elif isinstance(entry, CPath):
+            self.process_path(db=db, path=entry, forward=forward)
+
+    def parse_stage(self, entry: PipelineItem, db: CrawlerDB, forward):
+        self.parse_item(entry)
+        forward(entry)
+
+    def rules_stage(self, entry: PipelineItem, db: CrawlerDB, forward):
+        self.scan_item(entry)
+        forward(entry)
+
+    def evidence_stage(self, entry: PipelineItem, db: CrawlerDB, forward):
+        self.evidence_item(db, entry)
+        forward(entry)
+
+    def integrate_stage(self, entry: PipelineItem, db: CrawlerDB, forward):
+        self.integrate_item(db, entry)
+
+    def process_item(self, db: CrawlerDB, item: PipelineItem):
+        '''
+        Run every stage after fingerprint/dedup in the calling thread
+        '''
+        self.parse_item(item)
+        self.scan_item(item)
+        self.evidence_item(db, item)
+        self.integrate_item(db, item)
+
+    def process_path(self, db: CrawlerDB, path: CPath, forward=None):
+        if path.name != '.git' or not Configuration.git_support:
+            return
 
-                        integrated = 1
-                        b64_data = ''
-                    except Exception as e:
-                        if Configuration.verbose >= 4:
-                            Tools.print_error(Exception(f'Error integrating git data from: {path.path_virtual}', str(e)))
-                        pass
-
-                    row = None
-                    last_error = None
-                    for i in range(50):
-                        try:
-                            row = db.insert_or_get_file(
-                                **f_data,
-                                index_id=self.index_id,
-                                integrated=integrated,
-                                data=b64_data
-                            )
-                            if row is None:
-                                last_error = Exception('database register is none')
-                            break
-                        except sqlite3.OperationalError as e:
-                            last_error = e
-                            if 'locked' in str(e):
-                                time.sleep(0.5 * float(i))
-                                if i >= 20:
-                                    db.reconnect()
-                    if row is None and not Configuration.continue_on_error:
-                        Color.pl(
-                            '{!} {R}error: Cannot insert file {G}%s{R}: {O}%s{W}\r\n' % (path.path_real, str(last_error)))
-                        raise KeyboardInterrupt()
-            except KeyboardInterrupt as e:
-                raise e
-            except Exception as e:
-                if Configuration.verbose >= 3:
-                    Tools.print_error(Exception(f'Error getting git data from: {path.path_virtual}', e))
+        if forward is None:
+            forward = lambda item: self.process_item(db, item)
+
+        try:
+            git = GitFinder(path)
+            for f_data in git.get_diffs():
 
-    def process_file(self, db: CrawlerDB, file: File):
+                CrawlerBase.read += 1
+
+                if CrawlerBase.ignore2(len(f_data.get('content', '')), f_data['path_real'], ['*/.git/*', '*/.git/']):
+                    CrawlerBase.ignored += 1
+                    continue
+
+                # Check if already integrated
+                id = f_data.get('fingerprint', None)
+                if Configuration.filename_as_id or id is None:
+                    id = f_data.get('path_virtual', '')
+                if id is not None and id.strip() != '':
+                    if not self.must_index(file=id):
+                        CrawlerBase.ignored += 1
+                        continue
+
+                forward(PipelineItem(path=path, data=f_data))
+        except KeyboardInterrupt as e:
+            raise e
+        except Exception as e:
+            if Configuration.verbose >= 3:
+                Tools.print_error(Exception(f'Error getting git data from: {path.path_virtual}', e))
+
+    def process_file(self, db: CrawlerDB, file: File, forward=None):
 
         if Configuration.verbose >= 3:
             Color.pl('{*} {GR}processing %s{W}' % file.path_virtual)
 
+        if forward is None:
+            forward = lambda item: self.process_item(db, item)
+
+        self.load_hash(db=db, file=file)
+
         if not self.must_index(file=file):
             CrawlerBase.ignored += 1
             return
@@ -557,6 +818,7 @@ class CrawlerBase(object):
         if ContainerFile.is_container(file):
             if Configuration.verbose >= 3:
                 Color.pl('{*} {GR}container file %s{W}' % file.path_virtual)
+            # The extracted files are removed on exit, so they are processed here and not by the pipeline
             with(ContainerFile(file)) as container:
                 out_path = container.extract()
                 if out_path is not None:
@@ -576,110 +838,215 @@ class CrawlerBase(object):
 
             CrawlerBase.read += 1
 
-            if db.select_count('file_index', index_id=self.index_id, fingerprint=file.fingerprint) > 0:
+            # A new file (filter negative) goes straight to the insert, the possible positives are
+            # checked by this thread connection, without waiting for the database writer
+            if self.fingerprints.enabled and self.fingerprints.might_contain(file.fingerprint) and \
+                    db.select_count('file_index', index_id=self.index_id, fingerprint=file.fingerprint) > 0:
                 CrawlerBase.ignored += 1
                 return
 
+            # Insert and dedup in one statement, a file already known is not processed again
             row = None
-            last_error = None
-            for i in range(50):
-                try:
-                    row = db.insert_or_get_file(
-                        **file.db_dict,
-                        index_id=self.index_id,
-                        integrated=1,  # To not try to integrate without content
-                    )
-                    if row is None:
-                        last_error = Exception('database register is none')
-                    break
-                except sqlite3.OperationalError as e:
-                    last_error = e
-                    if 'locked' in str(e):
-                        time.sleep(0.5 * float(i))
-                        if i >= 20:
-                            db.reconnect()
+            last_error = Exception('database register is none')
+            try:
+                row = db.insert_or_get_file(
+                    **file.db_dict,
+                    index_id=self.index_id,
+                    integrated=1,  # To not try to integrate without content
+                    fetch_existing=False
+                )
+            except sqlite3.Error as e:
+                last_error = e
 
             if row is None and not Configuration.continue_on_error:
                 Color.pl(
                     '{!} {R}error: Cannot insert file {G}%s{R}: {O}%s{W}\r\n' % (file.path_real, str(last_error)))
                 raise KeyboardInterrupt()
 
+            if row is not None and not row['inserted']:
+                CrawlerBase.ignored += 1
+                return
+
             if row is not None and row['inserted']:
-                #Logger.pl(file.path_virtual)
-                #Process file content
-                parser = ParserBase.get_parser_instance(file.extension, file.mime)
-                data = file.db_dict
-                data.update(dict(parser=parser.name))
-
-                tmp = parser.parse(file)
-                if tmp is not None:
-                    data.update(**tmp)
-
-                    if not Configuration.disable_rules:
-                        creds = parser.lookup_credentials(data.get('content', ''))
-                        if creds is not None:
-                            data.update(creds)
-
-                            #
-                            #slice = Slice(data['path_virtual'], data['fingerprint'], data.get('content', ''), creds)
-                            #if slice.text != '':
-                            #    data.update(dict(filtered_content=slice.text))
-                            #    if Configuration.store_leaks_evidences:
-                            #        slice.save_evidences(Configuration.evidences_path, data['fingerprint'])
-
-                            self.save_credential(db, file.path_virtual, data)
-
-                if not Configuration.store_source:
-                    data['content'] = 'Disabled by configuration "store_source"'
-                elif data.get('content', None) is not None and Configuration.indexed_chars > 0:
-                    data['content'] = data['content'][:Configuration.indexed_chars]
-
-                b64_data = base64.b64encode(json.dumps(data, default=Tools.json_serial).encode("utf-8"))
-                if isinstance(b64_data, bytes):
-                    b64_data = b64_data.decode("utf-8")
-
-                # try to send in a first attempt
-                integrated = 0
-                try:
+                self.fingerprints.add(file.fingerprint)
+                forward(PipelineItem(file=file, row=row, data=file.db_dict))
+
+        if Configuration.verbose >= 3:
+            Color.pl('{*} {GR}finishing processor for %s{W}' % file.path_virtual)
+
+    def parse_item(self, item: PipelineItem):
+        data = item.data
+        if item.file is not None:
+            item.parser = ParserBase.get_parser_instance(item.file.extension, item.file.mime)
+            tmp = item.parser.parse(item.file)
 
-                    if isinstance(data.get('content', ''), bytes):
-                        data['content'] = data.get('content', bytes()).decode('utf-8', 'ignore')
+            # The parsed data has what the next stages need, do not keep the raw content queued
+            item.file.release_content()
+        else:
+            item.parser = ParserBase.get_parser_instance(data['extension'], data['mime_type'])
+            if ProcessPool.enabled() and len(data.get('content', bytes())) > 0:
+                tmp = ProcessPool.parse_from_bytes(item.parser.name, data.get('content', bytes()),
+                                                   name=data.get('filename', ''))
+            else:
+                tmp = item.parser.parse_from_bytes(data.get('content', bytes()), name=data.get('filename', ''))
+
+        data.update(dict(parser=item.parser.name))
+        if tmp is not None:
+            data.update(**tmp)
+        else:
+            item.parser = None
 
-                    if data.get('content', None) is not None and Configuration.indexed_chars > 0:
-                        data['content'] = data['content'][:Configuration.indexed_chars]
+    def scan_item(self, item: PipelineItem):
+        # Parsing failed, nothing to scan
+        if item.parser is None:
+            return
 
-                    data['content'] = data.get('content', '').strip('\n\t ')
+        if item.file is not None and Configuration.disable_rules:
+            return
 
-                    if not Configuration.index_empty_files and \
-                            (data.get('content', None) is None or len(data.get('content', '')) == 0):
-                        CrawlerBase.ignored += 1
-                    else:
-                        self.integrate(**data)
+        if ProcessPool.enabled():
+            item.credentials = ProcessPool.lookup_credentials(item.data.get('content', ''))
+        else:
+            item.credentials = item.parser.lookup_credentials(item.data.get('content', ''))
+        if item.credentials is not None:
+            item.data.update(item.credentials)
 
-                    integrated = 1
-                    b64_data = ''
-                except:
-                    pass
-
-                if not Configuration.disable_db:
-                    for i in range(5):
-                        try:
-                            db.update('file_index',
-                                      filter_data=dict(file_id=row['file_id']),
-                                      **dict(
-                                          integrated=integrated,
-                                          data=b64_data if not integrated else ''
-                                      )
-                            )
-                            break
-                        except sqlite3.OperationalError as e:
-                            if 'locked' in str(e):
-                                time.sleep(1)
+    def evidence_item(self, db: CrawlerDB, item: PipelineItem):
+        if item.credentials is None:
+            return
 
-                CrawlerBase.integrated += integrated
+        data = item.data
+        if item.file is None:
+            slice = Slice(data['path_virtual'], data['fingerprint'], data.get('content', bytes()), item.credentials)
+            if slice.text != '':
+                data.update(dict(filtered_content=slice.text))
+                if Configuration.store_leaks_evidences:
+                    slice.save_evidences(Configuration.evidences_path, data['fingerprint'])
+
+        #
+        #slice = Slice(data['path_virtual'], data['fingerprint'], data.get('content', ''), creds)
+        #if slice.text != '':
+        #    data.update(dict(filtered_content=slice.text))
+        #    if Configuration.store_leaks_evidences:
+        #        slice.save_evidences(Configuration.evidences_path, data['fingerprint'])
+
+        self.save_credential(db, item.path_virtual, data)
+
+    def integrate_item(self, db: CrawlerDB, item: PipelineItem):
+        data = item.data
+        if not Configuration.store_source:
+            data['content'] = 'Disabled by configuration "store_source"'
+        elif data.get('content', None) is not None and Configuration.indexed_chars > 0:
+            data['content'] = data['content'][:Configuration.indexed_chars]
+
+        file_id = item.row.get('file_id', None) if item.row is not None else None
+        if item.file is None:
+            # Git blobs are stored only now, before an integration result (see integration_failed)
+            file_id = self.store_blob(db, item)
+
+        # try to send in a first attempt, the payload is encoded only when it fails
+        try:
 
-        if Configuration.verbose >= 3:
-            Color.pl('{*} {GR}finishing processor for %s{W}' % file.path_virtual)
+            if isinstance(data.get('content', ''), bytes):
+                data['content'] = data.get('content', bytes()).decode('utf-8', 'ignore')
+
+            if data.get('content', None) is not None and Configuration.indexed_chars > 0:
+                data['content'] = data['content'][:Configuration.indexed_chars]
+
+            data['content'] = data.get('content', '').strip('\n\t ')
+
+            if not Configuration.index_empty_files and \
+                    (data.get('content', None) is None or len(data.get('content', '')) == 0):
+                CrawlerBase.ignored += 1
+            else:
+                self.integrate(**data)
+                CrawlerBase.integrated += 1
+
+        except Exception as e:
+            if Configuration.verbose >= 4:
+                Tools.print_error(Exception(f'Error integrating data from: {item.path_virtual}', str(e)))
+
+            if not Configuration.disable_db and file_id is not None:
+                db.set_pending(self.index_id, file_id, Payload.encode(data))
+                self.notify_integrator()
+
+    def integration_failed(self, data: dict, retry: bool, error: Exception = None):
+        '''
+        A document accepted by integrate was rejected later (bulk mode): store its payload in
+        the integration outbox. Without continue_on_error the crawl stops on a permanent error
+        '''
+        CrawlerBase.integrated -= 1
+        if Configuration.verbose >= 4 or (not retry and not Configuration.continue_on_error):
+            Tools.print_error(Exception(f'Error integrating data from: {data.get("path_virtual", "")}', str(error)))
+
+        if not retry and Configuration.continue_on_error:
+            CrawlerBase.ignored += 1
+            return
+
+        if not Configuration.disable_db and self.db_writer is not None:
+            self.db_writer.execute('set_pending_fingerprint', self.index_id, data['fingerprint'],
+                                   Payload.encode(data))
+            self.notify_integrator()
+
+    def flush_integration(self):
+        '''
+        Called when no more files are expected for now (end of the processors and of the
+        integrator): an integration buffering documents must send them
+        '''
+        pass
+
+    def post_run(self):
+        pass
+
+    def store_blob(self, db: CrawlerDB, item: PipelineItem) -> Optional[int]:
+        row = None
+        last_error = Exception('database register is none')
+        try:
+            row = db.insert_or_get_file(
+                **item.data,
+                index_id=self.index_id,
+                integrated=1,
+                data=None
+            )
+            if row is not None:
+                self.fingerprints.add(item.data.get('fingerprint', None))
+        except sqlite3.Error as e:
+            last_error = e
+
+        if row is None and not Configuration.continue_on_error:
+            Color.pl(
+                '{!} {R}error: Cannot insert file {G}%s{R}: {O}%s{W}\r\n' % (item.path.path_real, str(last_error)))
+            raise KeyboardInterrupt()
+
+        return row.get('file_id', None) if row is not None else None
+
+    def load_hash(self, db: CrawlerDB, file: File):
+        '''
+        Resolve the file hash from the hash cache when size and mtime did not change since
+        it was hashed, otherwise hash it now (large files by the pre-hash) and update the cache
+        '''
+        # Container members are extracted to a new temp folder (new inodes) every time
+        if file.container_path is not None:
+            return
+
+        try:
+            if not Configuration.rehash:
+                cached = db.get_file_hash(file.stats)
+                if cached is not None:
+                    # The mime detection uses the extension, renamed files (same inode) must sniff it again
+                    file.set_hash(cached['hash'],
+                                  cached['mime_type'] if cached['extension'] == file.extension else None)
+                    CrawlerBase.hash_cached += 1
+                    return
+
+            # Rehash asks for the full content hash, the pre-hash is not used
+            if file.size >= File._PREHASH_MIN_SIZE and not Configuration.rehash:
+                file.set_hash(CrawlerBase.prehash_index.get_hash(db, file, self.index_id))
+
+            db.set_file_hash(file.stats, file.hash, file.extension, file.mime)
+        except sqlite3.OperationalError as e:
+            if Configuration.verbose >= 3:
+                Tools.print_error(Exception(f'Error using hash cache for: {file.path_virtual}', e))
 
     def save_credential(self, db: CrawlerDB, file_path: str, data: dict):
         if data is None or len(data) == 0:
@@ -71,7 +71,7 @@ class GitFinder(object):
                                 fingerprint=self._diff_fingerprint(stats, 'a'),
                                 filename=opath.name,
                                 extension=opath.suffix.strip('. '),
-                                mime_type=Tools.get_mimes(bdata_a),
+                                mime_type=Tools.get_mimes(bdata_a, extension=opath.suffix),
                                 file_size=diff.a_blob.size,
                                 created=commit.authored_datetime,
                                 last_accessed=commit.authored_datetime,
@@ -90,7 +90,7 @@ class GitFinder(object):
                                     fingerprint=self._diff_fingerprint(stats, 'b'),
                                     filename=opath.name,
                                     extension=opath.suffix.strip('. '),
-                                    mime_type=Tools.get_mimes(bdata_b),
+                                    mime_type=Tools.get_mimes(bdata_b, extension=opath.suffix),
                                     file_size=diff.b_blob.size,
                                     created=commit.authored_datetime,
                                     last_accessed=commit.authored_datetime,
@@ -0,0 +1,240 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from filecrawler.libs.logger import Logger
+
+
+class AsyncIntegrator(object):
+    '''
+    Integrator engine on a single asyncio event loop (general.integrator.engine: async), an
+    alternative to the Worker threads. Each item runs the coroutine callback(engine, entry) on
+    the loop, so hundreds of requests can be in flight with a few threads.
+
+    Concurrency is bounded by max_in_flight (limit()) and by per_destination for each named
+    destination (limit(name)), e.g. one per elasticsearch index. Blocking code (SQLite, a
+    synchronous integrate) runs in run_blocking, a thread pool whose threads get the value of
+    per_thread_callback like the Worker threads.
+
+    Same interface as Worker for the crawler: start, add_item, wait_finish, close, running
+    and stats
+    '''
+
+    max_in_flight = 256
+    per_destination = 64
+    threads = 1
+    callback = None
+    per_thread_callback = None
+    on_close = None
+
+    def __init__(self, callback: Callable = None, per_thread_callback: Callable = None,
+                 max_in_flight: int = 256, per_destination: int = 64, queue_size: int = 0,
+                 blocking_threads: int = 4, on_close: Callable = None):
+        '''
+        queue_size: maximum of items waiting or running (0 is unbounded), add_item blocks while full
+        on_close: coroutine function run on the loop before it stops (e.g. close async clients)
+        '''
+        if callback is None or not callable(callback):
+            raise Exception('integrator callback is not callable')
+
+        self.callback = callback
+        self.per_thread_callback = per_thread_callback
+        self.on_close = on_close
+        self.max_in_flight = max(1, max_in_flight)
+        self.per_destination = max(1, per_destination)
+        self.threads = max(1, blocking_threads)
+        self._queue_size = max(0, queue_size)
+        self._slots = threading.BoundedSemaphore(self._queue_size) if self._queue_size > 0 else None
+        self._loop = None
+        self._thread = None
+        self._executor = None
+        self._local = threading.local()
+        self._thread_index = 0
+        self._thread_lock = threading.Lock()
+        self._running = False
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._tasks = set()
+        self._executed = 0
+        self._busy_time = 0.0
+        self._in_flight = 0
+        self._max_in_flight = 0
+        self._start_time = None
+        self._limits = {}
+        self._global = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def start(self):
+        started = threading.Event()
+
+        self._executor = ThreadPoolExecutor(max_workers=self.threads, initializer=self._thread_start)
+        self._running = True
+        self._start_time = time.monotonic()
+        self._thread = threading.Thread(target=self._run, kwargs=dict(started=started))
+        self._thread.daemon = True
+        self._thread.start()
+        started.wait()
+
+    def close(self):
+        with self._cond:
+            if not self._running:
+                return
+
+            self._running = False
+            self._cond.notify_all()
+
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            if threading.current_thread() is self._thread:
+                # Called by a coroutine: the loop stops once it returns
+                return
+            self._thread.join()
+
+        self._executor.shutdown(wait=True)
+
+    def add_item(self, entry: Any) -> bool:
+        '''
+        Run callback(engine, entry) on the loop, blocking while queue_size items are pending.
+        Returns False if the engine was closed
+        '''
+        if self._slots is not None:
+            while not self._slots.acquire(timeout=0.5):
+                if not self._running:
+                    return False
+
+        with self._cond:
+            if not self._running:
+                if self._slots is not None:
+                    self._slots.release()
+                return False
+
+            self._pending += 1
+
+            # The loop keeps only weak references to its tasks: a pending one that nothing else
+            # references can be garbage collected (its finally runs, as if it had finished)
+            future = asyncio.run_coroutine_threadsafe(self._execute(entry), self._loop)
+            self._tasks.add(future)
+
+        future.add_done_callback(self._task_done)
+        return True
+
+    def wait_finish(self, timeout: float = None) -> bool:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            while self._running and self._pending > 0:
+                wait = 1
+                if deadline is not None:
+                    wait = deadline - time.monotonic()
+                    if wait <= 0:
+                        return False
+                self._cond.wait(min(wait, 1))
+
+        return True
+
+    def limit(self, destination: str = None) -> asyncio.Semaphore:
+        '''
+        Semaphore of a destination (or the global in flight one), to be used in the loop:
+        async with engine.limit('index_name'): ...
+        '''
+        if destination is None:
+            return self._global
+
+        sem = self._limits.get(destination, None)
+        if sem is None:
+            sem = self._limits[destination] = asyncio.Semaphore(self.per_destination)
+
+        return sem
+
+    async def run_blocking(self, fn: Callable, *args):
+        '''
+        Run fn(thread_callback_data, *args) in the blocking thread pool
+        '''
+        return await self._loop.run_in_executor(self._executor, lambda: fn(self._local.data, *args))
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    @property
+    def loop(self):
+        return self._loop
+
+    @property
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self._start_time if self._start_time is not None else 0.0
+        return dict(
+            threads=self.threads,
+            queued=self._pending,
+            max_queued=self._max_in_flight,
+            queue_size=self._queue_size,
+            executed=self._executed,
+            busy_time=self._busy_time,
+            throughput=self._executed / elapsed if elapsed > 0 else 0.0,
+            busy=min(1.0, self._in_flight / self.max_in_flight),
+        )
+
+    def resize(self, threads: int):
+        # Nothing to resize: the concurrency is bounded by max_in_flight, not by threads
+        pass
+
+    def _task_done(self, future):
+        with self._cond:
+            self._tasks.discard(future)
+
+    def _thread_start(self):
+        with self._thread_lock:
+            index = self._thread_index
+            self._thread_index += 1
+
+        self._local.data = self.per_thread_callback(index) if self.per_thread_callback is not None else None
+
+    def _run(self, started: threading.Event):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._global = asyncio.Semaphore(self.max_in_flight)
+        started.set()
+
+        try:
+            self._loop.run_forever()
+
+            # Closing: cancel what is still running and let the module close its clients
+            tasks = [t for t in asyncio.all_tasks(self._loop) if not t.done()]
+            for t in tasks:
+                t.cancel()
+            if len(tasks) > 0:
+                self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+
+            if self.on_close is not None:
+                self._loop.run_until_complete(self.on_close())
+
+            self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+        finally:
+            self._loop.close()
+
+    async def _execute(self, entry: Any):
+        start = time.monotonic()
+        self._in_flight += 1
+        self._max_in_flight = max(self._max_in_flight, self._in_flight)
+        try:
+            await self.callback(engine=self, entry=entry)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            Logger.pl('{!} {R}async integrator error: %s{W}' % str(e))
+        finally:
+            self._in_flight -= 1
+            if self._slots is not None:
+                self._slots.release()
+
+            with self._cond:
+                self._executed += 1
+                self._busy_time += time.monotonic() - start
+                self._pending -= 1
+                self._cond.notify_all()
@@ -0,0 +1,135 @@
+import os
+import threading
+import time
+
+from filecrawler.libs.logger import Logger
+from filecrawler.libs.worker import Worker
+
+
+class AutoScaler(object):
+    '''
+    Grows and shrinks worker pools at runtime from their queue depth, busy ratio and
+    per item latency, within min/max bounds. Pools stop growing while the CPU is saturated.
+
+    A pool grows when its queue is full and its threads busy, or when the mean item latency
+    rises above its running average while the queue keeps growing: the items wait on
+    something (I/O, a remote service) and more threads overlap the waits
+    '''
+    interval = 2.0
+    cpu_high = 0.9
+    busy_high = 0.8
+    busy_low = 0.3
+    latency_rise = 1.5
+    latency_smoothing = 0.3
+    verbose = 0
+
+    def __init__(self, interval: float = 2.0, cpu_high: float = 0.9, verbose: int = 0):
+        self.interval = max(0.5, float(interval))
+        self.cpu_high = float(cpu_high)
+        self.verbose = verbose
+        self._pools = []
+        self._running = False
+        self._thread = None
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.stop()
+
+    def add_pool(self, name: str, worker: Worker, min_threads: int = 1, max_threads: int = 100):
+        min_threads = max(1, min_threads)
+        if min_threads > max_threads:
+            raise Exception(f'autoscale pool {name}: min threads {min_threads} > max threads {max_threads}')
+
+        self._pools.append(dict(
+            name=name,
+            worker=worker,
+            min=min_threads,
+            max=max_threads,
+            last=None,
+            latency=None,
+            backlog=0.0
+        ))
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    def _run(self):
+        last_cpu = sum(os.times()[:2])
+        last_time = time.monotonic()
+        while True:
+            with self._cond:
+                self._cond.wait(self.interval)
+                if not self._running:
+                    return
+
+            cpu_time = sum(os.times()[:2])
+            now = time.monotonic()
+            elapsed = max(0.001, now - last_time)
+            cpu = (cpu_time - last_cpu) / (elapsed * (os.cpu_count() or 1))
+            last_cpu, last_time = cpu_time, now
+
+            for p in self._pools:
+                try:
+                    self._scale(p, cpu, elapsed)
+                except Exception as e:
+                    Logger.pl('{!} {R}autoscaler error on pool {O}%s{R}: %s{W}' % (p['name'], str(e)))
+
+    def _scale(self, pool: dict, cpu: float, elapsed: float):
+        worker = pool['worker']
+        if not worker.running:
+            return
+
+        st = worker.stats
+        last = pool['last']
+        pool['last'] = st
+        if last is None:
+            return
+
+        executed = st['executed'] - last['executed']
+        busy_time = st['busy_time'] - last['busy_time']
+        busy = busy_time / (elapsed * st['threads'])
+        latency = busy_time / executed if executed > 0 else 0.0
+        queue_size = st['queue_size'] if st['queue_size'] > 0 else 1000
+        backlog = st['queued'] / queue_size
+
+        # Latency rising (against its running average) while the queue grows
+        average = pool['latency']
+        slower = average is not None and average > 0 and latency > average * self.latency_rise and \
+            backlog > pool['backlog'] and backlog >= 0.1
+        if executed > 0:
+            pool['latency'] = latency if average is None else \
+                average + self.latency_smoothing * (latency - average)
+        pool['backlog'] = backlog
+
+        threads = st['threads']
+        target = threads
+        reason = ''
+        if (backlog >= 0.5 and busy >= self.busy_high) or slower:
+            if cpu >= self.cpu_high:
+                reason = 'backlog but the CPU is saturated'
+            else:
+                target = min(pool['max'], threads + max(1, threads // 4))
+                reason = 'backlog' if not slower else 'latency rising with the backlog'
+        elif backlog < 0.1 and busy < self.busy_low:
+            target = max(pool['min'], threads - max(1, threads // 4))
+            reason = 'idle'
+
+        if target != threads:
+            worker.resize(target)
+
+        if target != threads or (reason != '' and self.verbose >= 1) or self.verbose >= 3:
+            Logger.pl('{?} {C}autoscale %s: {O}%s{C} -> {O}%s{C} tasks (%s) queue {O}%s{C}/%s, '
+                      'busy {O}%.0f%%{C}, latency {O}%.3fs{C}, {O}%.1f{C}/s, cpu {O}%.0f%%{W}' % (
+                        pool['name'], threads, target, reason if reason != '' else 'steady',
+                        st['queued'], queue_size, busy * 100, latency, executed / elapsed, cpu * 100))
@@ -0,0 +1,239 @@
+import json
+import threading
+import time
+from typing import Callable, Optional
+
+
+class BulkWriter(object):
+    '''
+    Buffer of elasticsearch bulk actions shared by every integration thread. The buffer is sent
+    through the _bulk endpoint when it has bulk_size documents, byte_size bytes or when it is
+    older than flush_interval seconds.
+
+    The actions of a file are added as one group (document, credentials and control document)
+    and the group callback receives the result of the whole group: callback(ok, retry, error).
+    retry is True when the failure is temporary (connection, 429 and 5xx): the file must be
+    integrated again later
+    '''
+
+    RETRY_STATUS = [429, 502, 503, 504]
+
+    class _Group(object):
+        def __init__(self, first: int, count: int, callback: Optional[Callable]):
+            self.first = first
+            self.count = count
+            self.callback = callback
+
+    bulk_size = 200
+    byte_size = 512 * 1024
+    flush_interval = 2.0
+    sent = 0
+    requests = 0
+    failed = 0
+
+    def __init__(self, send: Callable[[list], dict], bulk_size: int = 200, byte_size: int = 512 * 1024,
+                 flush_interval: float = 2.0):
+        '''
+        send: function receiving the operations list (action and source lines) and returning
+              the _bulk response, like Elasticsearch.bulk(operations=...)
+        '''
+        self._send = send
+        self.bulk_size = max(1, bulk_size)
+        self.byte_size = max(1, byte_size)
+        self.flush_interval = max(0.1, flush_interval)
+        self.sent = 0
+        self.requests = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._running = False
+        self._thread = None
+        self._reset()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def _reset(self):
+        self._operations = []
+        self._groups = []
+        self._actions = 0
+        self._bytes = 0
+        self._since = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        '''
+        Send what is left in the buffer and stop the flush timer
+        '''
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        self.flush()
+
+    def add(self, actions: list, callback: Optional[Callable] = None):
+        '''
+        Queue a group of actions, each one a tuple (action, source), e.g.
+        ({'index': {'_index': 'name', '_id': '1'}}, {'field': 'value'}). source is None for delete
+        '''
+        if len(actions) == 0:
+            return
+
+        # Estimated, the client serializes the request only once, when it is sent
+        size = 0
+        operations = []
+        for action, source in actions:
+            operations.append(action)
+            size += 100
+            if source is not None:
+                operations.append(source)
+                size += sum(len(k) + len(str(v)) for k, v in source.items())
+
+        batch = None
+        with self._lock:
+            if self._since is None:
+                self._since = time.monotonic()
+
+            self._groups.append(BulkWriter._Group(self._actions, len(actions), callback))
+            self._operations += operations
+            self._actions += len(actions)
+            self._bytes += size
+
+            if len(self._groups) >= self.bulk_size or self._bytes >= self.byte_size:
+                batch = self._take()
+
+        # Sent by the thread that filled the buffer, the others keep adding to a new one
+        if batch is not None:
+            self._flush(*batch)
+
+    def flush(self):
+        with self._lock:
+            batch = self._take()
+
+        if batch is not None:
+            self._flush(*batch)
+
+    def wait(self):
+        '''
+        Wait the requests already running in other threads
+        '''
+        with self._cond:
+            while self._pending > 0:
+                self._cond.wait(0.5)
+
+    def _take(self) -> Optional[tuple]:
+        if len(self._groups) == 0:
+            return None
+
+        batch = (self._operations, self._groups)
+        self._reset()
+        with self._cond:
+            self._pending += 1
+
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait(min(0.5, self.flush_interval))
+                if not self._running:
+                    return
+
+            batch = None
+            with self._lock:
+                if self._since is not None and time.monotonic() - self._since >= self.flush_interval:
+                    batch = self._take()
+
+            if batch is not None:
+                self._flush(*batch)
+
+    def _flush(self, operations: list, groups: list):
+        try:
+            items = []
+            error = None
+            try:
+                res = self._send(operations)
+                self.requests += 1
+                if isinstance(res, dict):
+                    items = res.get('items', None) or []
+                else:
+                    items = getattr(res, 'body', {}).get('items', None) or []
+            except Exception as e:
+                error = e
+
+            for g in groups:
+                ok, retry, g_error = True, False, error
+                if error is not None:
+                    ok, retry = False, True
+                else:
+                    g_items = items[g.first:g.first + g.count]
+                    for item in g_items + [None] * (g.count - len(g_items)):
+                        status, item_error = BulkWriter._get_status(item)
+                        if status is None or status >= 300:
+                            ok = False
+                            retry = retry or status is None or status in BulkWriter.RETRY_STATUS
+                            g_error = item_error if g_error is None else g_error
+
+                if ok:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+
+                if g.callback is not None:
+                    g.callback(ok, retry, g_error)
+        finally:
+            with self._cond:
+                self._pending -= 1
+                self._cond.notify_all()
+
+    @staticmethod
+    def _get_status(item: Optional[dict]) -> tuple:
+        if not isinstance(item, dict) or len(item) == 0:
+            return None, Exception('Missing item in the bulk response')
+
+        result = next(iter(item.values()))
+        status = result.get('status', None)
+        error = result.get('error', None)
+
+        return status, Exception(json.dumps(error)) if error is not None else None
+
+    @staticmethod
+    def parse_size(size: [str, int]) -> int:
+        '''
+        500K, 5M, 1G or a number of bytes
+        '''
+        size = str(size).strip().upper().rstrip('B')
+        units = {'K': 1024, 'M': 1024 * 1024, 'G': 1024 * 1024 * 1024}
+        if len(size) > 0 and size[-1] in units:
+            return int(float(size[:-1]) * units[size[-1]])
+
+        return int(float(size))
+
+    @staticmethod
+    def parse_interval(interval: [str, int, float]) -> float:
+        '''
+        500ms, 2s, 1m or a number of seconds
+        '''
+        interval = str(interval).strip().lower()
+        if interval.endswith('ms'):
+            return float(interval[:-2]) / 1000
+        if interval.endswith('s'):
+            return float(interval[:-1])
+        if interval.endswith('m'):
+            return float(interval[:-1]) * 60
+
+        return float(interval)
@@ -18,6 +18,7 @@ import shutil
 class ContainerFile(object):
     _file = None
     _temp_path = None
+    _extensions = None
     _defs = [
         dict(name='zip', extensions=['zip'], mime=['application/zip']),
         dict(name='rar', extensions=['rar'], mime=['application/x-rar-compressed', 'application/vnd.rar']),
@@ -59,6 +60,18 @@ class ContainerFile(object):
     def __str__(self):
         return str(self._file)
 
+    @staticmethod
+    def is_container_extension(extension: str) -> bool:
+        '''
+        Extension only check, used by the directory walker before any File is created
+        '''
+        if ContainerFile._extensions is None:
+            ContainerFile._extensions = frozenset(
+                e for x in ContainerFile._defs for e in x.get('extensions', [])
+            )
+
+        return extension in ContainerFile._extensions
+
     @staticmethod
     def is_container(file: File) -> bool:
         if not isinstance(file, File):
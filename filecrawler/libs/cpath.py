@@ -16,12 +16,23 @@ class CPath(object):
     _hash = None
     _path_real = None
     _path_virtual = None
-
-    def __init__(self, base_path: [str, Path],  path: [str, Path], container_path: TCPath = None):
+    _container_path = None
+
+    def __init__(self, base_path: [str, Path],  path: [str, Path], container_path: TCPath = None,
+                 resolved: bool = False):
+        '''
+        resolved: base_path and path are already absolute and resolved (directory walker),
+        so the resolve() calls and the existence check are skipped
+        '''
         self._path = Path(str(path))
-
-        base_path = str(Path(base_path).resolve())
-        self._path_real = str(self._path.resolve())
+        self._container_path = container_path
+
+        if resolved:
+            base_path = str(base_path)
+            self._path_real = str(path)
+        else:
+            base_path = str(Path(base_path).resolve())
+            self._path_real = str(self._path.resolve())
         self._path_virtual = self._path_real.replace(base_path, '').strip('\\/ ')
 
         if container_path is not None:
@@ -30,7 +41,7 @@ class CPath(object):
 
         self._path_virtual = '/' + self._path_virtual.replace('\\\\', '/').replace('\\', '/').replace('//', '/').lstrip('\\/ ')
 
-        if not self._path.exists():
+        if not resolved and not self._path.exists():
             from filecrawler.config import Configuration
             Color.pl('\n{!} {R}Error:{O} Path not found{W}'
                      '\n            {W}Real path.....: {G}%s{W}'
@@ -48,6 +59,10 @@ class CPath(object):
     def path(self) -> Path:
         return self._path
 
+    @property
+    def container_path(self) -> Optional[TCPath]:
+        return self._container_path
+
     @property
     def path_real(self) -> str:
         return self._path_real
@@ -1,8 +1,11 @@
 #!/usr/bin/python3
 # -*- coding: UTF-8 -*-
+import os
+import time
 from typing import Optional
 
-from .database import Database
+from .database import Database, write
+from .payload import Payload
 
 
 class CrawlerDB(Database):
@@ -14,14 +17,15 @@ class CrawlerDB(Database):
 
     _ALERT_COLUMNS = ['alert_id', 'index_id', 'file_fingerprint', 'fingerprint', 'data', 'sent']
 
-    def __init__(self, auto_create=True, db_name=None):
+    def __init__(self, auto_create=True, db_name=None, writer=None):
 
         if db_name is None:
             db_name = "filecrawler.db"
 
         super().__init__(
             auto_create=auto_create,
-            db_name=db_name
+            db_name=db_name,
+            writer=writer
         )
 
     def has_data(self) -> bool:
@@ -30,6 +34,7 @@ class CrawlerDB(Database):
     def check_open(self) -> bool:
         return self.select_count('file_index') >= 0
 
+    @write
     def insert_or_get_index(self, index_name: str) -> int:
 
         if index_name is None or index_name.strip() == '':
@@ -43,7 +48,13 @@ class CrawlerDB(Database):
 
         return self.select_first('index', **f).get('index_id', -1)
 
-    def insert_or_get_file(self, **data) -> Optional[dict]:
+    @write
+    def insert_or_get_file(self, fetch_existing: bool = True, **data) -> Optional[dict]:
+        '''
+        One INSERT ... ON CONFLICT DO UPDATE ... RETURNING per file (older SQLite: insert, update
+        and select). fetch_existing=False skips the select of a known file not changed, the data
+        received is returned with inserted=0
+        '''
         from filecrawler.config import Configuration
 
         if Configuration.disable_db:
@@ -53,51 +64,369 @@ class CrawlerDB(Database):
             if k not in self._FILE_INDEX_COLUMNS:
                 data.pop(k)
 
-        (inserted, updated) = self.insert_update_one_exclude('file_index',
-                                                             exclude_on_update=[
-                                                                 'indexing_date',
-                                                                 'created',
-                                                                 'last_accessed',
-                                                                 'last_modified',
-                                                                 'filename',
-                                                                 'extension',
-                                                                 'integrated',
-                                                                 'data',
-                                                                 'index_id'
-                                                             ],
-                                                             **data)
-
-        dt = self.select_first('file_index', fingerprint=data['fingerprint'])
+        exclude_on_update = [
+            'indexing_date',
+            'created',
+            'last_accessed',
+            'last_modified',
+            'filename',
+            'extension',
+            'integrated',
+            'data',
+            'index_id'
+        ]
+
+        if Database.RETURNING:
+            # indexing_date is new on every call and never updated: equal only when inserted
+            dt = self.upsert_one('file_index',
+                                 conflict=['index_id', 'fingerprint'],
+                                 exclude_on_update=exclude_on_update,
+                                 inserted_marker='indexing_date',
+                                 **data)
+            if dt is not None:
+                return dt
+
+            if not fetch_existing:
+                return {**data, **dict(inserted=0, updated=0)}
+
+            status = dict(inserted=0, updated=0)
+        else:
+            status = self.insert_update_one_exclude('file_index', exclude_on_update=exclude_on_update, **data)
+            if not fetch_existing and not status['inserted']:
+                return {**data, **status}
+
+        dt = self.select_first('file_index', index_id=data['index_id'], fingerprint=data['fingerprint'])
         if dt is None:
             return None
 
-        dt.update(dict(inserted=inserted, updated=updated))
+        dt.update(dict(inserted=status['inserted'], updated=status['updated']))
 
         return dt
 
+    @write
     def insert_or_get_alert(self, **data) -> Optional[dict]:
 
         for k in [k1 for k1 in data.keys()]:
             if k not in self._ALERT_COLUMNS:
                 data.pop(k)
 
-        (inserted, updated) = self.insert_update_one_exclude('alert',
-                                                             exclude_on_update=[
-                                                                 'file_fingerprint',
-                                                                 'data',
-                                                                 'sent',
-                                                                 'index_id'
-                                                             ],
-                                                             **data)
-
-        dt = self.select_first('alert', fingerprint=data['fingerprint'])
+        exclude_on_update = [
+            'file_fingerprint',
+            'data',
+            'sent',
+            'index_id'
+        ]
+
+        if Database.RETURNING:
+            # Nothing to update (DO NOTHING), a row is returned only when inserted
+            dt = self.upsert_one('alert',
+                                 conflict=['index_id', 'fingerprint'],
+                                 exclude_on_update=exclude_on_update,
+                                 **data)
+            if dt is not None:
+                return dt
+
+            status = dict(inserted=0, updated=0)
+        else:
+            status = self.insert_update_one_exclude('alert', exclude_on_update=exclude_on_update, **data)
+
+        dt = self.select_first('alert', index_id=data['index_id'], fingerprint=data['fingerprint'])
         if dt is None:
             return None
 
-        dt.update(dict(inserted=inserted, updated=updated))
+        dt.update(dict(inserted=status['inserted'], updated=status['updated']))
 
         return dt
 
+    @write
+    def set_pending(self, index_id: int, file_id: int, data: bytes):
+        '''
+        Store the payload of a file not integrated and queue it in the integration outbox,
+        both in the same transaction. A lease of the file is dropped: the integration that
+        holds it failed
+        '''
+        conn = self.connect_to_db()
+        conn.execute("UPDATE [file_index] SET integrated = 0, data = ? WHERE file_id = ?", (data, file_id))
+        conn.execute("INSERT OR REPLACE INTO [integration_outbox] (index_id, file_id) VALUES (?, ?)",
+                     (index_id, file_id))
+        self.commit(conn)
+
+    @write
+    def set_pending_fingerprint(self, index_id: int, fingerprint: str, data: bytes):
+        conn = self.connect_to_db()
+        conn.execute("UPDATE [file_index] SET integrated = 0, data = ? WHERE index_id = ? AND fingerprint = ?",
+                     (data, index_id, fingerprint))
+        conn.execute("INSERT OR REPLACE INTO [integration_outbox] (index_id, file_id) "
+                     "SELECT index_id, file_id FROM [file_index] WHERE index_id = ? AND fingerprint = ?",
+                     (index_id, fingerprint))
+        self.commit(conn)
+
+    @write
+    def fill_outbox(self, index_id: int) -> int:
+        '''
+        Queue the files left not integrated (older databases, or a crawl interrupted between
+        the payload and the outbox insert) and release the leases of an interrupted crawl
+        '''
+        conn = self.connect_to_db()
+        conn.execute("UPDATE [integration_outbox] SET lease_owner = NULL, lease_until = 0 WHERE index_id = ?",
+                     (index_id, ))
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO [integration_outbox] (index_id, file_id) "
+            "SELECT index_id, file_id FROM [file_index] WHERE index_id = ? AND integrated = 0", (index_id, ))
+        self.commit(conn)
+
+        return max(0, cursor.rowcount)
+
+    @write
+    def lease_integration(self, index_id: int, owner: str, limit: int = 100, timeout: float = 300) -> list:
+        '''
+        Lease up to limit files of the outbox: they are not leased again until the timeout
+        expires, so a batch lost by a crash comes back by itself
+        '''
+        now = time.time()
+        conn = self.connect_to_db()
+        select = ("SELECT outbox_id FROM [integration_outbox] WHERE index_id = ? AND lease_until <= ? "
+                  "ORDER BY outbox_id LIMIT ?")
+        if Database.RETURNING:
+            rows = conn.execute(
+                "UPDATE [integration_outbox] SET lease_owner = ?, lease_until = ?, attempts = attempts + 1 "
+                f"WHERE outbox_id IN ({select}) RETURNING file_id",
+                (owner, now + timeout, index_id, now, limit)).fetchall()
+        else:
+            ids = [r[0] for r in conn.execute(select, (index_id, now, limit)).fetchall()]
+            rows = []
+            if len(ids) > 0:
+                in_ids = ', '.join(['?'] * len(ids))
+                conn.execute(
+                    "UPDATE [integration_outbox] SET lease_owner = ?, lease_until = ?, attempts = attempts + 1 "
+                    f"WHERE outbox_id IN ({in_ids})", (owner, now + timeout, *ids))
+                rows = conn.execute(
+                    f"SELECT file_id FROM [integration_outbox] WHERE outbox_id IN ({in_ids})", ids).fetchall()
+        self.commit(conn)
+
+        return sorted([r[0] for r in rows])
+
+    @write
+    def complete_integration(self, owner: str, file_ids: list):
+        '''
+        Mark the leased files as integrated. A file queued again in the meantime (its lease
+        dropped by set_pending) is left in the outbox
+        '''
+        if len(file_ids) == 0:
+            return
+
+        in_ids = ', '.join(['?'] * len(file_ids))
+        conn = self.connect_to_db()
+        conn.execute(
+            "UPDATE [file_index] SET integrated = 1, data = NULL WHERE file_id IN ("
+            f"SELECT file_id FROM [integration_outbox] WHERE lease_owner = ? AND file_id IN ({in_ids}))",
+            (owner, *file_ids))
+        conn.execute(f"DELETE FROM [integration_outbox] WHERE lease_owner = ? AND file_id IN ({in_ids})",
+                     (owner, *file_ids))
+        self.commit(conn)
+
+    @write
+    def release_integration(self, owner: str, file_ids: list, delay: float = 0):
+        '''
+        Give the lease back: the files are leased again after delay seconds
+        '''
+        if len(file_ids) == 0:
+            return
+
+        in_ids = ', '.join(['?'] * len(file_ids))
+        conn = self.connect_to_db()
+        conn.execute(
+            "UPDATE [integration_outbox] SET lease_owner = NULL, lease_until = ? "
+            f"WHERE lease_owner = ? AND file_id IN ({in_ids})", (time.time() + delay, owner, *file_ids))
+        self.commit(conn)
+
+    def get_pending(self, file_ids: list) -> list:
+        if len(file_ids) == 0:
+            return []
+
+        in_ids = ', '.join(['?'] * len(file_ids))
+        rows = self.connect_to_db().execute(
+            f"SELECT file_id, path_virtual, data FROM [file_index] WHERE file_id IN ({in_ids})", file_ids).fetchall()
+
+        return [dict(file_id=r[0], path_virtual=r[1], data=r[2]) for r in rows]
+
+    def get_fingerprints(self, index_id: int):
+        '''
+        Fingerprints of an index, read in chunks: no list of the whole table in memory
+        '''
+        cursor = self.connect_to_db().execute(
+            'SELECT fingerprint FROM [file_index] WHERE index_id = ?', (index_id, ))
+        while rows := cursor.fetchmany(10000):
+            for r in rows:
+                yield r[0]
+
+    def get_file_hash(self, stats: os.stat_result) -> Optional[dict]:
+        '''
+        Hash cache lookup: hash and mime of a file not changed since it was hashed, or None
+        '''
+        from filecrawler.config import Configuration
+
+        if Configuration.disable_db:
+            return None
+
+        return self.select_first('file_hash', **self.get_stat_key(stats))
+
+    @write
+    def set_file_hash(self, stats: os.stat_result, hash: str, extension: str = None, mime_type: str = None):
+        from filecrawler.config import Configuration
+
+        if Configuration.disable_db or hash is None:
+            return
+
+        self.insert_replace_one('file_hash',
+                                **self.get_stat_key(stats),
+                                hash=hash,
+                                extension=extension if extension is not None else '',
+                                mime_type=mime_type if mime_type is not None else '')
+
+    def get_file_by_path(self, index_id: int, path_real: str, file_size: int) -> Optional[dict]:
+        '''
+        File already indexed at this path with the same size, or None
+        '''
+        from filecrawler.config import Configuration
+
+        if Configuration.disable_db:
+            return None
+
+        return self.select_first('file_index', index_id=index_id, path_real=path_real, file_size=file_size)
+
+    def get_prehash(self, prehash: str) -> Optional[dict]:
+        from filecrawler.config import Configuration
+
+        if Configuration.disable_db:
+            return None
+
+        return self.select_first('file_prehash', prehash=prehash)
+
+    @write
+    def set_prehash(self, **data):
+        from filecrawler.config import Configuration
+
+        if Configuration.disable_db:
+            return
+
+        self.insert_replace_one('file_prehash', **data)
+
+    @staticmethod
+    def get_stat_key(stats: os.stat_result) -> dict:
+        # SQLite integers are signed 64 bits, some filesystems use the whole unsigned range
+        return dict(
+            device=stats.st_dev - (stats.st_dev >> 63 << 64),
+            inode=stats.st_ino - (stats.st_ino >> 63 << 64),
+            file_size=stats.st_size,
+            mtime_ns=stats.st_mtime_ns
+        )
+
+    def upgrade_db(self):
+        '''
+        Create the tables added after the first release on older database files
+        '''
+        conn = self.connect_to_db()
+
+        cursor = conn.cursor()
+
+        # Hash cache, lets a re-crawl skip reading files not changed since the last run
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS [file_hash] (
+                device INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                file_size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                extension TEXT NOT NULL,
+                mime_type TEXT NOT NULL,
+                UNIQUE(device, inode)
+            );
+        """)
+        conn.commit()
+
+        # Pre-hash (size + first and last 64 KB) of large files, see PreHashIndex
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS [file_prehash] (
+                prehash TEXT NOT NULL,
+                path_real TEXT NOT NULL,
+                device INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                file_size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                UNIQUE(prehash)
+            );
+        """)
+        conn.commit()
+
+        # Files indexed before the pre-hash, looked up by path (see PreHashIndex)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_file_index_path_real
+            ON [file_index] (index_id, path_real);
+        """)
+        conn.commit()
+
+        # Files waiting for integration, leased in batches by the integrator (see lease_integration)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS [integration_outbox] (
+                outbox_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                index_id INTEGER NOT NULL,
+                file_id INTEGER NOT NULL,
+                lease_owner TEXT NULL,
+                lease_until REAL NOT NULL DEFAULT (0),
+                attempts INTEGER NOT NULL DEFAULT (0),
+                FOREIGN KEY(file_id) REFERENCES [file_index](file_id),
+                UNIQUE(file_id)
+            );
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_integration_outbox_lease
+            ON [integration_outbox] (index_id, lease_until);
+        """)
+        conn.commit()
+
+        #Must get the constraints
+        self.get_constraints()
+
+    def migrate_payloads(self, batch_size: int = 500) -> dict:
+        '''
+        Convert the pending payloads stored by older versions (base64 JSON as TEXT) to the
+        compressed format of Payload. Integrated rows just lose the data they do not need
+        '''
+        conn = self.connect_to_db()
+
+        cursor = conn.execute(
+            "UPDATE [file_index] SET data = NULL WHERE integrated = 1 AND typeof(data) = 'text'")
+        status = dict(cleared=max(0, cursor.rowcount), migrated=0, failed=0)
+        conn.commit()
+
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                "SELECT file_id, data FROM [file_index] "
+                "WHERE file_id > ? AND integrated = 0 AND typeof(data) = 'text' "
+                "ORDER BY file_id LIMIT ?", (last_id, batch_size)).fetchall()
+            if len(rows) == 0:
+                break
+
+            for file_id, data in rows:
+                try:
+                    data = Payload.decode(data)
+                except Exception:
+                    # Left as is, the integrator reports it
+                    status['failed'] += 1
+                    continue
+
+                conn.execute("UPDATE [file_index] SET data = ? WHERE file_id = ?", (
+                    Payload.encode(data) if data is not None else None, file_id))
+                status['migrated'] += 1
+
+            last_id = rows[-1][0]
+            conn.commit()
+
+        return status
+
     def create_db(self):
 
         conn = self.connect_to_db(check=False)
@@ -130,7 +459,7 @@ class CrawlerDB(Database):
                 indexing_date datetime NOT NULL,
                 path_real TEXT NOT NULL,
                 path_virtual TEXT NOT NULL,
-                data TEXT NULL,
+                data BLOB NULL,
                 integrated INTEGER NOT NULL DEFAULT (0),
                 FOREIGN KEY(index_id) REFERENCES [index](index_id),
                 UNIQUE(index_id, fingerprint)
@@ -180,5 +509,4 @@ class CrawlerDB(Database):
 
         conn.commit()
 
-        #Must get the constraints
-        self.get_constraints()
+        self.upgrade_db()
@@ -1,12 +1,13 @@
 #!/usr/bin/python3
 # -*- coding: UTF-8 -*-
 import math
-import shutil
 import sys, os.path
 import sqlite3
+import threading
 import string, base64
-from functools import reduce
+from functools import reduce, wraps
 from sqlite3 import Connection, OperationalError, IntegrityError, ProgrammingError
+from typing import Optional
 
 
 # TODO: use this decorator to wrap commit/rollback in a try/except block ?
@@ -29,6 +30,7 @@ def connect(func):
     inner func : function
     """
 
+    @wraps(func)
     def inner_func(self, *args, **kwargs):
         if f'{func.__module__}.{func.__qualname__}' != f'{Database.__module__}.{Database.__qualname__}.{func.__name__}':
             raise Exception('The connect decorator cannot be used outside of Database class')
@@ -45,6 +47,32 @@ def connect(func):
     return inner_func
 
 
+def write(func):
+    """Decorator to run a database change in the writer thread (see DBWriter).
+
+    When the instance has a writer the call is executed by the writer connection, inside
+    its current batch transaction, and this thread waits for the batch commit.
+
+    Parameters
+    ----------
+    func : function
+        function which changes the database
+
+    Returns
+    -------
+    inner func : function
+    """
+
+    @wraps(func)
+    def inner_func(self, *args, **kwargs):
+        if self.writer is not None:
+            return self.writer.execute(func.__name__, *args, **kwargs)
+
+        return func(self, *args, **kwargs)
+
+    return inner_func
+
+
 class Database(object):
     db_name = ""
 
@@ -52,9 +80,36 @@ class Database(object):
     db_connection = None
     constraints = []
 
-    def __init__(self, auto_create=True, db_name=None):
+    # Durability profiles, selected by profile
+    #   balanced: WAL journal, readers never block the writer and a crash never corrupts the
+    #             database. The last commits may be lost on a power loss
+    #   safe: WAL journal and a sync on every commit, survives power losses
+    #   fast: in-memory journal and no syncs. A crash in the middle of a commit can corrupt
+    #         the database, and readers are blocked while a transaction is open
+    PROFILES = {
+        'balanced': dict(journal_mode='WAL', synchronous='NORMAL'),
+        'safe': dict(journal_mode='WAL', synchronous='FULL'),
+        'fast': dict(journal_mode='MEMORY', synchronous='OFF'),
+    }
+    profile = 'balanced'
+
+    # INSERT/UPDATE ... RETURNING (upsert_one) needs SQLite 3.35
+    RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+    # Set when the changes are sent to a DBWriter
+    writer = None
+
+    # False for the DBWriter connection, it commits once per batch
+    autocommit = True
+
+    # Database files already copied to .bkp by this process
+    _backed_up = set()
+    _backup_lock = threading.Lock()
+
+    def __init__(self, auto_create=True, db_name=None, writer=None):
 
         self.db_name = db_name
+        self.writer = writer
 
         if not os.path.isfile(self.db_name):
             if auto_create:
@@ -72,6 +127,7 @@ class Database(object):
         # make sure the dbconnection gets closed
         self.db_connection.close()
 
+    @write
     @connect
     def insert_one(self, conn: Connection, table_name, **kwargs):
         table_name = self.scrub(table_name)
@@ -79,8 +135,9 @@ class Database(object):
         sql = "INSERT INTO [{}] ({}) VALUES ({})" \
             .format(table_name, ','.join(columns), ', '.join(['?'] * len(columns)))
         conn.execute(sql, values)
-        conn.commit()
+        self.commit(conn)
 
+    @write
     @connect
     def insert_ignore_one(self, conn: Connection, table_name, **kwargs):
         table_name = self.scrub(table_name)
@@ -88,8 +145,9 @@ class Database(object):
         sql = "INSERT OR IGNORE INTO [{}] ({}) VALUES ({})" \
             .format(table_name, ','.join(columns), ', '.join(['?'] * len(columns)))
         conn.execute(sql, values)
-        conn.commit()
+        self.commit(conn)
 
+    @write
     @connect
     def insert_replace_one(self, conn: Connection, table_name, **kwargs):
         table_name = self.scrub(table_name)
@@ -97,11 +155,12 @@ class Database(object):
         sql = "INSERT OR REPLACE INTO [{}] ({}) VALUES ({})" \
             .format(table_name, ','.join(columns), ', '.join(['?'] * len(columns)))
         conn.execute(sql, values)
-        conn.commit()
+        self.commit(conn)
 
     def insert_update_one(self, table_name: str, **kwargs):
         return self.insert_update_one_exclude(table_name, [], **kwargs)
 
+    @write
     @connect
     def insert_update_one_exclude(self, conn: Connection, table_name: str, exclude_on_update: list = [], **kwargs) -> dict:
         table_name = self.scrub(table_name)
@@ -125,13 +184,75 @@ class Database(object):
             if len(f_columns) > 0:
                 sql += " WHERE {}".format(f' and '.join([f'{col} = ?' for col in f_columns]))
             c = conn.execute(sql, tuple(u_values + f_values, ))
-            conn.commit()
+            self.commit(conn)
 
             status['updated'] = c.rowcount
 
-        conn.commit()
+        self.commit(conn)
         return status
 
+    @write
+    @connect
+    def upsert_one(self, conn: Connection, table_name: str, conflict: list, exclude_on_update: list = [],
+                   inserted_marker: str = None, **kwargs) -> Optional[dict]:
+        """Insert or update a row in one statement (INSERT ... ON CONFLICT DO UPDATE ... RETURNING).
+
+        Needs SQLite 3.35 (see RETURNING). Only a row that changed is written: None is returned
+        for an existing row whose columns already have these values.
+
+        Parameters
+        ----------
+        conflict : list
+            columns of the unique constraint
+        exclude_on_update : list
+            columns kept when the row exists
+        inserted_marker : str
+            column kept when the row exists whose value is unique to this call, tells an inserted
+            row from an updated one. Without it every row returned is flagged as inserted
+
+        Returns
+        -------
+        row : dict
+            row with the inserted and updated flags
+        """
+        table_name = self.scrub(table_name)
+        (columns, values) = self.parse_args(kwargs)
+        conflict = [f"[{self.scrub(c)}]" for c in conflict]
+        (u_columns, _) = self.parse_args({
+            k: v for k, v in kwargs.items()
+            if k not in exclude_on_update and f"[{self.scrub(k)}]" not in conflict
+        })
+
+        sql = "INSERT INTO [{}] ({}) VALUES ({}) ON CONFLICT({}) " \
+            .format(table_name, ','.join(columns), ', '.join(['?'] * len(columns)), ','.join(conflict))
+        if len(u_columns) == 0:
+            sql += "DO NOTHING"
+        else:
+            sql += "DO UPDATE SET {} WHERE {}".format(
+                ', '.join([f'{col} = excluded.{col}' for col in u_columns]),
+                ' or '.join([f'{col} IS NOT excluded.{col}' for col in u_columns]))
+
+        args = values
+        if inserted_marker is not None:
+            sql += f" RETURNING *, ([{self.scrub(inserted_marker)}] IS ?) AS [__inserted]"
+            args = tuple(values + (kwargs.get(inserted_marker, None),))
+        else:
+            sql += " RETURNING *, 1 AS [__inserted]"
+
+        cursor = conn.execute(sql, args)
+        data = cursor.fetchone()
+        columns = cursor.description
+        self.commit(conn)
+
+        if data is None:
+            return None
+
+        row = {columns[index][0]: column for index, column in enumerate(data)}
+        inserted = int(row.pop('__inserted', 1) or 0)
+        row.update(dict(inserted=inserted, updated=1 - inserted))
+
+        return row
+
     @connect
     def select(self, conn: Connection, table_name, **kwargs):
 
@@ -183,6 +304,7 @@ class Database(object):
 
         return int(data[0])
 
+    @write
     @connect
     def delete(self, conn: Connection, table_name, **kwargs) -> None:
 
@@ -195,8 +317,9 @@ class Database(object):
         if len(columns) > 0:
             sql += " WHERE {}".format(f' {operator} '.join([f'{col} = ?' for col in columns]))
         conn.execute(sql, values)
-        conn.commit()
+        self.commit(conn)
 
+    @write
     @connect
     def update(self, conn: Connection, table_name, filter_data, **kwargs):
 
@@ -207,11 +330,15 @@ class Database(object):
         (u_columns, u_values) = self.parse_args(kwargs)
 
         sql = f"UPDATE {table_name} SET "
-        sql += "[{}]".format(', '.join([f'{col} = ?' for col in u_columns]))
+        sql += "{}".format(', '.join([f'{col} = ?' for col in u_columns]))
         if len(f_columns) > 0:
             sql += " WHERE {}".format(f' {operator} '.join([f'{col} = ?' for col in f_columns]))
         conn.execute(sql, tuple(u_values + f_values, ))
-        conn.commit()
+        self.commit(conn)
+
+    def commit(self, conn: Connection):
+        if self.autocommit:
+            conn.commit()
 
     def get_constraints(self) -> dict:
         sql = ('SELECT '
@@ -262,6 +389,24 @@ class Database(object):
 
         return columns, tuple(values, )
 
+    def backup(self, conn: Connection):
+        '''
+        Copy the database to db_name.bkp once per process, with the SQLite backup API: unlike
+        a file copy it includes the commits still in the -wal file and is consistent while
+        other connections write
+        '''
+        with Database._backup_lock:
+            if self.db_name in Database._backed_up:
+                return
+
+            bkp = sqlite3.connect(f'{self.db_name}.bkp')
+            try:
+                conn.backup(bkp)
+            finally:
+                bkp.close()
+
+            Database._backed_up.add(self.db_name)
+
     def connect_to_db(self, check: bool = True) -> Connection:
         """Connect to a sqlite DB. Create the database if there isn't one yet.
 
@@ -291,22 +436,17 @@ class Database(object):
             except (AttributeError, ProgrammingError) as e:
                 raise Exception(f'Fail connecting to SQLite file: {self.db_name}', e)
 
-        shutil.copy(self.db_name, f'{self.db_name}.bkp')
+        self.backup(conn)
+
+        profile = Database.PROFILES.get(self.profile, Database.PROFILES['balanced'])
 
         cursor = conn.cursor()
         # www.sqlite.org/pragma.html
         # https://blog.devart.com/increasing-sqlite-performance.html
         cursor.execute("PRAGMA temp_store = MEMORY")
-        # cursor.execute("PRAGMA page_size = 4096")
-        # cursor.execute("PRAGMA cache_size = 10000")
-        #cursor.execute("PRAGMA locking_mode=EXCLUSIVE")
-        cursor.execute("PRAGMA synchronous=OFF")
-        cursor.execute("PRAGMA journal_mode=MEMORY")
-        # cursor.execute("PRAGMA foreign_keys=ON")
-
-        #cursor.execute("PRAGMA synchronous=OFF")
-        #cursor.execute("PRAGMA busy_timeout=15000")  # milliseconds
-        #cursor.execute("PRAGMA lock_timeout=5000")  # milliseconds
+        cursor.execute(f"PRAGMA journal_mode={profile['journal_mode']}")
+        cursor.execute(f"PRAGMA synchronous={profile['synchronous']}")
+        cursor.execute("PRAGMA busy_timeout=15000")  # milliseconds
 
         self.db_connection = conn
 
@@ -0,0 +1,203 @@
+import queue
+import threading
+import time
+
+from filecrawler.libs.crawlerdb import CrawlerDB
+
+
+class DBWriter(object):
+    '''
+    Single SQLite writer. The worker connections send their changes here (see the write
+    decorator) and this thread runs them in batch transactions, so there is no lock
+    contention between writers. Each change runs inside a savepoint, a failing change is
+    rolled back alone and its exception is raised in the calling thread. Any other error
+    (BEGIN, savepoints, rollback) stops the writer: the batch and the waiting changes fail
+    with it and execute raises from then on.
+
+    A batch is committed when it has batch_size changes, when it is open for flush_interval
+    seconds or when no more changes are waiting (group commit: under load the batches grow
+    while the previous commit runs)
+    '''
+
+    # Poison pill, makes the writer thread exit
+    _STOP = object()
+
+    class _Change(object):
+        def __init__(self, name: str, args: tuple, kwargs: dict):
+            self.name = name
+            self.args = args
+            self.kwargs = kwargs
+            self.result = None
+            self.error = None
+            self.done = threading.Event()
+
+    db_name = ''
+    batch_size = 500
+    flush_interval = 0.2
+    changes = 0
+    commits = 0
+
+    def __init__(self, db_name: str, batch_size: int = 500, flush_interval: float = 0.2):
+        self.db_name = db_name
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_interval)
+        self.changes = 0
+        self.commits = 0
+        self._q = queue.Queue()
+        self._thread = None
+        self._running = False
+        self._error = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def start(self):
+        started = dict(event=threading.Event(), error=None)
+
+        self._running = True
+        self._error = None
+        self._thread = threading.Thread(target=self._run, kwargs=dict(started=started))
+        self._thread.daemon = True
+        self._thread.start()
+
+        # A database error stops the crawl before it starts
+        started['event'].wait()
+        if started['error'] is not None:
+            self._running = False
+            raise started['error']
+
+    def close(self):
+        '''
+        Commit the pending changes and stop the writer thread
+        '''
+        with self._lock:
+            if not self._running:
+                return
+
+            self._running = False
+            self._q.put(DBWriter._STOP)
+
+        self._thread.join()
+
+    def execute(self, method: str, /, *args, **kwargs):
+        '''
+        Run the method of the writer connection and wait for its commit
+        '''
+        change = DBWriter._Change(method, args, kwargs)
+        with self._lock:
+            if not self._running:
+                if self._error is not None:
+                    raise Exception('The database writer stopped on error', self._error)
+                raise Exception('The database writer is closed')
+
+            self._q.put(change)
+
+        change.done.wait()
+
+        if change.error is not None:
+            raise change.error
+
+        return change.result
+
+    def _run(self, started: dict):
+        # SQLite connections can be used only by the thread that opened them
+        try:
+            db = CrawlerDB(auto_create=False, db_name=self.db_name)
+            db.autocommit = False
+        except Exception as e:
+            started['error'] = e
+            return
+        finally:
+            started['event'].set()
+
+        try:
+            with db:
+                self._loop(db)
+        except Exception as e:
+            # A failure outside a change (transaction control): the writer stops, execute raises it
+            self._error = e
+        finally:
+            with self._lock:
+                self._running = False
+
+            # Nobody else will run the changes left
+            error = Exception('The database writer is closed') if self._error is None else \
+                Exception('The database writer stopped on error', self._error)
+            while True:
+                try:
+                    change = self._q.get_nowait()
+                except queue.Empty:
+                    break
+
+                if change is not DBWriter._STOP:
+                    change.error = error
+                    change.done.set()
+
+    def _loop(self, db: CrawlerDB):
+        stop = False
+        while not stop:
+            change = self._q.get()
+            if change is DBWriter._STOP:
+                break
+
+            batch = [change]
+            deadline = time.monotonic() + self.flush_interval
+            conn = None
+            try:
+                conn = db.connect_to_db()
+                conn.execute('BEGIN')
+                while True:
+                    self._apply(db, conn, batch[-1])
+
+                    if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                        break
+
+                    try:
+                        change = self._q.get_nowait()
+                    except queue.Empty:
+                        break
+
+                    if change is DBWriter._STOP:
+                        stop = True
+                        break
+
+                    batch.append(change)
+
+                try:
+                    conn.commit()
+                    self.commits += 1
+                except Exception as e:
+                    conn.rollback()
+                    for c in batch:
+                        if c.error is None:
+                            c.error = e
+            except Exception as e:
+                # Nothing of the batch was committed
+                if conn is not None and conn.in_transaction:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        pass
+                for c in batch:
+                    c.error = e
+                raise
+            finally:
+                self.changes += len(batch)
+                for c in batch:
+                    c.done.set()
+
+    @staticmethod
+    def _apply(db: CrawlerDB, conn, change):
+        conn.execute('SAVEPOINT change')
+        try:
+            change.result = getattr(db, change.name)(*change.args, **change.kwargs)
+            conn.execute('RELEASE change')
+        except Exception as e:
+            conn.execute('ROLLBACK TO change')
+            conn.execute('RELEASE change')
+            change.error = e
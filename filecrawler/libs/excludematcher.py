@@ -0,0 +1,177 @@
+import re
+from pathlib import PurePath
+from typing import Iterable, Optional, Tuple, Union
+
+
+class ExcludeMatcher(object):
+    '''
+    Compiled form of Configuration.excludes, answering the same as
+    any(Path(path.lower()).match(x) for x in excludes).
+
+    Patterns like '*/*.ext' become a hash set of extensions and all the other globs are
+    translated (same right-anchored, per path part semantics of PurePath.match) into one
+    combined regex, so each check is a set lookup plus, at most, a single regex search.
+    '''
+    _patterns = ()
+    _extensions = {}
+    _regex = None
+    _groups = {}
+    _fallback = ()
+    _without = {}
+
+    def __init__(self, patterns: Iterable[str]):
+        self._patterns = tuple(p.lower().strip() for p in patterns if p is not None and p.strip() != '')
+        self._extensions = {}
+        self._groups = {}
+        self._without = {}
+
+        relative = []
+        absolute = []
+        fallback = []
+        for p in self._patterns:
+            ext = ExcludeMatcher._get_extension(p)
+            if ext is not None:
+                self._extensions.setdefault(ext, p)
+                continue
+
+            try:
+                anchored, r = ExcludeMatcher._translate(p)
+                re.compile(r)
+            except (re.error, ValueError):
+                fallback.append(p)
+                continue
+
+            name = f'p{len(self._groups)}'
+            self._groups[name] = p
+            (absolute if anchored else relative).append(f'(?P<{name}>{r})')
+
+        # Relative patterns match from the right, at a part boundary. Sharing the prefix is
+        # a lot faster than repeating it in every alternative
+        regexes = []
+        if len(relative) > 0:
+            regexes.append('(?:^|/)(?:' + '|'.join(relative) + ')$')
+        if len(absolute) > 0:
+            regexes.append('^/(?:' + '|'.join(absolute) + ')$')
+
+        self._regex = re.compile('|'.join(regexes)) if len(regexes) > 0 else None
+        self._fallback = tuple(fallback)
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def __str__(self):
+        return f'<{self.__class__.__qualname__} with {len(self._patterns)} patterns>'
+
+    @property
+    def patterns(self) -> Tuple[str, ...]:
+        return self._patterns
+
+    def is_excluded(self, path: Union[str, PurePath]) -> bool:
+        return self.get_match(path) is not None
+
+    def get_match(self, path: Union[str, PurePath]) -> Optional[str]:
+        '''
+        Return the pattern excluding this path or None
+        '''
+        if path is None:
+            return None
+
+        l_path = str(path).lower()
+        if '//' in l_path or '/./' in l_path or l_path[-2:] == '/.':
+            l_path = str(PurePath(l_path))
+        elif len(l_path) > 1:
+            l_path = l_path.rstrip('/')
+
+        if l_path == '.' or l_path == '':
+            return None
+
+        name = l_path.rpartition('/')[2]
+        if len(self._extensions) > 0 and '.' in name and '/' in l_path:
+            p = self._extensions.get(name.rpartition('.')[2], None)
+            if p is not None:
+                return p
+
+        if self._regex is not None:
+            m = self._regex.search(l_path)
+            if m is not None:
+                return self._groups[m.lastgroup]
+
+        if len(self._fallback) > 0:
+            pp = PurePath(l_path)
+            return next((x for x in self._fallback if pp.match(x)), None)
+
+        return None
+
+    def without(self, patterns: Iterable[str]) -> 'ExcludeMatcher':
+        '''
+        Matcher for the same list minus some patterns (cached)
+        '''
+        key = frozenset(p.lower().strip() for p in patterns)
+        if len(key) == 0:
+            return self
+
+        matcher = self._without.get(key, None)
+        if matcher is None:
+            matcher = ExcludeMatcher(x for x in self._patterns if x not in key)
+            self._without[key] = matcher
+
+        return matcher
+
+    @staticmethod
+    def _get_extension(pattern: str) -> Optional[str]:
+        # '*/*.ext' matches any path with two or more parts whose name ends with '.ext'
+        if not pattern.startswith('*/*.'):
+            return None
+
+        ext = pattern[4:]
+        if ext == '' or any(c in ext for c in '*?[]/.'):
+            return None
+
+        return ext
+
+    @staticmethod
+    def _translate(pattern: str) -> Tuple[bool, str]:
+        '''
+        Return (anchored, regex) where anchored means the pattern must match the whole path
+        '''
+        parts = [p for p in pattern.split('/') if p != '' and p != '.']
+        if len(parts) == 0:
+            raise ValueError('empty pattern')
+
+        return pattern.startswith('/'), '/'.join(ExcludeMatcher._translate_part(p) for p in parts)
+
+    @staticmethod
+    def _translate_part(part: str) -> str:
+        i, n = 0, len(part)
+        res = []
+        while i < n:
+            c = part[i]
+            i += 1
+            if c == '*':
+                while i < n and part[i] == '*':
+                    i += 1
+                res.append('[^/]*')
+            elif c == '?':
+                res.append('[^/]')
+            elif c == '[':
+                j = i
+                if j < n and part[j] == '!':
+                    j += 1
+                if j < n and part[j] == ']':
+                    j += 1
+                while j < n and part[j] != ']':
+                    j += 1
+                if j >= n:
+                    res.append('\\[')
+                else:
+                    stuff = part[i:j].replace('\\', '\\\\')
+                    i = j + 1
+                    if stuff[0] == '!':
+                        stuff = '^/' + stuff[1:]
+                    elif stuff[0] == '^':
+                        stuff = '\\' + stuff
+                    res.append(f'[{stuff}]')
+            else:
+                res.append(re.escape(c))
+
+        return ''.join(res)
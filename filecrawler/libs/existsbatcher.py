@@ -0,0 +1,159 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable
+
+
+class ExistsBatcher(object):
+    '''
+    Groups the existence checks of concurrent threads in one lookup (e.g. an elasticsearch
+    _mget): a check waits at most max_wait seconds for other ones, up to batch_size ids per
+    lookup. The ids found are kept in a bounded LRU cache, a cache hit needs no lookup.
+
+    A failed lookup raises its exception in every thread waiting for that batch
+    '''
+
+    _STOP = object()
+
+    class _Check(object):
+        def __init__(self, id: str):
+            self.id = id
+            self.found = False
+            self.error = None
+            self.done = threading.Event()
+
+    batch_size = 100
+    max_wait = 0.01
+    cache_size = 100000
+    lookups = 0
+    checks = 0
+    cache_hits = 0
+
+    def __init__(self, lookup: Callable[[list], Iterable], batch_size: int = 100, max_wait: float = 0.01,
+                 cache_size: int = 100000, concurrency: int = 4):
+        '''
+        lookup: function receiving a list of ids and returning the ones that exist
+        '''
+        self._lookup = lookup
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max(0.0, max_wait)
+        self.cache_size = max(0, cache_size)
+        self.lookups = 0
+        self.checks = 0
+        self.cache_hits = 0
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._q = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def close(self):
+        if not self._running:
+            return
+
+        self._running = False
+        self._q.put(ExistsBatcher._STOP)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def add(self, id: str):
+        '''
+        Cache an id known to exist (just indexed, or seeded at start)
+        '''
+        if self.cache_size == 0 or id is None:
+            return
+
+        with self._cache_lock:
+            self._cache[id] = True
+            self._cache.move_to_end(id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def seed(self, ids: Iterable):
+        for id in ids:
+            self.add(id)
+
+    def exists(self, id: str) -> bool:
+        self.checks += 1
+        with self._cache_lock:
+            if id in self._cache:
+                self._cache.move_to_end(id)
+                self.cache_hits += 1
+                return True
+
+        if not self._running:
+            raise Exception('The exists batcher is closed')
+
+        check = ExistsBatcher._Check(id)
+        self._q.put(check)
+        check.done.wait()
+
+        if check.error is not None:
+            raise check.error
+
+        if check.found:
+            self.add(id)
+
+        return check.found
+
+    @property
+    def cache_count(self) -> int:
+        return len(self._cache)
+
+    def _run(self):
+        stop = False
+        while not stop:
+            check = self._q.get()
+            if check is ExistsBatcher._STOP:
+                break
+
+            batch = [check]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                try:
+                    check = self._q.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+
+                if check is ExistsBatcher._STOP:
+                    stop = True
+                    break
+
+                batch.append(check)
+
+            self._executor.submit(self._check, batch)
+
+        # Nobody else will check the ids left
+        while True:
+            try:
+                check = self._q.get_nowait()
+            except queue.Empty:
+                break
+
+            if check is not ExistsBatcher._STOP:
+                check.error = Exception('The exists batcher is closed')
+                check.done.set()
+
+    def _check(self, batch: list):
+        try:
+            found = set(self._lookup(list({c.id for c in batch})))
+            self.lookups += 1
+            for c in batch:
+                c.found = c.id in found
+        except Exception as e:
+            for c in batch:
+                c.error = e
+        finally:
+            for c in batch:
+                c.done.set()
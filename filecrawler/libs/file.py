@@ -1,5 +1,6 @@
 import datetime
 import hashlib
+import mmap
 import os
 from pathlib import Path
 from typing import Optional
@@ -10,11 +11,22 @@ from filecrawler.util.tools import Tools
 
 
 class File(CPath):
+    # Files greater than this are mapped in memory instead of read
+    _MMAP_MIN_SIZE = 4 * 1024 * 1024
+    # Bytes used by the mime sniffer
+    _HEAD_SIZE = 2048
+    # Files greater than this are identified by the pre-hash unless it collides (see PreHashIndex)
+    _PREHASH_MIN_SIZE = 32 * 1024 * 1024
+    # Bytes taken from the start and the end of the file by the pre-hash
+    _PREHASH_BLOCK = 64 * 1024
+
     _hash = None
+    _prehash = None
     _fingerprint = None
     _stats = None
     _metadata = []
     _content = None
+    _head = None
     _mime_type = None
     _size = 0
     _credentials = []
@@ -25,15 +37,19 @@ class File(CPath):
                  base_path: [str, Path],
                  file_path: [str, Path],
                  container_path: CPath = None,
-                 info: str = None):
+                 info: str = None,
+                 stats: os.stat_result = None,
+                 resolved: bool = False):
         super().__init__(
             base_path=base_path,
             path=file_path,
-            container_path=container_path
+            container_path=container_path,
+            resolved=resolved
         )
         self._info = str(info) if info is not None else None
 
-        if not self._path.is_file():
+        # stats already taken by the directory walker (DirEntry.stat) tell us it is a regular file
+        if stats is None and not self._path.is_file():
             raise FileNotFoundError(f'Path is not a file instance: {self._path}')
 
         if isinstance(info, IntelXInfo.FileInfo):
@@ -41,10 +57,11 @@ class File(CPath):
             # Try to update file time from information received
             try:
                 os.utime(str(file_path), (self._overwrite_date, self._overwrite_date))
+                stats = None
             except:
                 pass
 
-        self._stats = self._path.stat()
+        self._stats = stats if stats is not None else self._path.stat()
         if self._overwrite_date is None:
             self._overwrite_date = self._stats.st_ctime
 
@@ -56,17 +73,33 @@ class File(CPath):
         if self._fingerprint is not None:
             return self._fingerprint
 
-        sha1sum = hashlib.sha1()
-        #sha1sum.update(f'{self.hash}_{self._path_virtual}'.encode("utf-8"))
-        sha1sum.update(f'{self.hash}_{self._path.name.lower()}'.encode("utf-8"))
-        self._fingerprint = sha1sum.hexdigest()
+        #self._fingerprint = File.get_fingerprint(self.hash, self._path_virtual)
+        self._fingerprint = File.get_fingerprint(self.hash, self._path.name)
 
         return self._fingerprint
 
+    @staticmethod
+    def get_fingerprint(hash: str, name: str) -> str:
+        sha1sum = hashlib.sha1()
+        sha1sum.update(f'{hash}_{name.lower()}'.encode("utf-8"))
+        return sha1sum.hexdigest()
+
     @property
     def size(self) -> int:
         return self._stats.st_size
 
+    @property
+    def stats(self) -> os.stat_result:
+        return self._stats
+
+    def set_hash(self, hash: str, mime_type: str = None):
+        '''
+        Hash (and mime) already known (hash cache, pre-hash), so the file is not read just to get them
+        '''
+        self._hash = hash
+        if mime_type is not None and mime_type != '':
+            self._mime_type = mime_type
+
     @property
     def hash(self):
         if self._path is None:
@@ -75,16 +108,86 @@ class File(CPath):
         if self._hash is not None:
             return self._hash
 
-        sha1sum = hashlib.sha1()
-        with open(self._path, 'rb') as source:
-            block = source.read(2 ** 16)
-            while len(block) != 0:
-                sha1sum.update(block)
-                block = source.read(2 ** 16)
-        self._hash = sha1sum.hexdigest()
+        self.read()
 
         return self._hash
 
+    @property
+    def prehash(self) -> str:
+        '''
+        SHA-1 of the size plus the first and the last 64 KB, cheap even for multi-GB files
+        '''
+        if self._path is None:
+            return None
+
+        if self._prehash is not None:
+            return self._prehash
+
+        sha1sum = hashlib.sha1(f'{self.size}:'.encode("utf-8"))
+        with open(self._path, 'rb') as source:
+            data = source.read(File._PREHASH_BLOCK)
+            sha1sum.update(data)
+            if self._head is None:
+                self._head = data[:File._HEAD_SIZE]
+
+            if self.size > File._PREHASH_BLOCK:
+                source.seek(max(File._PREHASH_BLOCK, self.size - File._PREHASH_BLOCK))
+                sha1sum.update(source.read(File._PREHASH_BLOCK))
+
+        self._prehash = sha1sum.hexdigest()
+
+        return self._prehash
+
+    @property
+    def content(self) -> bytes:
+        '''
+        File content limited to Configuration.indexed_chars
+        '''
+        if self._path is None:
+            return bytes()
+
+        if self._content is None:
+            self.read()
+
+        return self._content
+
+    def release_content(self):
+        '''
+        Drop the content buffer (read again if content is used later), hash and mime are kept
+        '''
+        self._content = None
+
+    def read(self):
+        '''
+        Read stage: open the file just once and feed the SHA-1, the mime sniffer and the
+        content buffer from the same data. Large files are mapped in memory and, when the
+        hash is already known, only the indexed part of them is touched.
+        '''
+        from filecrawler.config import Configuration
+
+        if self._hash is not None and self._content is not None:
+            return
+
+        limit = Configuration.indexed_chars
+        sha1sum = hashlib.sha1() if self._hash is None else None
+        with open(self._path, 'rb') as source:
+            size = os.fstat(source.fileno()).st_size
+            if size >= File._MMAP_MIN_SIZE:
+                with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    if sha1sum is not None:
+                        sha1sum.update(mm)
+                    self._head = mm[:File._HEAD_SIZE]
+                    self._content = mm[:limit] if limit > 0 else mm[:]
+            else:
+                data = source.read()
+                if sha1sum is not None:
+                    sha1sum.update(data)
+                self._head = data[:File._HEAD_SIZE]
+                self._content = data[:limit] if 0 < limit < len(data) else data
+
+        if sha1sum is not None:
+            self._hash = sha1sum.hexdigest()
+
     @property
     def extension(self) -> Optional[str]:
         if self._path is None:
@@ -100,7 +203,15 @@ class File(CPath):
         if self._mime_type is not None:
             return self._mime_type
 
-        self._mime_type = Tools.get_mime(str(self._path))
+        if self._head is None and self._hash is None and self.size <= File._MMAP_MIN_SIZE:
+            # Small file, read everything now to do not open it again to hash and parse
+            self.read()
+
+        if self._head is not None:
+            self._mime_type = Tools.get_mimes(self._head, extension=self.extension)
+        else:
+            self._mime_type = Tools.get_mime(str(self._path))
+
         return self._mime_type
 
     @property
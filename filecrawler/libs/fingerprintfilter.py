@@ -0,0 +1,108 @@
+import hashlib
+import math
+import threading
+
+
+class FingerprintFilter(object):
+    '''
+    Bloom filter of the fingerprints already in file_index for the current index.
+
+    A negative answer is exact: the fingerprint was never inserted, so the dedup lookups
+    (SQLite, elasticsearch) are skipped. A positive answer may be wrong with the configured
+    false positive rate and must be checked. The bit positions come from the 20 bytes of
+    the SHA-1 digest (the fingerprint itself when it is a SHA-1 hex string). When a filter
+    is full a new one twice as large is added, so the false positive rate holds while the
+    crawl inserts new files
+    '''
+
+    # Bits and hash positions of each filter
+    _filters = []
+    _lock = None
+    false_positive_rate = 0.001
+    enabled = False
+    count = 0
+
+    def __init__(self, capacity: int = 100000, false_positive_rate: float = 0.001):
+        self.false_positive_rate = min(max(false_positive_rate, 0.0000001), 0.5)
+        self._filters = []
+        self._lock = threading.Lock()
+        self.count = 0
+        self.enabled = True
+        self._add_filter(max(1000, capacity))
+
+    def _add_filter(self, capacity: int):
+        # Each new filter gets half of the remaining error budget: the sum stays under the rate
+        rate = self.false_positive_rate / (2 ** (len(self._filters) + 1))
+        bits = int(math.ceil(-capacity * math.log(rate) / (math.log(2) ** 2)))
+        hashes = max(1, int(round(bits / capacity * math.log(2))))
+        self._filters.append(dict(
+            capacity=capacity,
+            count=0,
+            bits=bits,
+            hashes=hashes,
+            data=bytearray((bits + 7) // 8)
+        ))
+
+    @staticmethod
+    def _digest(fingerprint: str) -> tuple:
+        try:
+            digest = bytes.fromhex(fingerprint)
+            if len(digest) < 16:
+                raise ValueError()
+        except (ValueError, TypeError):
+            digest = hashlib.sha1(str(fingerprint).encode('utf-8', 'ignore')).digest()
+
+        # Double hashing: position i = h1 + i * h2
+        return int.from_bytes(digest[0:8], 'little'), int.from_bytes(digest[8:16], 'little') | 1
+
+    @staticmethod
+    def _positions(f: dict, h1: int, h2: int):
+        bits = f['bits']
+        return ((h1 + i * h2) % bits for i in range(f['hashes']))
+
+    def add(self, fingerprint: str):
+        if not self.enabled or fingerprint is None:
+            return
+
+        h1, h2 = FingerprintFilter._digest(fingerprint)
+        with self._lock:
+            f = self._filters[-1]
+            if f['count'] >= f['capacity']:
+                self._add_filter(f['capacity'] * 2)
+                f = self._filters[-1]
+
+            data = f['data']
+            for p in FingerprintFilter._positions(f, h1, h2):
+                data[p >> 3] |= 1 << (p & 7)
+
+            f['count'] += 1
+            self.count += 1
+
+    def might_contain(self, fingerprint: str) -> bool:
+        '''
+        False when the fingerprint is surely unknown. Always True when the filter is disabled
+        '''
+        if not self.enabled:
+            return True
+
+        if fingerprint is None:
+            return False
+
+        h1, h2 = FingerprintFilter._digest(fingerprint)
+        for f in self._filters:
+            data = f['data']
+            if all(data[p >> 3] & (1 << (p & 7)) for p in FingerprintFilter._positions(f, h1, h2)):
+                return True
+
+        return False
+
+    @property
+    def memory_usage(self) -> int:
+        return sum(len(f['data']) for f in self._filters)
+
+    @classmethod
+    def disabled(cls) -> 'FingerprintFilter':
+        f = cls(capacity=1000)
+        f._filters = []
+        f.enabled = False
+        return f
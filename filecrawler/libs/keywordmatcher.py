@@ -0,0 +1,95 @@
+import re
+from typing import Iterable, Iterator, Tuple
+
+
+class KeywordMatcher(object):
+    '''
+    Case-insensitive keyword matcher over one compiled regex.
+
+    All keywords are compiled into one alternation (longest first) and, at each position
+    starting a match, the shorter keywords that are prefixes of the matched one are reported
+    as well, so every occurrence (overlapping ones included) of every keyword is found.
+
+    This is not an automaton: the regex engine tries the alternatives one after the other at
+    each position, so the cost grows with the text size times the number of keywords. It is
+    faster than one scan per keyword because the loop runs in C, in a single pass.
+    '''
+    _keywords = ()
+    _prefixes = {}
+    _pattern = None
+    _pattern_ci = None
+
+    def __init__(self, keywords: Iterable[str]):
+        kw = set()
+        for k in keywords:
+            if k is None or k == '':
+                continue
+            kw.add(k.lower())
+
+        # Longest first, so the alternation always picks the longest keyword at a position
+        self._keywords = tuple(sorted(kw, key=lambda k: (-len(k), k)))
+
+        self._prefixes = {
+            k: tuple(k1 for k1 in self._keywords if k1 != k and k.startswith(k1))
+            for k in self._keywords
+        }
+
+        self._pattern = None
+        self._pattern_ci = None
+        if len(self._keywords) > 0:
+            alternation = '|'.join(re.escape(k) for k in self._keywords)
+            self._pattern = re.compile(alternation)
+            self._pattern_ci = re.compile(alternation, flags=re.IGNORECASE)
+
+    def __len__(self):
+        return len(self._keywords)
+
+    def __str__(self):
+        return f'<{self.__class__.__qualname__} with {len(self._keywords)} keywords>'
+
+    @property
+    def keywords(self) -> Tuple[str, ...]:
+        return self._keywords
+
+    def iter(self, text: str) -> Iterator[Tuple[str, int]]:
+        '''
+        Yield (keyword, offset) for every keyword occurrence, ordered by offset
+        '''
+        if self._pattern is None or text is None or len(text) == 0:
+            return
+
+        # Lower the text only once, a case-sensitive search is a lot faster than (?i)
+        l_text = text.lower()
+        search = self._pattern.search
+        if len(l_text) != len(text):
+            # Some chars changed its size when lowered, so the offsets would not match the original text
+            l_text = text
+            search = self._pattern_ci.search
+
+        pos = 0
+        while True:
+            m = search(l_text, pos)
+            if m is None:
+                return
+
+            k = m.group(0).lower()
+            p = m.start()
+            yield k, p
+            for k1 in self._prefixes[k]:
+                yield k1, p
+
+            pos = p + 1
+
+    def search(self, text: str) -> dict:
+        '''
+        Single pass over the text returning {keyword: [offsets]} for the keywords found
+        '''
+        hits = {}
+        for k, p in self.iter(text):
+            o = hits.get(k, None)
+            if o is None:
+                hits[k] = [p]
+            else:
+                o.append(p)
+
+        return hits
@@ -0,0 +1,117 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+
+class MemoryFile(object):
+    '''
+    In-memory counterpart of File, used to parse git blobs and other buffers without writing
+    them to disk. A path is only created when a parser really asks for one: a memfd on Linux
+    (nothing touches the disk) or a temporary file on the other platforms or when real_path is set.
+    '''
+    _data = None
+    _name = ''
+    _real_path = False
+    _fd = None
+    _tmp_name = None
+    _path = None
+    _hash = None
+
+    def __init__(self, data: [bytes, bytearray, memoryview], name: str = '', real_path: bool = False):
+        self._data = memoryview(data if data is not None else bytes())
+        self._name = name if name is not None else ''
+        self._real_path = real_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def __str__(self):
+        return str(self._path) if self._path is not None else f'<memory:{self._name}>'
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def extension(self) -> Optional[str]:
+        return Path(self._name).suffix.lower().strip('. ')
+
+    @property
+    def size(self) -> int:
+        return self._data.nbytes
+
+    @property
+    def data(self) -> memoryview:
+        return self._data
+
+    @property
+    def content(self) -> bytes:
+        '''
+        Content limited to Configuration.indexed_chars, like File.content
+        '''
+        from filecrawler.config import Configuration
+
+        if 0 < Configuration.indexed_chars < self._data.nbytes:
+            return self._data[:Configuration.indexed_chars].tobytes()
+
+        return self._data.tobytes()
+
+    @property
+    def hash(self) -> str:
+        if self._hash is None:
+            self._hash = hashlib.sha1(self._data).hexdigest()
+        return self._hash
+
+    @property
+    def path(self) -> Path:
+        if self._path is not None:
+            return self._path
+
+        if not self._real_path and hasattr(os, 'memfd_create'):
+            try:
+                self._fd = os.memfd_create(f'filecrawler_{self._name}'[:200])
+                self._write(self._fd)
+                # /proc/<pid>/ instead of /proc/self/ so child processes (javap etc) can open it too
+                self._path = Path(f'/proc/{os.getpid()}/fd/{self._fd}')
+                return self._path
+            except OSError:
+                self.close()
+
+        fd, self._tmp_name = tempfile.mkstemp(prefix='filecrawler_', suffix=Path(self._name).suffix)
+        try:
+            self._write(fd)
+        finally:
+            os.close(fd)
+        self._path = Path(self._tmp_name)
+        return self._path
+
+    def _write(self, fd: int):
+        view = self._data
+        while view.nbytes > 0:
+            written = os.write(fd, view)
+            view = view[written:]
+
+    def close(self):
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = None
+
+        if self._tmp_name is not None:
+            # Database.connect_to_db leaves a .bkp copy beside the file (SQLite3Parser)
+            for f in [self._tmp_name, f'{self._tmp_name}.bkp']:
+                try:
+                    if os.path.exists(f):
+                        os.unlink(f)
+                except OSError:
+                    pass
+            self._tmp_name = None
+
+        self._path = None
@@ -5,21 +5,32 @@ class Parser(object):
     parser = ''
     qualname = ''
     _class = ''
+    _instance = None
     extensions = []
     mime_types = []
 
-    def __init__(self, name, description, parser, qualname, class_name, extensions, mime_types):
+    def __init__(self, name, description, parser, qualname, class_name, extensions, mime_types, instance=None):
         self.name = name
         self.description = description
         self.parser = parser
         self.qualname = qualname
         self._class = class_name
+        self._instance = instance
         self.extensions = [x.lower().strip(' .') for x in extensions]
         self.mime_types = [m.lower().strip(' .') for m in mime_types]
 
     def __str__(self):
         return self.name
 
+    @property
+    def instance(self):
+        '''
+        Shared parser instance (parsers are stateless), built once by ParserBase.list_parsers
+        '''
+        if self._instance is None:
+            self._instance = self._class()
+        return self._instance
+
     def create_instance(self):
         return self._class()
 
@@ -0,0 +1,104 @@
+import base64
+import json
+import struct
+import zlib
+from typing import Optional, Union
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class Payload(object):
+    '''
+    Binary format of the documents waiting for integration (file_index.data).
+
+    Header: magic (4 bytes), format version (1 byte), codec (1 byte) and size of the
+    uncompressed JSON (4 bytes), followed by the compressed JSON. Rows written before this
+    format (base64 of the JSON, stored as TEXT) are still decoded
+    '''
+
+    MAGIC = b'FCP\x00'
+    VERSION = 1
+    CODECS = {
+        'none': 0,
+        'zlib': 1,
+        'zstd': 2,
+    }
+
+    # Favor speed: the payload lives only until the integration succeeds
+    LEVELS = {
+        'none': 0,
+        'zlib': 1,
+        'zstd': 3,
+    }
+
+    _HEADER = struct.Struct('<4sBBI')
+
+    codec = 'zlib'
+    level = 1
+
+    @classmethod
+    def setup(cls, codec: str = 'zlib', level: Optional[int] = None):
+        if codec not in cls.available_codecs():
+            raise Exception(f'Invalid payload compression {codec}, use one of: {", ".join(cls.available_codecs())}')
+
+        cls.codec = codec
+        cls.level = int(level) if level is not None else cls.LEVELS[codec]
+
+    @classmethod
+    def available_codecs(cls) -> list:
+        return [c for c in cls.CODECS.keys() if c != 'zstd' or zstandard is not None]
+
+    @classmethod
+    def encode(cls, data: dict) -> bytes:
+        from filecrawler.util.tools import Tools
+
+        raw = json.dumps(data, default=Tools.json_serial).encode("utf-8")
+
+        if cls.codec == 'zstd':
+            body = zstandard.ZstdCompressor(level=cls.level).compress(raw)
+        elif cls.codec == 'zlib':
+            body = zlib.compress(raw, cls.level)
+        else:
+            body = raw
+
+        return cls._HEADER.pack(cls.MAGIC, cls.VERSION, cls.CODECS[cls.codec], len(raw)) + body
+
+    @classmethod
+    def decode(cls, payload: Union[bytes, str, None]) -> Optional[dict]:
+        '''
+        Document stored by encode (or by the old base64 format), None when empty
+        '''
+        if payload is None or len(payload) == 0:
+            return None
+
+        if isinstance(payload, memoryview):
+            payload = payload.tobytes()
+
+        if isinstance(payload, str) or not payload.startswith(cls.MAGIC):
+            # Legacy format
+            if isinstance(payload, bytes):
+                payload = payload.decode("utf-8")
+            if payload.strip() == '':
+                return None
+            return json.loads(base64.b64decode(payload).decode("utf-8"))
+
+        _, version, codec, size = cls._HEADER.unpack_from(payload)
+        if version != cls.VERSION:
+            raise Exception(f'Unsupported payload version {version}')
+
+        body = memoryview(payload)[cls._HEADER.size:]
+        if codec == cls.CODECS['zlib']:
+            raw = zlib.decompress(body, bufsize=max(size, 1))
+        elif codec == cls.CODECS['zstd']:
+            if zstandard is None:
+                raise Exception('Payload compressed with zstd but the zstandard package is not installed')
+            raw = zstandard.ZstdDecompressor().decompress(body, max_output_size=size)
+        elif codec == cls.CODECS['none']:
+            raw = body
+        else:
+            raise Exception(f'Unsupported payload codec {codec}')
+
+        return json.loads(bytes(raw).decode("utf-8"))
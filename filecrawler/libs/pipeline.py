@@ -0,0 +1,117 @@
+from typing import Any
+
+from filecrawler.libs.worker import Worker
+
+
+class PipelineItem(object):
+    '''
+    Unit of work handed from one pipeline stage to the next
+    '''
+    file = None
+    path = None
+    row = None
+    parser = None
+    data = None
+    credentials = None
+
+    def __init__(self, file: Any = None, path: Any = None, row: dict = None, data: dict = None):
+        '''
+        file: File being crawled, path: CPath of the git repository a blob came from
+        '''
+        self.file = file
+        self.path = path
+        self.row = row
+        self.data = data if data is not None else {}
+        self.parser = None
+        self.credentials = None
+
+    @property
+    def path_virtual(self) -> str:
+        if self.file is not None:
+            return self.file.path_virtual
+        return self.data.get('path_virtual', '')
+
+
+class Pipeline(object):
+    '''
+    Chain of Workers, each stage has its own thread pool and bounded queue.
+    A stage callback receives (entry, db, forward) and calls forward(item) for every
+    item the next stage must receive.
+    '''
+    stages = []
+    __running = False
+
+    def __init__(self):
+        self.stages = []
+        self.__running = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def add_stage(self, name: str, callback: Any, threads: int = 1, queue_size: int = 0,
+                  per_thread_callback: Any = None):
+        '''
+        per_thread_callback: called once per stage thread, its result is passed to the callback as db
+        '''
+        if callback is None or not callable(callback):
+            raise Exception(f'stage {name} is not callable')
+
+        index = len(self.stages)
+        self.stages.append((name, Worker(
+            callback=lambda worker, entry, thread_callback_data, thread_count, **kwargs: callback(
+                entry=entry, db=thread_callback_data, forward=lambda item: self.__forward(index, item)),
+            per_thread_callback=per_thread_callback,
+            threads=threads,
+            queue_size=queue_size
+        )))
+
+    def __forward(self, index: int, item) -> bool:
+        # The last stage has nowhere to send its items
+        if index + 1 >= len(self.stages):
+            return True
+
+        return self.stages[index + 1][1].add_item(item)
+
+    def start(self, **kwargs):
+        if len(self.stages) == 0:
+            raise Exception('The pipeline has no stages')
+
+        self.__running = True
+        for _, w in self.stages:
+            w.start(**kwargs)
+
+    def add_item(self, item) -> bool:
+        '''
+        Queue an item at the first stage, blocking while its queue is full
+        '''
+        if not self.__running:
+            return False
+
+        return self.stages[0][1].add_item(item)
+
+    def wait_finish(self) -> bool:
+        # Items only move forward, so once a stage is idle nothing else reaches the next one
+        for _, w in self.stages:
+            if not w.wait_finish():
+                return False
+
+        return self.__running
+
+    def close(self):
+        self.__running = False
+        for _, w in self.stages:
+            w.close()
+
+    @property
+    def running(self):
+        return self.__running and all(w.running for _, w in self.stages)
+
+    @property
+    def stats(self) -> dict:
+        '''
+        Queue depth and throughput metrics by stage
+        '''
+        return {name: w.stats for name, w in self.stages}
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import threading
+from typing import Optional
+
+from filecrawler.libs.crawlerdb import CrawlerDB
+from filecrawler.libs.file import File
+
+
+class PreHashIndex(object):
+    '''
+    Two-tier identity for large files.
+
+    The pre-hash (size + first and last 64 KB) of every large file is kept here (memory and
+    the file_prehash table). A file whose pre-hash was never seen is identified by it and is
+    never fully hashed. Only when the pre-hash collides with another file both full SHA-1 are
+    computed: equal contents share the first file identity (same fingerprint, as before) and
+    different contents get the full SHA-1, so (index_id, fingerprint) stays unique.
+
+    Files indexed before the pre-hash existed keep their full SHA-1: the first time such a
+    file is seen its full hash is checked against the fingerprint already stored for its
+    path, and on a match the full hash is used (the hash cache keeps it for the next runs).
+    '''
+    _entries = {}
+    _in_flight = {}
+    _lock = None
+
+    def __init__(self):
+        self._entries = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def get_hash(self, db: CrawlerDB, file: File, index_id: int) -> str:
+        prehash = file.prehash
+        key = CrawlerDB.get_stat_key(file.stats)
+
+        # Only the lookup and the claim of the entry hold the lock: the database and the full
+        # hash of a collision wait for this entry alone, not for every large file
+        entry = self._claim(prehash, key)
+        if entry is not None:
+            return self._resolve(entry, file)
+
+        try:
+            entry = self._entries.get(prehash, None)
+            if entry is None:
+                entry = db.get_prehash(prehash)
+
+            if entry is None:
+                legacy_hash = PreHashIndex._get_legacy_hash(db, file, index_id)
+                if legacy_hash is not None:
+                    return legacy_hash
+
+                entry = dict(prehash=prehash, path_real=str(file.path), hash='', **key)
+                db.set_prehash(**entry)
+                with self._lock:
+                    self._entries[prehash] = entry
+                return prehash
+
+            with self._lock:
+                self._entries[prehash] = entry
+            if all(entry[k] == v for k, v in key.items()):
+                # Same file seen before
+                return prehash
+
+            # Collision, only the full content tells if it is a copy of the known file
+            if entry['hash'] == '':
+                full_hash = PreHashIndex._get_full_hash(entry) or ''
+                if full_hash != '':
+                    db.set_prehash(**dict(entry, hash=full_hash))
+                    entry['hash'] = full_hash
+        finally:
+            self._release(prehash)
+
+        return self._resolve(entry, file)
+
+    def _claim(self, prehash: str, key: dict) -> Optional[dict]:
+        '''
+        Return the known entry when it answers without the database, otherwise wait for the
+        thread working on this pre-hash and take it over (None is returned, _release ends it)
+        '''
+        while True:
+            with self._lock:
+                entry = self._entries.get(prehash, None)
+                if entry is not None and (entry['hash'] != '' or all(entry[k] == v for k, v in key.items())):
+                    return entry
+
+                event = self._in_flight.get(prehash, None)
+                if event is None:
+                    self._in_flight[prehash] = threading.Event()
+                    return None
+
+            event.wait()
+
+    def _release(self, prehash: str):
+        with self._lock:
+            self._in_flight.pop(prehash).set()
+
+    @staticmethod
+    def _resolve(entry: dict, file: File) -> str:
+        if all(entry[k] == v for k, v in CrawlerDB.get_stat_key(file.stats).items()):
+            return entry['prehash']
+
+        if entry['hash'] != '' and entry['hash'] == file.hash:
+            return entry['prehash']
+
+        return file.hash
+
+    @staticmethod
+    def _get_legacy_hash(db: CrawlerDB, file: File, index_id: int) -> Optional[str]:
+        '''
+        Full hash of a file already indexed by it (fingerprint of the full SHA-1), or None
+        '''
+        row = db.get_file_by_path(index_id, file.path_real, file.size)
+        if row is None:
+            return None
+
+        full_hash = file.hash
+        return full_hash if File.get_fingerprint(full_hash, file.path.name) == row['fingerprint'] else None
+
+    @staticmethod
+    def _get_full_hash(entry: dict) -> Optional[str]:
+        # The known file must still be the one that generated the pre-hash
+        try:
+            path = entry['path_real']
+            if any(entry[k] != v for k, v in CrawlerDB.get_stat_key(os.stat(path)).items()):
+                return None
+
+            sha1sum = hashlib.sha1()
+            with open(path, 'rb') as source:
+                while data := source.read(1024 * 1024):
+                    sha1sum.update(data)
+
+            return sha1sum.hexdigest()
+        except OSError:
+            return None
@@ -0,0 +1,128 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Optional
+
+
+class ProcessPool(object):
+    '''
+    Process pool (--executor process) for the CPU-bound work: rule scanning and parsing of
+    git blobs. Every process loads the rules and parsers once at start and the documents are
+    handed over in shared memory. The processes never touch the database, the stage threads
+    keep their own connections (thread_start_callback)
+    '''
+
+    # Static
+    _executor = None
+    _futures = set()
+    _lock = threading.Lock()
+
+    @classmethod
+    def start(cls, processes: int):
+        from filecrawler.config import Configuration
+
+        with cls._lock:
+            if cls._executor is not None:
+                return
+
+            # spawn: forking a process with running threads (and libmagic handles) is not safe
+            cls._executor = ProcessPoolExecutor(
+                max_workers=max(1, processes),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_initialize,
+                initargs=(ProcessPool._get_config(Configuration),)
+            )
+
+            # Start every process now, so the first files do not wait for the rules being loaded
+            for f in [cls._executor.submit(_ping) for _ in range(max(1, processes))]:
+                f.result()
+
+    @classmethod
+    def shutdown(cls):
+        with cls._lock:
+            if cls._executor is None:
+                return
+
+            # Work not started yet is dropped (shutdown cancel_futures needs Python 3.9)
+            for f in list(cls._futures):
+                f.cancel()
+            cls._executor.shutdown(wait=True)
+            cls._executor = None
+            cls._futures.clear()
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return cls._executor is not None
+
+    @classmethod
+    def lookup_credentials(cls, data: [str, bytes]) -> Optional[dict]:
+        if isinstance(data, str):
+            data = data.encode('utf-8', 'ignore')
+
+        if data is None or len(data) == 0:
+            return None
+
+        return cls._submit(_lookup_credentials, data)
+
+    @classmethod
+    def parse_from_bytes(cls, parser_name: str, data: [bytes, memoryview], name: str = '') -> Optional[dict]:
+        return cls._submit(_parse_from_bytes, data, parser_name, name)
+
+    @classmethod
+    def _submit(cls, fn, data: [bytes, memoryview], *args):
+        shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        try:
+            shm.buf[:len(data)] = data
+            future = cls._executor.submit(fn, shm.name, len(data), *args)
+            cls._futures.add(future)
+            future.add_done_callback(cls._futures.discard)
+            return future.result()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    @staticmethod
+    def _get_config(configuration) -> dict:
+        # Just plain values, the processes are spawned and must receive the loaded configuration
+        return {
+            k: v for k, v in vars(configuration).items()
+            if not k.startswith('_') and isinstance(v, (str, int, float, bool, list, dict, Path))
+        }
+
+
+def _initialize(config: dict):
+    from filecrawler.config import Configuration
+    from filecrawler.parserbase import ParserBase
+    from filecrawler.rulebase import RuleBase
+
+    for k, v in config.items():
+        setattr(Configuration, k, v)
+
+    RuleBase.list_rules()
+    ParserBase.list_parsers()
+
+
+def _ping():
+    return True
+
+
+def _read(shm_name: str, size: int) -> bytes:
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        return bytes(shm.buf[:size])
+    finally:
+        shm.close()
+
+
+def _lookup_credentials(shm_name: str, size: int) -> Optional[dict]:
+    from filecrawler.parserbase import ParserBase
+
+    return ParserBase.lookup_credentials(_read(shm_name, size))
+
+
+def _parse_from_bytes(shm_name: str, size: int, parser_name: str, name: str) -> Optional[dict]:
+    from filecrawler.parserbase import ParserBase
+
+    return ParserBase.list_parsers()[parser_name].instance.parse_from_bytes(_read(shm_name, size), name=name)
@@ -8,13 +8,15 @@ class Rule(object):
     _rule = ''
     _qualname = ''
     _class = None
+    _instance = None
 
-    def __init__(self, id: str, name: str, rule: str, qualname: str, class_name: type):
+    def __init__(self, id: str, name: str, rule: str, qualname: str, class_name: type, instance=None):
         self._id = id
         self._name = name
         self._rule = rule
         self._qualname = qualname
         self._class = class_name
+        self._instance = instance
 
     @property
     def id(self) -> str:
@@ -27,5 +29,14 @@ class Rule(object):
     def __str__(self):
         return f'<{self._name} id {self._id}>'
 
+    @property
+    def instance(self):
+        '''
+        Shared (frozen) rule instance, built once per process by RuleBase.list_rules
+        '''
+        if self._instance is None:
+            self._instance = self._class().freeze()
+        return self._instance
+
     def create_instance(self):
         return self._class()
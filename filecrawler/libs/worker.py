@@ -5,17 +5,31 @@ import threading
 
 
 class Worker:
+    # Poison pill, makes a worker thread exit
+    _STOP = object()
+
     __running = False
     q = None
     __total = 0
     __count = 0
+    __pending = 0
+    __cond = None
+    __busy_time = 0.0
+    __max_count = 0
+    __start_time = None
+    __alive = None
+    __resize_lock = None
+    __kwargs = None
     threads = 1
     callback = None
     per_thread_callback = None
     inserted = []
     threads_status = {}
 
-    def __init__(self, callback: Any = None, per_thread_callback: Any = None, threads=2):
+    def __init__(self, callback: Any = None, per_thread_callback: Any = None, threads=2, queue_size: int = 0):
+        '''
+        queue_size: maximum of queued items (0 is unbounded), add_item blocks while the queue is full
+        '''
         if callback is None or not callable(callback):
             raise Exception('worker is not callable')
 
@@ -24,9 +38,15 @@ class Worker:
 
         self.callback = callback
         self.per_thread_callback = per_thread_callback
-        self.q = queue.Queue()
+        self.q = queue.Queue(maxsize=queue_size if queue_size > 0 else 0)
         self.threads = threads
+        self.threads_status = {}
         self.total = 0
+        self.__pending = 0
+        self.__cond = threading.Condition()
+        self.__alive = {}
+        self.__resize_lock = threading.Lock()
+        self.__kwargs = {}
         if self.threads <= 1:
             self.threads = 1
 
@@ -37,9 +57,27 @@ class Worker:
         self.close()
 
     def add_item(self, item) -> bool:
-        self.q.put(item)
-        self.__total += 1
-        return True
+        '''
+        Queue an item, blocking while the queue is full. Returns False if the worker was closed
+        '''
+        if not self.__running:
+            return False
+
+        with self.__cond:
+            self.__pending += 1
+
+        while self.__running:
+            try:
+                self.q.put(item, timeout=0.5)
+                self.__total += 1
+                if self.q.qsize() > self.__max_count:
+                    self.__max_count = self.q.qsize()
+                return True
+            except queue.Full:
+                pass
+
+        self.__done(1)
+        return False
 
     def start(self, **kwargs):
 
@@ -48,11 +86,39 @@ class Worker:
 
         self.__running = True
         self.__count = 0
-        for i in range(self.threads):
-            self.threads_status[i] = False
-            t = threading.Thread(target=self.__worker, kwargs=dict(index=i, **kwargs))
-            t.daemon = True
-            t.start()
+        self.__busy_time = 0.0
+        self.__max_count = 0
+        self.__start_time = time.monotonic()
+        self.__kwargs = kwargs
+        self.resize(self.threads)
+
+    def resize(self, threads: int):
+        '''
+        Change the number of threads while running. Extra threads exit after their current item
+        '''
+        with self.__resize_lock:
+            self.threads = max(1, threads)
+            if not self.__running:
+                return
+
+            for i in range(self.threads):
+                if i in self.__alive:
+                    continue
+
+                self.threads_status[i] = False
+                t = threading.Thread(target=self.__worker, kwargs=dict(index=i, **self.__kwargs))
+                t.daemon = True
+                self.__alive[i] = t
+                t.start()
+
+    def __retire(self, index) -> bool:
+        with self.__resize_lock:
+            if index < self.threads:
+                return False
+
+            self.__alive.pop(index, None)
+            self.threads_status.pop(index, None)
+            return True
 
     def __worker(self, index, **kwargs):
         tcb = None
@@ -61,12 +127,24 @@ class Worker:
 
         thread_count = 0
         while self.__running:
-            entry = self.q.get()
+            if self.__retire(index):
+                return
+
+            try:
+                entry = self.q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            if entry is Worker._STOP:
+                self.q.task_done()
+                break
 
             if entry is None:
                 self.q.task_done()
+                self.__done(1)
                 continue
 
+            start = time.monotonic()
             try:
                 self.threads_status[index] = True
                 self.callback(worker=self, entry=entry, thread_callback_data=tcb, thread_count=thread_count, **kwargs)
@@ -76,10 +154,26 @@ class Worker:
                 self.__count += 1
                 self.q.task_done()
                 self.threads_status[index] = False
+                self.__done(1, time.monotonic() - start)
+
+    def __done(self, count: int, busy_time: float = 0.0):
+        with self.__cond:
+            self.__busy_time += busy_time
+            self.__pending -= count
+            if self.__pending <= 0:
+                self.__pending = 0
+                self.__cond.notify_all()
 
     @property
     def count(self):
-        return len(self.q.queue)
+        return self.q.qsize()
+
+    @property
+    def pending(self):
+        '''
+        Items queued or being executed
+        '''
+        return self.__pending
 
     @property
     def executed(self):
@@ -90,24 +184,60 @@ class Worker:
         return self.__running
 
     @property
-    def executing(self):
-        return next((
-            v for _, v in self.threads_status.items()
-            if v
-        ), False)
-
-    def wait_finish(self):
-        while self.running and self.executed < 1 and self.count > 0:
-            time.sleep(0.3)
+    def stats(self) -> dict:
+        '''
+        Queue depth and throughput metrics
+        '''
+        elapsed = time.monotonic() - self.__start_time if self.__start_time is not None else 0.0
+        return dict(
+            threads=self.threads,
+            queued=self.q.qsize(),
+            max_queued=self.__max_count,
+            queue_size=self.q.maxsize,
+            executed=self.__count,
+            busy_time=self.__busy_time,
+            throughput=self.__count / elapsed if elapsed > 0 else 0.0,
+            busy=self.__busy_time / (elapsed * self.threads) if elapsed > 0 else 0.0,
+        )
 
-        while self.running and self.count > 0:
-            time.sleep(0.300)
+    @property
+    def executing(self):
+        return self.__pending > self.q.qsize()
+
+    def wait_finish(self, timeout: float = None) -> bool:
+        '''
+        Block until every queued item was executed (or the worker is closed).
+        Returns False if the timeout expired before
+        '''
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.__cond:
+            while self.__running and self.__pending > 0:
+                wait = 1
+                if deadline is not None:
+                    wait = deadline - time.monotonic()
+                    if wait <= 0:
+                        return False
+
+                # Short waits so the main thread still receives KeyboardInterrupt
+                self.__cond.wait(min(wait, 1))
 
-        while self.executing:
-            time.sleep(0.300)
+        return True
 
     def close(self):
         self.__running = False
         self.inserted = []
         with self.q.mutex:
+            cleared = len(self.q.queue)
             self.q.queue.clear()
+            self.q.unfinished_tasks = max(0, self.q.unfinished_tasks - cleared)
+            self.q.all_tasks_done.notify_all()
+            self.q.not_full.notify_all()
+
+        self.__done(cleared)
+
+        # Wake up the threads waiting for items
+        for _ in range(self.threads):
+            try:
+                self.q.put_nowait(Worker._STOP)
+            except queue.Full:
+                break
@@ -7,6 +7,7 @@ from pathlib import Path
 from typing import Optional
 
 from filecrawler.libs.file import File
+from filecrawler.libs.memoryfile import MemoryFile
 from filecrawler.libs.parser import Parser
 from filecrawler.rulebase import RuleBase
 from filecrawler.libs.color import Color
@@ -20,8 +21,15 @@ class ParserBase(object):
     extensions = []
     mime_types = []
 
+    # Set when the parser needs a real file on disk to parse data received by
+    # parse_from_bytes, otherwise the path is created in memory (memfd on Linux)
+    real_path = False
+
     #Static
     _parsers = {}
+    _mime_map = {}
+    _extension_map = {}
+    _default = None
 
     def __init__(self, name, description):
         self.name = name
@@ -30,35 +38,20 @@ class ParserBase(object):
 
     @classmethod
     def get_parser_instance(cls, file_extension: str, mime: str):
-        from filecrawler.parsers.default import DefaultParser
-
-        if file_extension is None and mime is None:
-            return DefaultParser()
+        cls.list_parsers()
 
-        if file_extension is None:
-            file_extension = ''
-        else:
-            file_extension = file_extension.strip()
+        # Mime type wins over extension
+        if mime is not None:
+            p = ParserBase._mime_map.get(mime.strip(' .').lower(), None)
+            if p is not None:
+                return p
 
-        if mime is None:
-            mime = ''
-        else:
-            mime = mime.strip()
+        if file_extension is not None:
+            p = ParserBase._extension_map.get(file_extension.strip(' .').lower(), None)
+            if p is not None:
+                return p
 
-        cls.list_parsers()
-        return next(
-            (
-                p.create_instance() for k, p in ParserBase._parsers.items()
-                if mime != '' and p.is_valid(extension='', mime=mime, mime_only=True)
-            )
-            , next(
-                (
-                    p.create_instance() for k, p in ParserBase._parsers.items()
-                    if file_extension != '' and p.is_valid(extension=file_extension)
-                )
-                , DefaultParser()
-            )
-        )
+        return ParserBase._default
 
     @classmethod
     def get_base_parsers(cls) -> str:
@@ -104,27 +97,41 @@ class ParserBase(object):
                     qualname=str(iclass.__qualname__),
                     class_name=iclass,
                     extensions=t.extensions,
-                    mime_types=t.mime_types
+                    mime_types=t.mime_types,
+                    instance=t
                 )
 
+            # Dispatch tables, the first parser found keeps the key (same order as the parsers list)
+            mime_map = {}
+            extension_map = {}
+            for k, p in parsers.items():
+                for m in p.mime_types:
+                    if m != '':
+                        mime_map.setdefault(m, p.instance)
+                for e in p.extensions:
+                    if e != '':
+                        extension_map.setdefault(e, p.instance)
+
+            from filecrawler.parsers.default import DefaultParser
+            ParserBase._default = next((
+                p.instance for k, p in parsers.items()
+                if p.instance.__class__ is DefaultParser
+            ), DefaultParser())
+
+            ParserBase._mime_map = mime_map
+            ParserBase._extension_map = extension_map
             ParserBase._parsers = parsers
             return ParserBase._parsers
 
         except Exception as e:
             raise Exception('Error listing parsers', e)
 
-    def parse(self, file: File) -> dict:
+    def parse(self, file: [File, MemoryFile]) -> dict:
         raise Exception('Method "parse" is not yet implemented.')
 
-    def parse_from_bytes(self, file_data: bytes) -> dict:
-        import tempfile
-        with tempfile.NamedTemporaryFile(mode="wb") as tmp_parser:
-            tmp_parser.write(file_data)
-
-            return self.parse(File(
-                base_path=os.path.dirname(tmp_parser.name),
-                file_path=tmp_parser.name
-            ))
+    def parse_from_bytes(self, file_data: [bytes, memoryview], name: str = '') -> dict:
+        with MemoryFile(file_data, name=name, real_path=self.real_path) as mf:
+            return self.parse(mf)
 
     @classmethod
     def lookup_credentials(cls, data: [str, bytes]) -> Optional[dict]:
@@ -186,18 +193,13 @@ class ParserBase(object):
         return data
 
     @classmethod
-    def get_readable_data(cls, file: [File, bytes]) -> str:
-        from filecrawler.config import Configuration
-
-        if isinstance(file, File):
-            with open(file.path, 'rb') as f:
-                if Configuration.indexed_chars > 0:
-                    bData = f.read(Configuration.indexed_chars)
-                else:
-                    bData = f.read()
-        elif isinstance(file, bytes):
+    def get_readable_data(cls, file: [File, MemoryFile, bytes, memoryview]) -> str:
+        if isinstance(file, (File, MemoryFile)):
+            # Shared buffer, already limited to indexed_chars
+            bData = file.content
+        elif isinstance(file, (bytes, bytearray, memoryview)):
             bData = file
         else:
             bData = bytes()
 
-        return bData.decode('utf-8', 'ignore')
+        return str(bData, 'utf-8', 'ignore')
@@ -13,7 +13,7 @@ class CertificateParser(ParserBase):
         data = {'content': self.get_readable_data(file)}
         return self._parse(data, file.path.read_bytes())
 
-    def parse_from_bytes(self, file_data: bytes) -> dict:
+    def parse_from_bytes(self, file_data: bytes, name: str = '') -> dict:
         data = {'content': self.get_readable_data(file_data)}
         return self._parse(data, file_data)
 
@@ -8,6 +8,7 @@ from filecrawler.parserbase import ParserBase
 class SQLite3Parser(ParserBase):
     extensions = []
     mime_types = ['application/vnd.sqlite3']
+    real_path = True
 
     def __init__(self):
         super().__init__('SQLite3 Parser', 'Parser for SQLite3 files')
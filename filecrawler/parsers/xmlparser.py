@@ -27,7 +27,7 @@ class XMLParser(ParserBase):
 
         return data
 
-    def parse_from_bytes(self, file_data: bytes) -> dict:
+    def parse_from_bytes(self, file_data: bytes, name: str = '') -> dict:
         from filecrawler.config import Configuration
         data = {'content': self.get_readable_data(file_data)}
 
@@ -25,7 +25,7 @@ class YamlParser(ParserBase):
 
         return data
 
-    def parse_from_bytes(self, file_data: bytes) -> dict:
+    def parse_from_bytes(self, file_data: bytes, name: str = '') -> dict:
         data = {'content': self.get_readable_data(file_data)}
 
         try:
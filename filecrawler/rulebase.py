@@ -5,11 +5,13 @@ import os
 import importlib
 import pkgutil
 import re
+import threading
 from pathlib import Path
 from re import Pattern
 from typing import Iterator, Optional, TypeVar
 
 from filecrawler._exceptions import FalsePositiveError
+from filecrawler.libs.keywordmatcher import KeywordMatcher
 from filecrawler.libs.rule import Rule
 from filecrawler.libs.color import Color
 from filecrawler.libs.logger import Logger
@@ -53,8 +55,20 @@ class RuleBase(object):
     _exclude_keywords = []
     _severity = 70
 
+    # Keyword window scan (Configuration.keyword_window_scan): the regex runs only over the text
+    # around each keyword hit. Must be greater than the max length of a match and can be set only
+    # when every match contains one of the keywords. None means the whole text is always scanned
+    _window_radius = None
+
+    # Filled by freeze()
+    _frozen = False
+    _l_keywords = ()
+    _l_exclude_keywords = ()
+
     # Static
     _rules = {}
+    _rules_lock = threading.Lock()
+    _matcher = None
 
     def __init__(self, id: str, name: str):
         self._name = name
@@ -66,6 +80,29 @@ class RuleBase(object):
 
         return f'{self._name} <{self._id}>'
 
+    def __setattr__(self, key, value):
+        if self._frozen:
+            raise AttributeError(f'Rule [{self._id}] is frozen, attribute {key} cannot be changed')
+        super().__setattr__(key, value)
+
+    def freeze(self) -> TRuleBase:
+        '''
+        Turn this instance into an immutable, thread-safe object. Keywords and exclusions are
+        stored as lowercase tuples so run() does not need to rebuild them on every call
+        '''
+        if self._frozen:
+            return self
+
+        self._keywords = tuple(self._keywords if self._keywords is not None else [])
+        self._exclude_keywords = tuple(self._exclude_keywords if self._exclude_keywords is not None else [])
+        self._l_keywords = tuple(k.lower() for k in self._keywords)
+        self._l_exclude_keywords = tuple(x.lower() for x in self._exclude_keywords)
+        self._tps = tuple(self._tps)
+        self._fps = tuple(self._fps)
+        self._frozen = True
+
+        return self
+
     def post_processor(self, original_data: str, found: str) -> dict:
         return {}
 
@@ -85,6 +122,10 @@ class RuleBase(object):
     def keywords(self) -> Iterator[str]:
         return self._keywords
 
+    @property
+    def window_radius(self) -> Optional[int]:
+        return self._window_radius
+
     @classmethod
     def get_base_rule(cls) -> str:
         file = Path(__file__).stem
@@ -99,6 +140,24 @@ class RuleBase(object):
         if RuleBase._rules is not None and len(RuleBase._rules) > 0:
             return RuleBase._rules
 
+        with RuleBase._rules_lock:
+            if RuleBase._rules is not None and len(RuleBase._rules) > 0:
+                return RuleBase._rules
+
+            return RuleBase._load_rules(verbose)
+
+    @classmethod
+    def get_rule(cls, id: str) -> Optional[TRuleBase]:
+        # Do not trigger the rule loading here, this is also called by post processors during validation
+        rule = RuleBase._rules.get(id, None) if RuleBase._rules is not None else None
+        if rule is None:
+            return None
+
+        return rule.instance
+
+    @classmethod
+    def _load_rules(cls, verbose: int = 0) -> dict:
+
         base_rules = RuleBase.get_base_rule()
 
         rules = {}
@@ -120,7 +179,7 @@ class RuleBase(object):
             if verbose >= 2:
                 Color.pl('{?} Loading rule: %s' % f'{iclass.__module__}.{iclass.__qualname__}')
             try:
-                t = iclass()
+                t = iclass().freeze()
                 if t.id in rules:
                     raise Exception(f'Duplicated rule id [{t.id}]: {iclass.__module__}.{iclass.__qualname__}')
 
@@ -132,6 +191,7 @@ class RuleBase(object):
                     rule=str(iclass.__module__),
                     qualname=str(iclass.__qualname__),
                     class_name=iclass,
+                    instance=t,
                 )
             except Exception as e:
                 from filecrawler.config import Configuration
@@ -141,9 +201,30 @@ class RuleBase(object):
                 if not Configuration.continue_on_error:
                     raise e
 
+        # One automaton with the keywords of all rules, must exist before publishing the rules
+        RuleBase._matcher = KeywordMatcher(
+            k for r in rules.values() for k in r.instance.keywords
+        )
+
         RuleBase._rules = rules
         return RuleBase._rules
 
+    @classmethod
+    def get_matcher(cls) -> KeywordMatcher:
+        cls.list_rules()
+        return RuleBase._matcher
+
+    def get_keyword_hits(self, hits: dict) -> Optional[dict]:
+        '''
+        Filter the result of KeywordMatcher.search to the keywords of this rule.
+        Return None if this rule is not a candidate
+        '''
+        r_hits = {k: hits[k] for k in self._l_keywords if k in hits}
+        if len(r_hits) == 0:
+            return None
+
+        return r_hits
+
     def validate(self, verbose: int = 0):
         for tp in self._tps:
             r = self.run(tp)
@@ -176,20 +257,55 @@ class RuleBase(object):
                 self.run(fp, verbose=True)
                 raise Exception(f'Failed to validate (fp) [{self.id}]')
 
+        if self._window_radius is not None:
+            self.validate_window(verbose)
+
+    def validate_window(self, verbose: int = 0):
+        try:
+            from re import _parser as sre_parse
+        except ImportError:
+            import sre_parse
+
+        if self._regex is not None:
+            max_width = sre_parse.parse(self._regex.pattern, self._regex.flags).getwidth()[1]
+            if max_width >= self._window_radius:
+                raise Exception((f'Failed to validate. For rule ID [{self.id}], window radius '
+                                 f'{self._window_radius} must be greater than the regexp max width {max_width}'))
+
+        # Both scan modes must return exactly the same findings
+        matcher = KeywordMatcher(self._keywords)
+        for t in self._tps + self._fps:
+            hits = self.get_keyword_hits(matcher.search(t))
+            r1 = self.run(t, window_scan=False)
+            r2 = self.run(t, keyword_hits=hits, window_scan=True) if hits is not None else None
+            if r1 != r2:
+                raise Exception(f'Failed to validate. For rule ID [{self.id}], window scan result differs for [{t}]')
+
+        if verbose >= 2:
+            Color.pl('{?} {W}Window scan OK for {O}%s{W} (radius %s)' % (self, self._window_radius))
+
     @classmethod
     def detect(cls, text: str) -> Optional[dict]:
         '''
         Run rule defined by inherited class
         '''
-        cls.list_rules()
+        rules = cls.list_rules()
+
+        # Just one case-insensitive pass over the text to find the candidate rules
+        hits = RuleBase._matcher.search(text)
+        if len(hits) == 0:
+            return None
 
         findings = {}
-        for k, rule in cls._rules.items():
-            inst = rule.create_instance()
-            ret = inst.run(text)
+        for rule in rules.values():
+            inst = rule.instance
+            keyword_hits = inst.get_keyword_hits(hits)
+            if keyword_hits is None:
+                continue
+
+            ret = inst.run(text, keyword_hits=keyword_hits)
             if ret is not None and len(ret) > 0:
-                findings.update({inst.id: dict(name=str(inst), findings=ret)})
-            del inst
+                findings[inst.id] = dict(name=str(inst), findings=ret)
 
         if len(findings) == 0:
             return None
@@ -282,37 +398,66 @@ class RuleBase(object):
 
         return ent
 
-    def run(self, text: str, verbose: bool = False) -> Optional[list]:
+    def get_windows(self, keyword_hits: dict, size: int) -> list:
+        '''
+        Merged [start, end] windows around the keyword offsets, ordered by start
+        '''
+        radius = self._window_radius
+        windows = []
+        for o in sorted(o for ol in keyword_hits.values() for o in ol):
+            start = o - radius if o > radius else 0
+            end = o + radius if o + radius < size else size
+            if len(windows) > 0 and start <= windows[-1][1]:
+                windows[-1][1] = end
+            else:
+                windows.append([start, end])
+
+        return windows
+
+    def run(self, text: str, verbose: bool = False, keyword_hits: Optional[dict] = None,
+            window_scan: Optional[bool] = None) -> Optional[list]:
+        '''
+        Run this rule over the text. keyword_hits is the already filtered KeywordMatcher result
+        (see get_keyword_hits), when it is informed the keyword pre filter is skipped.
+        window_scan overwrites Configuration.keyword_window_scan
+        '''
+        if not self._frozen:
+            self.freeze()
+
         # Pré filter
-        if self._keywords is None or len(self._keywords) == 0:
+        if len(self._l_keywords) == 0:
             if verbose:
                 Color.pl('{?} {W}Keywords array is empty found to {O}%s{W}\n' % self.id)
             return None
 
-        if self._exclude_keywords is None:
-            self._exclude_keywords = []
-
         if verbose:
             Color.pl('{?} {W}Keywords: {O}%s{W}\n' % ', '.join(self._keywords))
 
-        l_text = text.lower()
-        if not any([
-            k for k in self._keywords
-            if k.lower() in l_text
-        ]):
-            if verbose:
-                Color.pl('{?} {W}None keywords found to {O}%s{W} at text {O}%s{W}\n' % (self.id, text))
-            return None
+        if keyword_hits is None:
+            l_text = text.lower()
+            if not any(k in l_text for k in self._l_keywords):
+                if verbose:
+                    Color.pl('{?} {W}None keywords found to {O}%s{W} at text {O}%s{W}\n' % (self.id, text))
+                return None
+
+        windows = None
+        if keyword_hits is not None and self._window_radius is not None:
+            if window_scan is None:
+                from filecrawler.config import Configuration
+                window_scan = Configuration.keyword_window_scan
+
+            if window_scan:
+                windows = self.get_windows(keyword_hits, len(text))
 
         findings = []
 
         if self._regex is None and verbose:
             Color.pl('{?} {W}Regex is empty.\n')
 
-        for f in self.run_regex(text, self._regex, verbose):
+        for f in self.run_regex(text, self._regex, verbose, windows=windows):
             if f is not None and f not in findings:
-                ignore = next((True for x in self._exclude_keywords if x.lower() in f.lower()), False)
-                if not ignore:
+                l_f = f.lower()
+                if not any(x in l_f for x in self._l_exclude_keywords):
                     findings.append(f)
 
         if len(findings) == 0:
@@ -367,21 +512,25 @@ class RuleBase(object):
         data.update(dict(fingerprint=sha1sum.hexdigest()))
         return data
 
-    def run_regex(self, text: str, regex: Pattern, verbose: bool = False) -> list:
+    def run_regex(self, text: str, regex: Pattern, verbose: bool = False, windows: list = None) -> list:
         findings = []
 
         if regex is None:
             return findings
 
-        for m in regex.finditer(text):
-            if verbose:
-                Color.pl('{?} {W}Match: {O}%s{W}\n' % m)
-            f = None
-            if self._secret_group == 0 and len(m.groups()) == 0:
-                f = m[0]
-            elif len(m.groups()) >= self._secret_group:
-                f = m.group(self._secret_group)
-
-            findings.append(f)
+        if windows is None:
+            windows = [(0, len(text))]
+
+        for start, end in windows:
+            for m in regex.finditer(text, start, end):
+                if verbose:
+                    Color.pl('{?} {W}Match: {O}%s{W}\n' % m)
+                f = None
+                if self._secret_group == 0 and len(m.groups()) == 0:
+                    f = m[0]
+                elif len(m.groups()) >= self._secret_group:
+                    f = m.group(self._secret_group)
+
+                findings.append(f)
 
         return findings
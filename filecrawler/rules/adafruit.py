@@ -11,5 +11,6 @@ class AdafruitAPIKey(RuleBase):
         self._secret_group = 1
         self._regex = self.generate_semi_generic_regex(['adafruit'], self.alpha_numeric_extended_short("32"))
         self._keywords = ["adafruit"]
+        self._window_radius = 100
 
         self._tps = [self.generate_sample_secret("adafruit", self.new_secret(self.alpha_numeric_extended_short("32")))]
\ No newline at end of file
@@ -11,6 +11,7 @@ class AdobeClientID(RuleBase):
         self._secret_group = 1
         self._regex = self.generate_semi_generic_regex(['adobe'], self.hex("32"))
         self._keywords = ["adobe"]
+        self._window_radius = 100
 
         self._tps = [self.generate_sample_secret("adobe", self.new_secret(self.hex("32")))]
 
@@ -22,6 +23,7 @@ class AdobeClientSecret(RuleBase):
 
         self._regex = self.generate_unique_token_regex(r'(p8e-)[a-z0-9]{32}')
         self._keywords = ["p8e-"]
+        self._window_radius = 64
 
         self._tps = ['adobeClient = "p8e-%s"' % self.new_secret(self.hex("32"))]
 
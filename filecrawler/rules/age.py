@@ -10,5 +10,6 @@ class AgeSecretKey(RuleBase):
 
         self._regex = re.compile(r"AGE-SECRET-KEY-1[QPZRY9X8GF2TVDW0S3JN54KHCE6MUA7L]{58}")
         self._keywords = ["AGE-SECRET-KEY-1"]
+        self._window_radius = 100
 
         self._tps = ['apiKey = "AGE-SECRET-KEY-1QQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQQ"']
@@ -10,6 +10,7 @@ class GitHubPat(RuleBase):
 
         self._regex = re.compile(r'ghp_[0-9a-zA-Z]{36}')
         self._keywords = ["ghp_"]
+        self._window_radius = 64
 
         self._tps = [self.generate_sample_secret("github", "ghp_%s" % self.new_secret(self.alpha_numeric(36)))]
 
@@ -21,6 +22,7 @@ class GitHubFineGrainedPat(RuleBase):
 
         self._regex = re.compile(r'github_pat_[0-9a-zA-Z_]{82}')
         self._keywords = ["github_pat_"]
+        self._window_radius = 128
 
         self._tps = [self.generate_sample_secret("github", "github_pat_%s" % self.new_secret(self.alpha_numeric(82)))]
 
@@ -32,6 +34,7 @@ class GitHubOauth(RuleBase):
 
         self._regex = re.compile(r'gho_[0-9a-zA-Z]{36}')
         self._keywords = ["gho_"]
+        self._window_radius = 64
 
         self._tps = [self.generate_sample_secret("github", "gho_%s" % self.new_secret(self.alpha_numeric(36)))]
 
@@ -43,6 +46,7 @@ class GitHubApp(RuleBase):
 
         self._regex = re.compile(r'(ghu|ghs)_[0-9a-zA-Z]{36}')
         self._keywords = ["ghu_", "ghs_"]
+        self._window_radius = 64
 
         self._tps = [
             self.generate_sample_secret("github", "ghu_%s" % self.new_secret(self.alpha_numeric(36))),
@@ -57,6 +61,7 @@ class GitHubRefresh(RuleBase):
 
         self._regex = re.compile(r'ghr_[0-9a-zA-Z]{36}')
         self._keywords = ["ghr_"]
+        self._window_radius = 64
 
         self._tps = [
             self.generate_sample_secret("github", "ghr_%s" % self.new_secret(self.alpha_numeric(36)))
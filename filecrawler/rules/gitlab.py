@@ -10,6 +10,7 @@ class GitlabPat(RuleBase):
 
         self._regex = re.compile(r'glpat-[0-9a-zA-Z\-\_]{20}')
         self._keywords = ["glpat-"]
+        self._window_radius = 64
 
         self._tps = [self.generate_sample_secret("gitlab", "glpat-%s" % self.new_secret(self.alpha_numeric(20)))]
 
@@ -21,6 +22,7 @@ class GitlabPipelineTriggerToken(RuleBase):
 
         self._regex = re.compile(r'glptt-[0-9a-f]{40}')
         self._keywords = ["glptt-"]
+        self._window_radius = 64
 
         self._tps = [self.generate_sample_secret("gitlab", "glptt-%s" % self.new_secret(self.hex(40)))]
 
@@ -32,6 +34,7 @@ class GitlabRunnerRegistrationToken(RuleBase):
 
         self._regex = re.compile(r'GR1348941[0-9a-zA-Z\-\_]{20}')
         self._keywords = ["GR1348941"]
+        self._window_radius = 64
 
         self._tps = [self.generate_sample_secret("gitlab", "GR1348941%s" % self.new_secret(self.alpha_numeric(20)))]
 
@@ -13,6 +13,7 @@ class Leaked1(RuleBase):
         self._regex = re.compile(r"(?i)([a-zA-Z0-9_-]{2,30}@[a-zA-Z0-9._-]{2,256}.[a-zA-Z0-9.]{2,256}):([\S]{1,1024})")
         # (?![A-Za-z0-9:._-])
         self._keywords = ["@", ':']
+        self._window_radius = 1600
         #self._fp_regex = re.compile(r"[a-zA-Z0-9_-]{2,30}://([<]{0,1})(user|username|usuario)([>]{0,1}):([<]{0,1})(pass|password|token|secret|senha|pwd)([>]{0,1})@")
         self._exclude_keywords = [
         ]
@@ -2,12 +2,15 @@
 # -*- coding: UTF-8 -*-
 import base64
 import datetime
+import hashlib
 import os
 import platform
 import string, random, sys, re
 import subprocess
 import tempfile
+import threading
 import time
+from collections import OrderedDict
 from email.message import EmailMessage
 
 import unicodedata
@@ -19,6 +22,26 @@ from filecrawler.libs.color import Color
 
 
 class Tools:
+    # Extensions with an unambiguous mime type, used only when the file starts with the expected signature
+    _EXTENSION_MIMES = {
+        'pdf': (b'%PDF-', 'application/pdf'),
+        'png': (b'\x89PNG\r\n\x1a\n', 'image/png'),
+        'gif': (b'GIF8', 'image/gif'),
+        'jpg': (b'\xff\xd8\xff', 'image/jpeg'),
+        'jpeg': (b'\xff\xd8\xff', 'image/jpeg'),
+        'gz': (b'\x1f\x8b', 'application/gzip'),
+        'bz2': (b'BZh', 'application/x-bzip2'),
+        '7z': (b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    }
+
+    # Mime cache (LRU) keyed by the hash of the sniffed prefix
+    _MIME_CACHE_SIZE = 8192
+    _mime_cache = OrderedDict()
+    _mime_lock = threading.Lock()
+    _mime_stats = dict(calls=0, cache_hits=0, extension_hits=0, magic_calls=0)
+
+    # One libmagic handle per thread, libmagic is not thread safe
+    _magic_local = threading.local()
 
     def __init__(self):
         pass
@@ -275,31 +298,78 @@ class Tools:
 
     @staticmethod
     def get_mime(file_path: str) -> str:
-        return Tools.get_mimes(open(file_path, "rb").read(2048))
+        with open(file_path, "rb") as f:
+            data = f.read(2048)
+
+        return Tools.get_mimes(data, extension=Path(file_path).suffix)
 
     @staticmethod
-    def get_mimes(data: [str, bytes]) -> str:
+    def get_magic():
+        f = getattr(Tools._magic_local, 'magic', None)
+        if f is not None:
+            return f
+
         import magic
         from filecrawler.config import Configuration
 
-        if isinstance(data, str):
-            data = data.encode('utf-8', 'ignore')
-
-        if len(data) > 2048:
-            data = data[:2048]
-
         p = platform.system().lower()
         if p == 'windows':
             f = magic.Magic(mime=True, magic_file=os.path.join(Configuration.lib_path, 'libmagic_windows', 'magic.mgc'))
         else:
             f = magic.Magic(mime=True)
 
+        Tools._magic_local.magic = f
+        return f
+
+    @staticmethod
+    def get_mimes(data: [str, bytes], extension: str = None) -> str:
+        if isinstance(data, str):
+            data = data.encode('utf-8', 'ignore')
+
+        if len(data) > 2048:
+            data = data[:2048]
+
+        if extension is not None:
+            em = Tools._EXTENSION_MIMES.get(extension.strip(' .').lower(), None)
+            if em is not None and data.startswith(em[0]):
+                with Tools._mime_lock:
+                    Tools._mime_stats['calls'] += 1
+                    Tools._mime_stats['extension_hits'] += 1
+                return em[1]
+
+        key = hashlib.blake2b(data, digest_size=16).digest()
+        with Tools._mime_lock:
+            Tools._mime_stats['calls'] += 1
+            mime = Tools._mime_cache.get(key, None)
+            if mime is not None:
+                Tools._mime_cache.move_to_end(key)
+                Tools._mime_stats['cache_hits'] += 1
+                return mime
+
+        f = Tools.get_magic()
         try:
-            return f.from_buffer(data).lower()
+            mime = f.from_buffer(data).lower()
         except Exception as e:
             Tools.print_error(e)
             return 'application/octet-stream'
 
+        with Tools._mime_lock:
+            Tools._mime_stats['magic_calls'] += 1
+            Tools._mime_cache[key] = mime
+            if len(Tools._mime_cache) > Tools._MIME_CACHE_SIZE:
+                Tools._mime_cache.popitem(last=False)
+
+        return mime
+
+    @staticmethod
+    def get_mime_stats() -> dict:
+        with Tools._mime_lock:
+            stats = dict(Tools._mime_stats)
+
+        calls = stats['calls']
+        stats['hit_rate'] = ((stats['cache_hits'] + stats['extension_hits']) / calls) if calls > 0 else 0.0
+        return stats
+
     @staticmethod
     def json_serial(obj):
         """JSON serializer for objects not serializable by default json code"""
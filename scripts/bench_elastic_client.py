@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+'''
+Requests per second of a new Elasticsearch client per call (the old Elastic.must_index and
+Elastic.integrate) against one shared client, on a local stub server.
+
+    python3 scripts/bench_elastic_client.py [threads] [calls per thread]
+'''
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from elasticsearch import Elasticsearch
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Length', str(len(data)) if self.command != 'HEAD' else '0')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def _read(self):
+        size = int(self.headers.get('Content-Length', 0) or 0)
+        if size > 0:
+            self.rfile.read(size)
+
+    def do_GET(self):
+        self._send(200, {'version': {'number': '8.6.2'}, 'tagline': 'You Know, for Search'})
+
+    def do_HEAD(self):
+        # exists: never indexed
+        self._send(404, {})
+
+    def do_PUT(self):
+        self._read()
+        self._send(201, {'result': 'created', '_shards': {'total': 1, 'successful': 1, 'failed': 0}})
+
+    do_POST = do_PUT
+
+
+def run(threads: int, calls: int, get_client, close: bool) -> float:
+    def worker(n):
+        for i in range(calls):
+            es = get_client()
+            try:
+                es.exists(index='bench', id=f'{n}-{i}')
+                es.index(index='bench', id=f'{n}-{i}', document={'content': 'x' * 1024})
+            finally:
+                if close:
+                    es.close()
+
+    start = time.monotonic()
+    tl = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in tl:
+        t.start()
+    for t in tl:
+        t.join()
+
+    return (threads * calls * 2) / (time.monotonic() - start)
+
+
+if __name__ == '__main__':
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    calls = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    nodes = [{'scheme': 'http', 'host': '127.0.0.1', 'port': server.server_address[1]}]
+
+    per_call = run(threads, calls,
+                   lambda: Elasticsearch(nodes, request_timeout=30, max_retries=10, retry_on_timeout=True),
+                   close=True)
+
+    shared_es = Elasticsearch(nodes, request_timeout=30, max_retries=10, retry_on_timeout=True,
+                              connections_per_node=threads + 1)
+    shared = run(threads, calls, lambda: shared_es, close=False)
+    shared_es.close()
+
+    server.shutdown()
+
+    print(f'threads: {threads}, requests: {threads * calls * 2}')
+    print(f'client per call: {per_call:.0f} req/s')
+    print(f'shared client:   {shared:.0f} req/s ({shared / per_call:.1f}x)')
@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+'''
+RuleBase.detect with the whole text scanned against the keyword window scan
+(general.keyword_window_scan). Checks that both modes return the same findings for the tps/fps
+of every rule and for the text files of tests/fakedata, then times them over 1 MB texts.
+
+    PYTHONPATH=. python3 scripts/bench_keyword_window.py [size in KB] [rounds]
+'''
+import random
+import string
+import sys
+import time
+from pathlib import Path
+
+from filecrawler.config import Configuration
+from filecrawler.libs.keywordmatcher import KeywordMatcher
+from filecrawler.rulebase import RuleBase
+
+
+def get_prose(size: int) -> str:
+    words = [''.join(random.choice(string.ascii_lowercase) for _ in range(random.randint(2, 10)))
+             for _ in range(2000)]
+    text = []
+    length = 0
+    while length < size:
+        w = random.choice(words)
+        text.append(w)
+        length += len(w) + 1
+
+    return ' '.join(text)
+
+
+def get_code(size: int) -> str:
+    lines = [
+        'user = config.get("user:%s@example.com")',
+        'mapping = {"key": value, "other": "a:b:c"}',
+        'url = base + "/api/v1/items/" + str(item_id)',
+        'if obj.attr: return obj.method(arg=value)',
+        '    # contact: dev@example.com for details',
+    ]
+    text = []
+    length = 0
+    while length < size:
+        line = random.choice(lines)
+        if '%s' in line:
+            line = line % random.randint(1, 1000)
+        text.append(line)
+        length += len(line) + 1
+
+    return '\n'.join(text)
+
+
+def get_corpora(size: int) -> dict:
+    prose = get_prose(size)
+    urls = ' '.join(
+        w if i % 12 else f'https://host{i}.example.com/path'
+        for i, w in enumerate(prose.split(' '))
+    )
+    return {
+        'single "://" at the top of prose': 'see https://example.com/docs\n' + prose,
+        'source code (dense ":" and "@")': get_code(size),
+        'prose with a URL every ~75 chars': urls,
+    }
+
+
+def check_rules() -> int:
+    checked = 0
+    for rule in RuleBase.list_rules().values():
+        inst = rule.instance
+        if inst.window_radius is None:
+            continue
+
+        matcher = KeywordMatcher(inst.keywords)
+        for t in inst._tps + inst._fps:
+            hits = inst.get_keyword_hits(matcher.search(t))
+            full = inst.run(t, window_scan=False)
+            window = inst.run(t, keyword_hits=hits, window_scan=True) if hits is not None else None
+            if full != window:
+                raise Exception(f'rule {inst.id}: window scan differs for {t!r}: {full} != {window}')
+            checked += 1
+
+    return checked
+
+
+def detect(text: str, window_scan: bool):
+    Configuration.keyword_window_scan = window_scan
+    return RuleBase.detect(text)
+
+
+def check_fakedata() -> int:
+    checked = 0
+    for f in (Path(__file__).resolve().parent.parent / 'tests' / 'fakedata').iterdir():
+        if f.suffix.lower() not in ('.txt', '.java', '.yml', '.sh'):
+            continue
+
+        text = f.read_text(encoding='utf-8', errors='ignore')
+        if detect(text, False) != detect(text, True):
+            raise Exception(f'{f.name}: window scan findings differ')
+        checked += 1
+
+    return checked
+
+
+def timed(text: str, window_scan: bool, rounds: int) -> tuple:
+    result = None
+    start = time.monotonic()
+    for _ in range(rounds):
+        result = detect(text, window_scan)
+
+    return result, (time.monotonic() - start) / rounds
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) * 1024 if len(sys.argv) > 1 else 1024 * 1024
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    random.seed(42)
+    RuleBase.list_rules()
+
+    print(f'rule tps/fps checked: {check_rules()}, identical')
+    print(f'tests/fakedata files checked: {check_fakedata()}, identical')
+
+    print(f'RuleBase.detect over {size // 1024} KB, full vs window scan:')
+    for name, text in get_corpora(size).items():
+        full, t_full = timed(text, False, rounds)
+        window, t_window = timed(text, True, rounds)
+        if full != window:
+            raise Exception(f'{name}: window scan findings differ')
+
+        print(f'  {name:<34} {t_full * 1000:6.0f} ms -> {t_window * 1000:6.0f} ms')
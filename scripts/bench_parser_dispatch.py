@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+'''
+Parser dispatch cost: the old ParserBase.get_parser_instance (two scans over the parsers
+calling Parser.is_valid, a new instance per call) against the dict dispatch. Checks that both
+return the same parser class for a grid of extensions and mime types first.
+
+    PYTHONPATH=. python3 scripts/bench_parser_dispatch.py [lookups]
+'''
+import itertools
+import sys
+import time
+
+from filecrawler.parserbase import ParserBase
+from filecrawler.parsers.default import DefaultParser
+
+
+def old_get_parser_instance(file_extension: str, mime: str):
+    if file_extension is None and mime is None:
+        return DefaultParser()
+
+    if file_extension is None:
+        file_extension = ''
+    else:
+        file_extension = file_extension.strip()
+
+    if mime is None:
+        mime = ''
+    else:
+        mime = mime.strip()
+
+    ParserBase.list_parsers()
+    return next(
+        (
+            p.create_instance() for k, p in ParserBase._parsers.items()
+            if mime != '' and p.is_valid(extension='', mime=mime, mime_only=True)
+        )
+        , next(
+            (
+                p.create_instance() for k, p in ParserBase._parsers.items()
+                if file_extension != '' and p.is_valid(extension=file_extension)
+            )
+            , DefaultParser()
+        )
+    )
+
+
+def get_grid() -> tuple:
+    parsers = ParserBase.list_parsers().values()
+    extensions = sorted({e for p in parsers for e in p.extensions}) + ['txt', 'unknown']
+    mimes = sorted({m for p in parsers for m in p.mime_types}) + ['text/plain', 'application/octet-stream']
+
+    def variants(values: list) -> list:
+        return [None, '', ' '] + [
+            v2 for v in values
+            for v2 in (v, v.upper(), f' {v} ', f'.{v}')
+        ]
+
+    return variants(extensions), variants(mimes)
+
+
+def check() -> int:
+    extensions, mimes = get_grid()
+    checked = 0
+    for ext, mime in itertools.product(extensions, mimes):
+        old = old_get_parser_instance(ext, mime).__class__
+        new = ParserBase.get_parser_instance(ext, mime).__class__
+        if old is not new:
+            raise Exception(f'({ext!r}, {mime!r}): {old.__name__} != {new.__name__}')
+        checked += 1
+
+    return checked
+
+
+def timed(fn, lookups: int) -> float:
+    start = time.monotonic()
+    for _ in range(lookups):
+        fn('yml', 'text/plain')
+
+    return (time.monotonic() - start) * 1000000 / lookups
+
+
+if __name__ == '__main__':
+    lookups = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    ParserBase.list_parsers()
+    print(f'(extension, mime) pairs checked: {check()}, same parser class')
+
+    old = timed(old_get_parser_instance, lookups)
+    new = timed(ParserBase.get_parser_instance, lookups)
+    print("dispatch cost for ('yml', 'text/plain') per million lookups:")
+    print(f'  scan + new instance: {old:6.2f} s')
+    print(f'  dict dispatch:       {new:6.2f} s ({old / new:.0f}x)')
@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+'''
+SQL statements per file and per alert, counted with sqlite3 set_trace_callback: the old
+select_count + INSERT OR IGNORE / UPDATE / select_first against insert_or_get_file and
+insert_or_get_alert (UPSERT ... RETURNING, and the fallback used by SQLite older than 3.35).
+
+    PYTHONPATH=. python3 scripts/count_db_statements.py [files]
+'''
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from filecrawler.config import Configuration
+from filecrawler.libs.crawlerdb import CrawlerDB
+from filecrawler.libs.database import Database
+
+
+class Counter(object):
+    '''
+    Statements run by a connection, transaction control (BEGIN, COMMIT...) not included
+    '''
+
+    def __init__(self, db: CrawlerDB):
+        self.count = 0
+        db.connect_to_db().set_trace_callback(self._trace)
+
+    def _trace(self, statement: str):
+        if statement.strip().split(' ', 1)[0].upper() not in ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE'):
+            self.count += 1
+
+
+def get_file(index_id: int, n: int) -> dict:
+    return dict(index_id=index_id, fingerprint='%040x' % n, filename=f'f{n}.txt', extension='txt',
+                mime_type='text/plain', created=time.time(), last_accessed=time.time(),
+                last_modified=time.time(), indexing_date=time.time(), path_real=f'/f{n}.txt',
+                path_virtual=f'/f{n}.txt', file_size=n, integrated=1)
+
+
+def get_alert(index_id: int, n: int) -> dict:
+    return dict(index_id=index_id, fingerprint='%040x' % n, file_fingerprint='%040x' % n, sent=1, data='')
+
+
+def old_file(db: CrawlerDB, data: dict):
+    # process_file select_count, then the old insert_or_get_file
+    if db.select_count('file_index', index_id=data['index_id'], fingerprint=data['fingerprint']) > 0:
+        return
+
+    db.insert_update_one_exclude('file_index',
+                                 exclude_on_update=['indexing_date', 'created', 'last_accessed', 'last_modified',
+                                                    'filename', 'extension', 'integrated', 'data', 'index_id'],
+                                 **data)
+    db.select_first('file_index', fingerprint=data['fingerprint'])
+
+
+def new_file(db: CrawlerDB, data: dict):
+    # process_file, known files are skipped by the inserted flag
+    db.insert_or_get_file(fetch_existing=False, **data)
+
+
+def old_alert(db: CrawlerDB, data: dict):
+    db.insert_update_one_exclude('alert', exclude_on_update=['file_fingerprint', 'data', 'sent', 'index_id'],
+                                 **data)
+    db.select_first('alert', fingerprint=data['fingerprint'])
+
+
+def new_alert(db: CrawlerDB, data: dict):
+    db.insert_or_get_alert(**data)
+
+
+def measure(name: str, table: str, fn, returning: bool, files: int) -> tuple:
+    Database.RETURNING = returning
+    db_name = os.path.join(tempfile.mkdtemp(), f'{name}.db')
+    with CrawlerDB(auto_create=True, db_name=db_name) as db:
+        index_id = db.insert_or_get_index('statements')
+        get_data = get_file if table == 'file_index' else get_alert
+        counter = Counter(db)
+
+        # First pass: every file is new, second pass: every file is known
+        counts = []
+        for _ in range(2):
+            counter.count = 0
+            for n in range(files):
+                fn(db, get_data(index_id, n))
+            db.commit(db.connect_to_db())
+            counts.append(counter.count / files)
+
+    return counts[0], counts[1]
+
+
+if __name__ == '__main__':
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    Configuration.disable_db = False
+    returning = Database.RETURNING
+
+    print(f'statements per entry over {files} entries (autocommit connection)')
+    for table, modes in [
+        ('file_index', [('old', old_file, False), ('new', new_file, True), ('fallback', new_file, False)]),
+        ('alert', [('old', old_alert, False), ('new', new_alert, True), ('fallback', new_alert, False)]),
+    ]:
+        for name, fn, use_returning in modes:
+            if use_returning and not returning:
+                print(f'  {table:<10} {name:<8} skipped: SQLite {sqlite3.sqlite_version} has no RETURNING')
+                continue
+
+            new, known = measure(f'{table}_{name}', table, fn, use_returning, files)
+            print(f'  {table:<10} {name:<8} {new:.1f} for a new entry, {known:.1f} for a known entry')
+
+    Database.RETURNING = returning
@@ -0,0 +1,177 @@
+import asyncio
+import threading
+import time
+
+from filecrawler.libs.asyncintegrator import AsyncIntegrator
+
+
+class StubServer(object):
+    '''
+    Local asyncio HTTP server: answers every request after a delay and records the highest
+    number of concurrent requests per path
+    '''
+
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.port = 0
+        self.requests = 0
+        self.current = {}
+        self.max_concurrent = {}
+        self._loop = None
+        self._server = None
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, '127.0.0.1', 0))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started.set()
+        self._loop.run_forever()
+        self._server.close()
+        self._loop.run_until_complete(self._server.wait_closed())
+        self._loop.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                path = line.decode().split(' ')[1]
+                size = 0
+                while (header := await reader.readline()) not in (b'\r\n', b''):
+                    name, _, value = header.decode().partition(':')
+                    if name.strip().lower() == 'content-length':
+                        size = int(value.strip())
+                if size > 0:
+                    await reader.readexactly(size)
+
+                self.requests += 1
+                self.current[path] = self.current.get(path, 0) + 1
+                self.max_concurrent[path] = max(self.max_concurrent.get(path, 0), self.current[path])
+                await asyncio.sleep(self.delay)
+                self.current[path] -= 1
+
+                body = b'{"result":"created"}'
+                writer.write(b'HTTP/1.1 201 Created\r\nContent-Type: application/json\r\n'
+                             b'Content-Length: %d\r\n\r\n%s' % (len(body), body))
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+async def http_put(port: int, path: str, body: bytes = b'{}') -> int:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(b'PUT %s HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: %d\r\n\r\n%s' % (
+            path.encode(), len(body), body))
+        await writer.drain()
+        status = int((await reader.readline()).decode().split(' ')[1])
+        size = 0
+        while (header := await reader.readline()) not in (b'\r\n', b''):
+            name, _, value = header.decode().partition(':')
+            if name.strip().lower() == 'content-length':
+                size = int(value.strip())
+        await reader.readexactly(size)
+        return status
+    finally:
+        writer.close()
+
+
+def test_001_many_requests_in_flight():
+    with StubServer(delay=0.1) as server:
+        statuses = []
+
+        async def callback(engine: AsyncIntegrator, entry):
+            destination = f'/index_{entry % 2}/_doc/{entry}'
+            async with engine.limit():
+                async with engine.limit(destination.split('/')[1]):
+                    statuses.append(await http_put(server.port, destination))
+
+        start = time.monotonic()
+        with AsyncIntegrator(callback=callback, max_in_flight=200, per_destination=1000) as engine:
+            engine.start()
+            for i in range(200):
+                assert engine.add_item(i)
+            assert engine.wait_finish(30)
+
+        # 200 requests of 100 ms each, sequentially it would take 20 s
+        assert time.monotonic() - start < 5
+        assert statuses == [201] * 200
+        assert engine.stats['executed'] == 200
+
+
+def test_002_per_destination_limit():
+    with StubServer(delay=0.05) as server:
+        async def callback(engine: AsyncIntegrator, entry):
+            index = f'index_{entry % 2}'
+            async with engine.limit():
+                async with engine.limit(index):
+                    await http_put(server.port, f'/{index}')
+
+        with AsyncIntegrator(callback=callback, max_in_flight=100, per_destination=5) as engine:
+            engine.start()
+            for i in range(100):
+                engine.add_item(i)
+            assert engine.wait_finish(30)
+
+        assert server.requests == 100
+        assert server.max_concurrent['/index_0'] == 5
+        assert server.max_concurrent['/index_1'] == 5
+
+
+def test_003_blocking_calls_with_thread_data():
+    results = []
+
+    def blocking(tcb, value):
+        time.sleep(0.01)
+        return tcb, value
+
+    async def callback(engine: AsyncIntegrator, entry):
+        results.append(await engine.run_blocking(blocking, entry))
+
+    with AsyncIntegrator(callback=callback, per_thread_callback=lambda index: f'thread-{index}',
+                         blocking_threads=2) as engine:
+        engine.start()
+        for i in range(10):
+            engine.add_item(i)
+        assert engine.wait_finish(30)
+
+    assert sorted(v for _, v in results) == list(range(10))
+    assert {t for t, _ in results} <= {'thread-0', 'thread-1'}
+
+
+def test_004_queue_size_and_close():
+    release = threading.Event()
+
+    async def callback(engine: AsyncIntegrator, entry):
+        while not release.is_set():
+            await asyncio.sleep(0.01)
+
+    engine = AsyncIntegrator(callback=callback, queue_size=2)
+    engine.start()
+    assert engine.add_item(1)
+    assert engine.add_item(2)
+
+    # The third item waits for a free slot, then the engine is closed
+    added = []
+    t = threading.Thread(target=lambda: added.append(engine.add_item(3)))
+    t.start()
+    time.sleep(0.3)
+    assert added == []
+
+    engine.close()
+    t.join(5)
+    assert added == [False]
+    assert not engine.running
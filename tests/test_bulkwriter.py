@@ -0,0 +1,205 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from elasticsearch import Elasticsearch
+
+from filecrawler.libs.bulkwriter import BulkWriter
+
+
+class StubBulkHandler(BaseHTTPRequestHandler):
+    '''
+    Minimal elasticsearch: answers the _bulk endpoint, the status of each document comes from
+    its _id ("fail-400-..." and "fail-429-..." are rejected)
+    '''
+    requests = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._send(200, {'version': {'number': '8.6.2'}, 'tagline': 'You Know, for Search'})
+
+    def do_HEAD(self):
+        self._send(200, {})
+
+    def do_POST(self):
+        if not self.path.startswith('/_bulk'):
+            self._send(404, {'error': 'not found'})
+            return
+
+        lines = [
+            json.loads(line)
+            for line in self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8').split('\n')
+            if line.strip() != ''
+        ]
+        StubBulkHandler.requests.append(lines)
+
+        items = []
+        i = 0
+        while i < len(lines):
+            op, meta = next(iter(lines[i].items()))
+            i += 1 if op == 'delete' else 2
+
+            status = 201
+            if str(meta.get('_id', '')).startswith('fail-'):
+                status = int(str(meta['_id']).split('-')[1])
+
+            item = dict(_index=meta.get('_index'), _id=meta.get('_id'), status=status)
+            if status >= 300:
+                item['error'] = dict(type='stub_exception', reason=f'rejected with {status}')
+            items.append({op: item})
+
+        self._send(200, dict(took=1, errors=any(next(iter(it.values()))['status'] >= 300 for it in items),
+                             items=items))
+
+    # elasticsearch-py 8 sends the bulk requests with PUT
+    do_PUT = do_POST
+
+
+def start_server() -> ThreadingHTTPServer:
+    StubBulkHandler.requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubBulkHandler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
+
+
+def get_writer(server: ThreadingHTTPServer, **kwargs) -> BulkWriter:
+    es = Elasticsearch(f'http://127.0.0.1:{server.server_address[1]}', max_retries=0)
+    return BulkWriter(lambda operations: es.bulk(operations=operations), **kwargs)
+
+
+def get_group(id: str) -> list:
+    return [
+        ({'index': {'_index': 'test', '_id': id}}, {'fingerprint': id, 'content': 'content ' + id}),
+        ({'index': {'_index': '.ctrl_test', '_id': id}}, {'fingerprint': id}),
+    ]
+
+
+def test_001_flush_on_bulk_size():
+    server = start_server()
+    try:
+        results = {}
+        with get_writer(server, bulk_size=2, flush_interval=60) as bulk:
+            for id in ['a', 'b', 'c']:
+                bulk.add(get_group(id), callback=lambda ok, retry, error, id=id: results.update({id: ok}))
+
+            # a and b are sent together, c waits for more documents
+            assert len(StubBulkHandler.requests) == 1
+            assert len(StubBulkHandler.requests[0]) == 8
+            assert results == {'a': True, 'b': True}
+
+        # close sends the rest
+        assert len(StubBulkHandler.requests) == 2
+        assert results == {'a': True, 'b': True, 'c': True}
+        assert bulk.sent == 3 and bulk.failed == 0 and bulk.requests == 2
+    finally:
+        server.shutdown()
+
+
+def test_002_item_failures():
+    server = start_server()
+    try:
+        results = {}
+        with get_writer(server, bulk_size=10, flush_interval=60) as bulk:
+            for id in ['ok-1', 'fail-400-1', 'fail-429-1', 'ok-2']:
+                bulk.add(get_group(id), callback=lambda ok, retry, error, id=id: results.update({id: (ok, retry)}))
+
+        assert len(StubBulkHandler.requests) == 1
+        assert results == {
+            'ok-1': (True, False),
+            'fail-400-1': (False, False),
+            'fail-429-1': (False, True),
+            'ok-2': (True, False),
+        }
+        assert bulk.sent == 2 and bulk.failed == 2
+    finally:
+        server.shutdown()
+
+
+def test_003_flush_on_interval():
+    server = start_server()
+    try:
+        done = threading.Event()
+        with get_writer(server, bulk_size=100, flush_interval=0.2) as bulk:
+            bulk.add(get_group('a'), callback=lambda ok, retry, error: done.set())
+            assert done.wait(5)
+            assert len(StubBulkHandler.requests) == 1
+    finally:
+        server.shutdown()
+
+
+def test_004_flush_on_byte_size():
+    server = start_server()
+    try:
+        with get_writer(server, bulk_size=100, byte_size=1024, flush_interval=60) as bulk:
+            bulk.add([({'index': {'_index': 'test', '_id': 'big'}}, {'content': 'x' * 2048})])
+            assert len(StubBulkHandler.requests) == 1
+    finally:
+        server.shutdown()
+
+
+def test_005_connection_error_is_retried():
+    server = start_server()
+    port = server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+    es = Elasticsearch(f'http://127.0.0.1:{port}', max_retries=0)
+    results = []
+    with BulkWriter(lambda operations: es.bulk(operations=operations), flush_interval=60) as bulk:
+        bulk.add(get_group('a'), callback=lambda ok, retry, error: results.append((ok, retry)))
+
+    assert results == [(False, True)]
+
+
+def test_006_failure_back_to_file_index():
+    from filecrawler.cmd.elastic import Elastic
+    from filecrawler.config import Configuration
+    from filecrawler.libs.crawlerdb import CrawlerDB
+    from filecrawler.libs.dbwriter import DBWriter
+    from filecrawler.libs.payload import Payload
+
+    Configuration.disable_db = False
+    Configuration.continue_on_error = False
+
+    db_name = os.path.join(tempfile.mkdtemp(), 'bulk.db')
+    with CrawlerDB(auto_create=True, db_name=db_name) as db:
+        index_id = db.insert_or_get_index('bulk')
+        data = dict(fingerprint='f' * 40, filename='a.txt', extension='txt', mime_type='text/plain',
+                    created=time.time(), last_accessed=time.time(), last_modified=time.time(),
+                    indexing_date=time.time(), path_real='/a.txt', path_virtual='/a.txt', file_size=1)
+        db.insert_or_get_file(**data, index_id=index_id, integrated=1)
+
+    writer = DBWriter(db_name)
+    writer.start()
+    try:
+        elastic = Elastic()
+        elastic.index_id = index_id
+        elastic.db_writer = writer
+
+        # Temporary failure: queued again, the crawl continues
+        elastic.bulk_callback(dict(data, content='abc'), False, True, Exception('429'))
+        assert elastic._bulk_error is None
+    finally:
+        writer.close()
+
+    with CrawlerDB(auto_create=False, db_name=db_name) as db:
+        row = db.select_first('file_index', index_id=index_id, fingerprint=data['fingerprint'])
+        assert row['integrated'] == 0
+        assert Payload.decode(row['data'])['content'] == 'abc'
+        assert db.select_count('integration_outbox', file_id=row['file_id']) == 1
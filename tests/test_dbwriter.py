@@ -0,0 +1,62 @@
+import os
+import sqlite3
+import tempfile
+import threading
+
+from filecrawler.config import Configuration
+from filecrawler.libs.crawlerdb import CrawlerDB
+from filecrawler.libs.dbwriter import DBWriter
+
+
+def get_db_name() -> str:
+    Configuration.disable_db = False
+    db_name = os.path.join(tempfile.mkdtemp(), 'writer.db')
+    with CrawlerDB(auto_create=True, db_name=db_name):
+        pass
+    return db_name
+
+
+def execute(writer: DBWriter, *args) -> dict:
+    # Run in a thread, a writer that never answers fails the test instead of hanging it
+    result = dict(value=None, error=None)
+
+    def run():
+        try:
+            result['value'] = writer.execute(*args)
+        except Exception as e:
+            result['error'] = e
+
+    t = threading.Thread(target=run)
+    t.daemon = True
+    t.start()
+    t.join(timeout=10)
+    assert not t.is_alive(), 'execute did not return'
+    return result
+
+
+def test_001_change_error_keeps_writer():
+    with DBWriter(get_db_name()) as writer:
+        assert execute(writer, 'insert_or_get_index', 'a')['value'] is not None
+        assert isinstance(execute(writer, 'no_such_method')['error'], AttributeError)
+        assert execute(writer, 'insert_or_get_index', 'b')['value'] is not None
+
+
+def test_002_transaction_error_stops_writer():
+    class FailingWriter(DBWriter):
+        @staticmethod
+        def _apply(db, conn, change):
+            raise sqlite3.OperationalError('disk I/O error')
+
+    writer = FailingWriter(get_db_name())
+    writer.start()
+    try:
+        result = execute(writer, 'insert_or_get_index', 'a')
+        assert isinstance(result['error'], sqlite3.OperationalError)
+
+        # The writer thread is gone, the next changes fail instead of waiting forever
+        writer._thread.join(timeout=10)
+        result = execute(writer, 'insert_or_get_index', 'b')
+        assert result['error'] is not None
+        assert isinstance(result['error'].args[1], sqlite3.OperationalError)
+    finally:
+        writer.close()
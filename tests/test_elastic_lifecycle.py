@@ -0,0 +1,255 @@
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+from filecrawler.cmd.elastic import Elastic
+from filecrawler.config import Configuration
+from filecrawler.libs.crawlerdb import CrawlerDB
+
+
+class StubIndicesHandler(BaseHTTPRequestHandler):
+    '''
+    Minimal elasticsearch for the index lifecycle: indices, aliases, templates, settings,
+    refresh and rollover. Every request is kept as (method, path, body)
+    '''
+    protocol_version = 'HTTP/1.1'
+    requests = []
+    indices = set()
+    aliases = {}
+    rolled_over = False
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Length', str(len(data)) if self.command != 'HEAD' else '0')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def _handle(self):
+        size = int(self.headers.get('Content-Length', 0) or 0)
+        body = json.loads(self.rfile.read(size)) if size > 0 else None
+        path = unquote(urlparse(self.path).path)
+        StubIndicesHandler.requests.append((self.command, path, body))
+        parts = path.strip('/').split('/')
+
+        if path == '/':
+            return self._send(200, {'version': {'number': '8.6.2'}, 'tagline': 'You Know, for Search'})
+
+        if self.command == 'HEAD' and parts[0] == '_alias':
+            return self._send(200 if parts[1] in StubIndicesHandler.aliases else 404, {})
+
+        if self.command == 'HEAD':
+            found = parts[0] in StubIndicesHandler.indices or parts[0] in StubIndicesHandler.aliases
+            return self._send(200 if found else 404, {})
+
+        if parts[0] == '_index_template':
+            return self._send(200, {'acknowledged': True})
+
+        if len(parts) == 1 and self.command == 'PUT':
+            StubIndicesHandler.indices.add(parts[0])
+            for alias in (body or {}).get('aliases', {}).keys():
+                StubIndicesHandler.aliases[alias] = parts[0]
+            return self._send(200, {'acknowledged': True, 'index': parts[0]})
+
+        if parts[-1] == '_rollover':
+            old_index = StubIndicesHandler.aliases[parts[0]]
+            if not StubIndicesHandler.rolled_over:
+                return self._send(200, dict(old_index=old_index, new_index=old_index, rolled_over=False))
+
+            new_index = '%s-%06d' % (parts[0], int(old_index.rsplit('-', 1)[1]) + 1)
+            StubIndicesHandler.indices.add(new_index)
+            StubIndicesHandler.aliases[parts[0]] = new_index
+            return self._send(200, dict(old_index=old_index, new_index=new_index, rolled_over=True))
+
+        if parts[-1] == '_search':
+            return self._send(200, {'hits': {'total': {'value': 0}, 'hits': []}})
+
+        if parts[-1] in ('_settings', '_refresh'):
+            return self._send(200, {'acknowledged': True, '_shards': {'total': 1, 'successful': 1, 'failed': 0}})
+
+        self._send(404, {'error': f'not found: {self.command} {path}'})
+
+    do_GET = _handle
+    do_HEAD = _handle
+    do_PUT = _handle
+    do_POST = _handle
+
+
+def start_server(indices: list = None) -> ThreadingHTTPServer:
+    StubIndicesHandler.requests = []
+    StubIndicesHandler.indices = set(indices or [])
+    StubIndicesHandler.aliases = {}
+    StubIndicesHandler.rolled_over = False
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubIndicesHandler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
+
+
+def get_elastic(server: ThreadingHTTPServer, **kwargs) -> Elastic:
+    Configuration.index_name = 'crawl'
+    elastic = Elastic()
+    elastic.nodes = [{'scheme': 'http', 'host': '127.0.0.1', 'port': server.server_address[1]}]
+    elastic.bulk_size = 0
+    elastic.number_of_replicas = 2
+    elastic.refresh_interval = '30s'
+    for k, v in kwargs.items():
+        setattr(elastic, k, v)
+    return elastic
+
+
+def get_requests(method: str, suffix: str) -> list:
+    return [(path, body) for m, path, body in StubIndicesHandler.requests if m == method and path.endswith(suffix)]
+
+
+def test_001_bulk_load_settings():
+    server = start_server(indices=['crawl'])
+    try:
+        elastic = get_elastic(server, bulk_load=True)
+        elastic.pre_run()
+
+        # New indices are created with the load settings
+        created = {path: body for path, body in get_requests('PUT', '') if body is not None and 'settings' in body}
+        for name in ('/crawl_credentials', '/.ctrl_crawl'):
+            assert created[name]['settings']['number_of_replicas'] == 0
+            assert created[name]['settings']['refresh_interval'] == '-1'
+
+        # and every index, also the existing one, is switched to them
+        names = '/crawl,crawl_credentials,.ctrl_crawl/_settings'
+        assert get_requests('PUT', '/_settings') == [
+            (names, {'number_of_replicas': 0, 'refresh_interval': '-1'})
+        ]
+        StubIndicesHandler.requests = []
+
+        elastic.post_run()
+
+        assert get_requests('PUT', '/_settings') == [
+            (names, {'number_of_replicas': 2, 'refresh_interval': '30s'})
+        ]
+        assert [p for p, _ in get_requests('POST', '/_refresh')] == ['/crawl,crawl_credentials,.ctrl_crawl/_refresh']
+
+        # Already restored: a second post_run does not touch the settings
+        StubIndicesHandler.requests = []
+        elastic.post_run()
+        assert get_requests('PUT', '/_settings') == []
+    finally:
+        server.shutdown()
+
+
+def test_002_no_bulk_load():
+    server = start_server()
+    try:
+        elastic = get_elastic(server)
+        elastic.pre_run()
+        elastic.post_run()
+
+        created = {path: body for path, body in get_requests('PUT', '') if body is not None and 'settings' in body}
+        assert created['/crawl']['settings']['number_of_replicas'] == 2
+        assert created['/crawl']['settings']['refresh_interval'] == '30s'
+        assert get_requests('PUT', '/_settings') == []
+        assert get_requests('POST', '/_refresh') == []
+    finally:
+        server.shutdown()
+
+
+def test_003_settings_restored_after_run_error():
+    class FailingElastic(Elastic):
+        def _list_objects(self, *args, **kwargs):
+            raise RuntimeError('crawl interrupted')
+
+    base = tempfile.mkdtemp()
+    Configuration.db_name = os.path.join(base, 'lifecycle.db')
+    Configuration.path = base
+    Configuration.disable_db = False
+    with CrawlerDB(auto_create=True, db_name=Configuration.db_name):
+        pass
+
+    server = start_server()
+    try:
+        elastic = get_elastic(server, bulk_load=True)
+        elastic.__class__ = FailingElastic
+
+        try:
+            elastic.run()
+            assert False, 'run() must raise'
+        except RuntimeError as e:
+            assert str(e) == 'crawl interrupted'
+
+        settings = get_requests('PUT', '/_settings')
+        assert [body for _, body in settings] == [
+            {'number_of_replicas': 0, 'refresh_interval': '-1'},
+            {'number_of_replicas': 2, 'refresh_interval': '30s'},
+        ]
+        assert len(get_requests('POST', '/_refresh')) == 1
+    finally:
+        server.shutdown()
+
+
+def test_004_rollover_alias_and_template():
+    server = start_server()
+    try:
+        elastic = get_elastic(server, bulk_load=True,
+                              rollover=dict(enabled=True, max_docs=1000, max_primary_shard_size='50gb',
+                                            max_age='', check_interval=60.0))
+        elastic.pre_run()
+
+        # Templates hold the configured settings, used by the indices created after the load
+        templates = dict(get_requests('PUT', '_template'))
+        template = templates['/_index_template/crawl_template']
+        assert template['index_patterns'] == ['crawl-*']
+        assert template['template']['settings']['number_of_replicas'] == 2
+        assert template['template']['settings']['refresh_interval'] == '30s'
+        assert 'content' in template['template']['mappings']['properties']
+        assert templates['/_index_template/crawl_credentials_template']['index_patterns'] == ['crawl_credentials-*']
+
+        # The first backing index has the write alias and the load settings
+        created = dict(get_requests('PUT', '-000001'))
+        assert created['/crawl-000001']['aliases'] == {'crawl': {'is_write_index': True}}
+        assert created['/crawl-000001']['settings']['number_of_replicas'] == 0
+        assert created['/crawl_credentials-000001']['aliases'] == {'crawl_credentials': {'is_write_index': True}}
+
+        # The control index is never rolled over
+        assert '/.ctrl_crawl' in dict(get_requests('PUT', ''))
+        assert '/_index_template/.ctrl_crawl_template' not in templates
+
+        StubIndicesHandler.rolled_over = True
+        elastic.rollover_indices()
+        rollovers = dict(get_requests('POST', '/_rollover'))
+        assert rollovers['/crawl/_rollover'] == {
+            'conditions': {'max_docs': 1000, 'max_primary_shard_size': '50gb'},
+            'settings': {'number_of_replicas': 0, 'refresh_interval': '-1'}
+        }
+        assert StubIndicesHandler.aliases['crawl'] == 'crawl-000002'
+
+        elastic.post_run()
+
+        # The aliases update every backing index
+        assert get_requests('PUT', '/_settings')[-1] == (
+            '/crawl,crawl_credentials,.ctrl_crawl/_settings', {'number_of_replicas': 2, 'refresh_interval': '30s'})
+    finally:
+        server.shutdown()
+
+
+def test_005_existing_index_without_alias():
+    server = start_server(indices=['crawl'])
+    try:
+        elastic = get_elastic(server, rollover=dict(enabled=True, max_docs=1000, max_primary_shard_size='',
+                                                    max_age='', check_interval=60.0))
+        elastic.pre_run()
+        elastic.post_run()
+
+        # Kept as a single index: no backing index and no rollover for it
+        assert '/crawl-000001' not in dict(get_requests('PUT', ''))
+        assert elastic._rollover_aliases == ['crawl_credentials']
+    finally:
+        server.shutdown()
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import time
+
+from filecrawler.config import Configuration
+from filecrawler.crawlerbase import CrawlerBase
+from filecrawler.libs.crawlerdb import CrawlerDB
+from filecrawler.libs.payload import Payload
+
+
+class RecordCrawler(CrawlerBase):
+    '''
+    Crawler module keeping the data of every file integrated
+    '''
+
+    def __init__(self):
+        super().__init__('record', 'Record integrated files')
+        self.received = []
+
+    def pre_run(self, **data):
+        pass
+
+    def integrate(self, **data):
+        self.received.append(data)
+
+
+def test_001_pending_payload_survives_restart():
+    base = tempfile.mkdtemp()
+    crawl_path = os.path.join(base, 'empty')
+    os.mkdir(crawl_path)
+
+    Configuration.db_name = os.path.join(base, 'outbox.db')
+    Configuration.index_name = 'outbox'
+    Configuration.path = crawl_path
+    Configuration.disable_db = False
+    Configuration.continue_on_error = False
+
+    # A crawl interrupted before its pending file was integrated
+    data = dict(fingerprint='f' * 40, filename='a.txt', extension='txt', mime_type='text/plain',
+                created=time.time(), last_accessed=time.time(), last_modified=time.time(),
+                indexing_date=time.time(), path_real='/a.txt', path_virtual='/a.txt', file_size=3)
+    with CrawlerDB(auto_create=True, db_name=Configuration.db_name) as db:
+        index_id = db.insert_or_get_index(Configuration.index_name)
+        row = db.insert_or_get_file(**data, index_id=index_id, integrated=0)
+        db.set_pending(index_id, row['file_id'], Payload.encode(dict(data, content='abc')))
+
+    crawler = RecordCrawler()
+    crawler.run()
+
+    assert len(crawler.received) == 1
+    assert crawler.received[0]['fingerprint'] == data['fingerprint']
+    assert crawler.received[0]['content'] == 'abc'
+
+    with CrawlerDB(auto_create=False, db_name=Configuration.db_name) as db:
+        row = db.select_first('file_index', index_id=index_id, fingerprint=data['fingerprint'])
+        assert row['integrated'] == 1
+        assert db.select_count('integration_outbox', file_id=row['file_id']) == 0
+
+
+def test_002_integrated_payloads_stay_cleared():
+    base = tempfile.mkdtemp()
+    crawl_path = os.path.join(base, 'empty')
+    os.mkdir(crawl_path)
+
+    Configuration.db_name = os.path.join(base, 'cleared.db')
+    Configuration.index_name = 'cleared'
+    Configuration.path = crawl_path
+    Configuration.disable_db = False
+
+    # Integrated file of an older version, still holding its base64 payload
+    data = dict(fingerprint='e' * 40, filename='b.txt', extension='txt', mime_type='text/plain',
+                created=time.time(), last_accessed=time.time(), last_modified=time.time(),
+                indexing_date=time.time(), path_real='/b.txt', path_virtual='/b.txt', file_size=3)
+    with CrawlerDB(auto_create=True, db_name=Configuration.db_name) as db:
+        index_id = db.insert_or_get_index(Configuration.index_name)
+        db.insert_or_get_file(**data, index_id=index_id, integrated=1)
+        db.select_raw(sql="update file_index set data = 'e30=' where index_id = ?", args=[index_id])
+        db.connect_to_db().commit()
+        assert db.migrate_payloads()['cleared'] == 1
+
+    for _ in range(2):
+        RecordCrawler().run()
+
+        # Nothing left for the migration to rewrite on the next start
+        with CrawlerDB(auto_create=False, db_name=Configuration.db_name) as db:
+            assert db.migrate_payloads() == dict(cleared=0, migrated=0, failed=0)
+            assert db.select_first('file_index', index_id=index_id, fingerprint=data['fingerprint'])['data'] is None